@@ -2,13 +2,23 @@ import os
 import logging
 import secrets
 import json
-import ccxt
 from dotenv import load_dotenv
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for, send_from_directory
+from flask import Flask, render_template, jsonify, request, session, redirect, url_for, send_from_directory, Response, stream_with_context
 import threading
 from datetime import datetime
 import pandas as pd
 from telegram_notifications import TelegramNotifier
+from exchange_gateway import get_exchange
+from contract_index import contract_index, CONTRACTS_URL
+from price_book import price_book, TICKERS_URL
+from state_store import state_store
+from state_watcher import state_watcher
+from engine_lease import engine_lease, engine_snapshot, ENGINE_LEASE_RETRY
+from status_snapshot import status_snapshot, STATUS_TICK
+from single_flight import SingleFlightRefresher
+from gainers_ranking import gainers_ranking
+from gecko_ranks import gecko_ranks
+import backtest as backtest_engine
 
 load_dotenv()
 
@@ -49,13 +59,10 @@ state = {
     "trading_symbol": "PIPPIN_USDT"
 }
 
-# ✅ Load trades from file immediately on startup
+# ✅ Load trades from the state store immediately on startup
 try:
-    with open("goldantelopegate_v1.0_state.json", "r") as f:
-        _saved_state = json.load(f)
-        if "trades" in _saved_state:
-            state["trades"] = _saved_state["trades"]
-            print(f"✅ APP.PY: Loaded {len(state['trades'])} trades from state file")
+    state["trades"] = state_store.get_trades()
+    print(f"✅ APP.PY: Loaded {len(state['trades'])} trades from state store")
 except Exception as e:
     print(f"⚠️ APP.PY: Could not load trades: {e}")
 
@@ -76,13 +83,10 @@ strategy_config = {
     'close_levels': ['5m']
 }
 
-# ✅ Load strategy_config from state file on startup
+# ✅ Load strategy_config from the state store on startup
 try:
-    with open("goldantelopegate_v1.0_state.json", "r") as f:
-        _saved_state = json.load(f)
-        if "strategy_config" in _saved_state:
-            strategy_config = _saved_state["strategy_config"]
-            print(f"✅ APP.PY: Loaded strategy from state: OPEN={strategy_config.get('open_levels')}, CLOSE={strategy_config.get('close_levels')}")
+    strategy_config = state_store.get_strategy_config()
+    print(f"✅ APP.PY: Loaded strategy from state: OPEN={strategy_config.get('open_levels')}, CLOSE={strategy_config.get('close_levels')}")
 except Exception as e:
     print(f"⚠️ APP.PY: Could not load strategy config: {e}")
 
@@ -102,23 +106,16 @@ def update_positions_cache():
             api_key = os.getenv('GATE_API_KEY', '').strip()
             api_secret = os.getenv('GATE_API_SECRET', '').strip()
             if api_key and api_secret:
-                ex = ccxt.gateio({
-                    'apiKey': api_key,
-                    'secret': api_secret,
-                    'sandbox': False,
-                    'enableRateLimit': True,
-                    'options': {'defaultType': 'swap'}
-                })
+                ex = get_exchange(api_key, api_secret)
                 # Fetch positions with contract size
                 positions = ex.fetch_positions()
-                markets = ex.load_markets()
                 real_pos = None
                 for pos in positions:
                     if pos.get('contracts') != 0:
                         symbol = pos['symbol']
                         symbol_clean = symbol.split(':')[0].replace('/', '_')
-                        # Get contract size from market info
-                        contract_size = markets.get(symbol, {}).get('contractSize', 1)
+                        # Get contract size from the contract index (no load_markets)
+                        contract_size = contract_index.contract_size(symbol_clean, 1)
                         contracts = float(pos['contracts'])
                         mark_price = float(pos['markPrice'])
                         # Correct notional = contracts × contract_size × price
@@ -155,6 +152,7 @@ def update_positions_cache():
                 cached_positions['balance'] = usdt_free
                 cached_positions['total_balance'] = usdt_total
                 cached_positions['timestamp'] = time_module.time()
+                engine_snapshot.publish(positions=cached_positions)
                 if real_pos:
                     logging.info(f"✅ POSITION CACHE: {symbol_clean} {real_pos['side'].upper()} | Balance: ${usdt_total:.2f}")
                 else:
@@ -163,15 +161,48 @@ def update_positions_cache():
             logging.debug(f"Position cache update error: {e}")
         time_module.sleep(5)
 
-# Start background cache updater
-positions_cache_thread = threading.Thread(target=update_positions_cache, daemon=True)
-positions_cache_thread.start()
+# State snapshot: reloaded from the store only when its files change (inotify / mtime)
+state_watcher.start()
 
 # Черный список - пары которые удалены из торговли
 BLACKLISTED_SYMBOLS = {'PIPPIN_USDT'}
 
 # ✅ NOW import TradingBot AFTER state is defined!
-from trading_bot import TradingBot
+from trading_bot import TradingBot, candle_cache, psar_scanner, chart_psar_book, USE_SIMULATOR
+from market_stream import MarketStream, WS_TOP_N, to_ccxt_symbol
+
+# Market data stream: WebSocket tickers/candles feed price_book and candle_cache, REST stays the fallback
+USE_MARKET_STREAM = os.getenv('USE_MARKET_STREAM', '1') == '1'
+market_stream = MarketStream(price_book, candle_cache, record_path=os.getenv('GATE_WS_RECORD') or None)
+
+def on_market_stream_tick(kind, symbol, data):
+    """Route live ticks to the running bot (SAR flip -> immediate level re-check)"""
+    if bot_instance is not None:
+        bot_instance.on_stream_tick(kind, symbol, data)
+
+market_stream.add_listener(on_market_stream_tick)
+
+# ✅ Engine snapshot: workers without the engine lease read pollers' data published by the leader
+_engine_snapshot_seen = None
+
+def sync_engine_snapshot():
+    """Refresh positions, top gainers, prices and bot status from the leader's snapshot (followers only)"""
+    global _engine_snapshot_seen, current_trading_symbol, bot_running
+    if engine_lease.is_leader:
+        return
+    snapshot = engine_snapshot.read()
+    if not snapshot or snapshot.get('published_at') == _engine_snapshot_seen:
+        return
+    _engine_snapshot_seen = snapshot.get('published_at')
+    if 'positions' in snapshot:
+        cached_positions.update(snapshot['positions'])
+    if 'top_gainers' in snapshot:
+        top_gainers_cache.update(snapshot['top_gainers'])
+        gainers_ranking.load(top_gainers_cache['data'], top_gainers_cache.get('version'))
+    if 'prices' in snapshot:
+        price_book.load_export(snapshot['prices'])
+    current_trading_symbol = snapshot.get('current_trading_symbol', current_trading_symbol)
+    bot_running = snapshot.get('bot_running', bot_running)
 
 # Store API credentials in session
 def require_auth(f):
@@ -186,13 +217,7 @@ def require_auth(f):
 def validate_api_credentials(api_key, api_secret):
     """Validate API credentials by connecting to Gate.io"""
     try:
-        exchange = ccxt.gateio({
-            'apiKey': api_key,
-            'secret': api_secret,
-            'sandbox': False,
-            'enableRateLimit': True,
-            'options': {'defaultType': 'swap'}
-        })
+        exchange = get_exchange(api_key, api_secret)
         # Try to fetch account balance to verify credentials
         balance = exchange.fetch_balance()
         return True, balance
@@ -210,6 +235,13 @@ def get_top_trading_symbol():
         return current_trading_symbol
     
     try:
+        # Сканер PSAR: первый топ-гейнер, у которого все open_levels совпадают
+        pick = psar_scanner.pick(state_watcher.strategy_config().get('open_levels', []))
+        if pick and pick[0] not in BLACKLISTED_SYMBOLS:
+            if pick[0] != current_trading_symbol:
+                logging.info(f"🔄 Switching to top aligned pair: {pick[0]} ({pick[1].upper()})")
+            current_trading_symbol = pick[0]
+            return pick[0]
         if top_gainers_cache['data'] and len(top_gainers_cache['data']) > 0:
             # Ищем первый символ с ASCII буквами (не китайский) и не в черном списке
             for pair in top_gainers_cache['data']:
@@ -478,7 +510,9 @@ def api_online_users():
 
 @app.after_request
 def add_cache_control(response):
-    """Disable caching for all responses"""
+    """Disable caching for all responses (except those that revalidate with an ETag, e.g. /api/status)"""
+    if response.get_etag()[0] is not None:
+        return response
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
@@ -536,244 +570,241 @@ def api_verify_referral():
         logging.error(f"Referral verification error: {e}")
         return jsonify({'error': str(e), 'verified': False}), 500
 
-@app.route('/api/status')
-def api_status():
-    """Получение текущего статуса бота"""
+def sync_shared_state():
+    """Sync this worker's state with the store (in-memory snapshot, reloaded only when the store changes)"""
+    global api_connected_global
     try:
-        global top_gainers_cache, cached_positions, state
-        
-        # CRITICAL: Always reload state from file to sync across Gunicorn workers
-        global api_connected_global
+        file_state = state_watcher.state()
+        state['in_position'] = file_state.get('in_position', False)
+        state['position'] = file_state.get('position')
+        state['balance'] = file_state.get('balance', 100.0)
+        state['available'] = file_state.get('available', 100.0)
+        state['trades'] = file_state.get('trades', [])
+        state['api_connected'] = file_state.get('api_connected', False)
+        state['trading_mode'] = file_state.get('trading_mode', 'demo')
+        # ✅ SYNC global variable with stored state
+        api_connected_global = state['api_connected']
+    except Exception as e:
+        logging.debug(f"Could not reload state from store: {e}")
+
+def build_status_payload():
+    """Собрать payload /api/status из кэшей (позиции/баланс - из update_positions_cache, без запросов к бирже)"""
+    global top_gainers_cache, cached_positions, state
+    sync_shared_state()
+    
+    directions = {}
+    current_price = 3000.0
+    unrealized_pnl = 0.0
+    
+    # Use ONLY data_fetcher to avoid creating new bot instances
+    fetcher = data_fetcher
+    if fetcher:
         try:
-            with open('goldantelopegate_v1.0_state.json', 'r') as f:
-                file_state = json.load(f)
-                state['in_position'] = file_state.get('in_position', False)
-                state['position'] = file_state.get('position')
-                state['balance'] = file_state.get('balance', 100.0)
-                state['available'] = file_state.get('available', 100.0)
-                state['trades'] = file_state.get('trades', [])
-                state['api_connected'] = file_state.get('api_connected', False)
-                state['trading_mode'] = file_state.get('trading_mode', 'demo')
-                # ✅ SYNC global variable with file state
-                api_connected_global = state['api_connected']
+            directions = fetcher.get_current_directions()
+            current_price = fetcher.get_current_price()
+            unrealized_pnl = fetcher.calculate_unrealized_pnl()
         except Exception as e:
-            logging.debug(f"Could not reload state from file: {e}")
-        
-        # Refresh TOP1 price if cache is older than 10 seconds
-        if time.time() - top_gainers_cache['timestamp'] > 10:
-            threading.Thread(target=fetch_top_gainers_background, daemon=True).start()
-        
-        directions = {}
-        current_price = 3000.0
-        unrealized_pnl = 0.0
-        
-        # Use ONLY data_fetcher to avoid creating new bot instances
-        fetcher = data_fetcher
-        if fetcher:
-            try:
-                directions = fetcher.get_current_directions()
-                current_price = fetcher.get_current_price()
-                unrealized_pnl = fetcher.calculate_unrealized_pnl()
-            except Exception as e:
-                logging.error(f"Error fetching data: {e}")
-        
-        # CRITICAL: Get TOP1 current price for API response
-        top1_current_price = 0.0
-        if top_gainers_cache['data']:
-            top1 = top_gainers_cache['data'][0]
-            top1_current_price = float(top1.get('price', 0))
-        
-        position_data = state.get('position')
-        top1_display = ""
-        
-        # AUTO-SYNC: Verify position exists on Gate.io before showing
-        if state.get('in_position') and state.get('api_connected', False):
+            logging.error(f"Error fetching data: {e}")
+    
+    # CRITICAL: Get TOP1 current price for API response
+    top1_current_price = 0.0
+    if top_gainers_cache['data']:
+        top1 = top_gainers_cache['data'][0]
+        top1_current_price = float(top1.get('price', 0))
+    
+    position_data = state.get('position')
+    top1_display = ""
+    
+    # AUTO-SYNC: Verify position exists on Gate.io before showing (fresh positions cache, no request)
+    if state.get('in_position') and state.get('api_connected', False):
+        if time.time() - cached_positions.get('timestamp', 0) < 15 and not cached_positions.get('data'):
+            # No real position - clear state!
+            state['in_position'] = False
+            state['position'] = None
+            position_data = None
+            logging.info("🔄 AUTO-SYNC: Cleared ghost position (no real position on Gate.io)")
+    
+    if position_data and state.get('in_position'):
+        position_data = dict(position_data)
+        position_data['unrealized_pnl'] = unrealized_pnl
+        # RULE: Position LOCKS to TOP1 pair at entry and stays there until close
+        # Current Price = Position pair's current price (TRADOOR not TOP1!)
+        position_symbol = position_data.get('symbol', current_trading_symbol)
+        # Get POSITION pair's current price, not TOP1
+        if fetcher and position_symbol:
             try:
-                import ccxt
-                exchange = ccxt.gateio({
-                    'apiKey': os.getenv('GATE_API_KEY'),
-                    'secret': os.getenv('GATE_API_SECRET'),
-                    'options': {'defaultType': 'swap'}
-                })
-                real_positions = exchange.fetch_positions()
-                has_real_position = any(float(p.get('contracts', 0)) != 0 for p in real_positions)
-                if not has_real_position:
-                    # No real position - clear state!
-                    state['in_position'] = False
-                    state['position'] = None
-                    position_data = None
-                    logging.info("🔄 AUTO-SYNC: Cleared ghost position (no real position on Gate.io)")
+                position_current_price = fetcher.get_price_for_symbol(position_symbol)
+                position_data['current_price'] = round(position_current_price, 6)
             except Exception as e:
-                logging.debug(f"Could not verify real position: {e}")
-        
-        if position_data and state.get('in_position'):
-            position_data = dict(position_data)
-            position_data['unrealized_pnl'] = unrealized_pnl
-            # RULE: Position LOCKS to TOP1 pair at entry and stays there until close
-            # Current Price = Position pair's current price (TRADOOR not TOP1!)
-            position_symbol = position_data.get('symbol', current_trading_symbol)
-            # Get POSITION pair's current price, not TOP1
-            if fetcher and position_symbol:
-                try:
-                    position_current_price = fetcher.get_price_for_symbol(position_symbol)
-                    position_data['current_price'] = round(position_current_price, 6)
-                except Exception as e:
-                    logging.debug(f"Could not fetch {position_symbol} price: {e}")
-                    position_data['current_price'] = round(current_price, 6)
-            else:
+                logging.debug(f"Could not fetch {position_symbol} price: {e}")
                 position_data['current_price'] = round(current_price, 6)
-            position_data['symbol'] = position_symbol
-            # Show locked TOP1 pair+price when position is open
-            top1_entry = position_data.get('top1_entry', {})
-            if top1_entry:
-                top1_display = f"{top1_entry.get('pair', 'TOP1')} ${top1_entry.get('price', 0):.6f}"
-            position_data['top1_display'] = top1_display
-            # Ensure notional is properly set from position state
-            notional = position_data.get('notional', 0)
-            if not notional and position_data.get('size_base') and position_data.get('entry_price'):
-                notional = float(position_data.get('size_base', 0)) * float(position_data.get('entry_price', 0))
-            position_data['notional'] = round(notional, 2)
-            position_data['size'] = round(notional, 2)  # Size = notional in USDT
-            position_data['entry'] = round(position_data.get('entry_price', 0), 6)
-            # Show locked TOP1 pair+price when position is open
-            top1_entry = position_data.get('top1_entry', {})
-            if top1_entry:
-                top1_display = f"{top1_entry.get('pair', 'TOP1')} ${top1_entry.get('price', 0):.6f}"
-            position_data['top1_display'] = top1_display
         else:
-            # When no position, show current TOP1 with FRESH price from Gate.io
-            if top_gainers_cache['data']:
-                top1 = top_gainers_cache['data'][0]
-                top1_symbol = top1.get('symbol', 'TOP1')
-                top1_price = float(top1.get('price', 0))
-                top1_display = f"{top1_symbol} ${top1_price:.6f}"
-                # Store current TOP1 in state for next position opening
-                state["current_top1"] = {"pair": top1_symbol, "price": top1_price}
-                logging.debug(f"TOP1 Update: {top1_display}")
-        
-        # Calculate REALIZED P&L from all closed trades
-        trades = state.get('trades', [])
-        realized_pnl = sum(float(trade.get('pnl', 0)) for trade in trades)
-        total_pnl = realized_pnl + unrealized_pnl
-        
-        # ✅ Use state['api_connected'] which tracks DEMO/REAL mode toggle
-        api_is_connected = state.get('api_connected', False)
-        trading_mode = state.get('trading_mode', 'demo')
-        
-        # ✅ DEBUG: Log current mode status
-        logging.info(f"📊 /api/status: api_connected={api_is_connected}, trading_mode={trading_mode}")
-        
-        # ✅ Initialize display balance
-        display_balance = 100.0  # Start with default
-        
-        if api_is_connected:
-            # API IS CONNECTED: ALWAYS fetch FRESH real balance from Gate.io
+            position_data['current_price'] = round(current_price, 6)
+        position_data['symbol'] = position_symbol
+        # Show locked TOP1 pair+price when position is open
+        top1_entry = position_data.get('top1_entry', {})
+        if top1_entry:
+            top1_display = f"{top1_entry.get('pair', 'TOP1')} ${top1_entry.get('price', 0):.6f}"
+        position_data['top1_display'] = top1_display
+        # Ensure notional is properly set from position state
+        notional = position_data.get('notional', 0)
+        if not notional and position_data.get('size_base') and position_data.get('entry_price'):
+            notional = float(position_data.get('size_base', 0)) * float(position_data.get('entry_price', 0))
+        position_data['notional'] = round(notional, 2)
+        position_data['size'] = round(notional, 2)  # Size = notional in USDT
+        position_data['entry'] = round(position_data.get('entry_price', 0), 6)
+        # Show locked TOP1 pair+price when position is open
+        top1_entry = position_data.get('top1_entry', {})
+        if top1_entry:
+            top1_display = f"{top1_entry.get('pair', 'TOP1')} ${top1_entry.get('price', 0):.6f}"
+        position_data['top1_display'] = top1_display
+    else:
+        # When no position, show current TOP1 with FRESH price from Gate.io
+        if top_gainers_cache['data']:
+            top1 = top_gainers_cache['data'][0]
+            top1_symbol = top1.get('symbol', 'TOP1')
+            top1_price = float(top1.get('price', 0))
+            top1_display = f"{top1_symbol} ${top1_price:.6f}"
+            # Store current TOP1 in state for next position opening
+            state["current_top1"] = {"pair": top1_symbol, "price": top1_price}
+            logging.debug(f"TOP1 Update: {top1_display}")
+    
+    # Calculate REALIZED P&L from all closed trades
+    trades = state.get('trades', [])
+    realized_pnl = sum(float(trade.get('pnl', 0)) for trade in trades)
+    total_pnl = realized_pnl + unrealized_pnl
+    
+    # ✅ Use state['api_connected'] which tracks DEMO/REAL mode toggle
+    api_is_connected = state.get('api_connected', False)
+    trading_mode = state.get('trading_mode', 'demo')
+    
+    # ✅ DEBUG: Log current mode status
+    logging.debug(f"📊 /api/status: api_connected={api_is_connected}, trading_mode={trading_mode}")
+    
+    # ✅ Initialize display balance
+    display_balance = 100.0  # Start with default
+    
+    if api_is_connected:
+        # API IS CONNECTED: real balance from the positions cache (fetch_balance every 5 sec in background)
+        display_balance = float(cached_positions.get('balance', 0) or state.get('balance', 0))
+        # Ensure not negative (real balance can't be negative)
+        display_balance = max(0.0, float(display_balance))
+    else:
+        # API DISCONNECTED: show virtual balance from state ($100 default)
+        display_balance = float(state.get('balance', 100.0))
+        logging.debug(f"🔵 Using VIRTUAL balance from state: ${display_balance:.2f}")
+    
+    # ✅ USE CACHED POSITIONS (updated in background every 5 sec)
+    real_position_data = cached_positions.get('data')
+    cached_balance = cached_positions.get('balance', 0)
+    cached_total = cached_positions.get('total_balance', 0)
+    
+    # ✅ ONLY use cached balance if in REAL mode (api_connected=True)
+    # In DEMO mode, use available from state file (margin is locked when position open)
+    available_balance = display_balance  # Default
+    if api_is_connected:  # REAL mode - use cached balance
+        if cached_total > 0:
+            display_balance = cached_total
+            available_balance = cached_balance
+        elif cached_balance > 0:
+            display_balance = cached_balance
+    else:
+        # DEMO mode - use available from state file
+        available_balance = float(state.get('available', 100.0))
+    
+    # Calculate unrealized P&L for DEMO position using CORRECT futures formula
+    if state.get('in_position') and state.get('position') and not api_is_connected:
+        pos = state['position']
+        entry_price = float(pos.get('entry_price', 0))
+        notional = float(pos.get('notional', 0))
+        side = pos.get('side', 'long')
+        margin = float(pos.get('margin', 0))
+        position_symbol = pos.get('symbol', current_trading_symbol)
+        
+        # ✅ CRITICAL: Get price for POSITION symbol, not TOP1!
+        position_current_price = top1_current_price  # Default fallback
+        if fetcher and position_symbol:
             try:
-                api_key = os.getenv('GATE_API_KEY', '').strip()
-                api_secret = os.getenv('GATE_API_SECRET', '').strip()
-                if api_key and api_secret:
-                    is_valid, balance_result = validate_api_credentials(api_key, api_secret)
-                    if is_valid and isinstance(balance_result, dict):
-                        if 'USDT' in balance_result:
-                            usdt_balance = balance_result['USDT']
-                            if isinstance(usdt_balance, dict):
-                                display_balance = float(usdt_balance.get('free', 0))
-                            else:
-                                display_balance = float(usdt_balance)
-                        else:
-                            display_balance = 0.0
+                position_current_price = fetcher.get_price_for_symbol(position_symbol)
             except Exception as e:
-                logging.warning(f"Could not fetch balance from Gate.io: {e}")
-                display_balance = 0.0
-            # Ensure not negative (real balance can't be negative)
-            display_balance = max(0.0, float(display_balance))
-        else:
-            # API DISCONNECTED: show virtual balance from state ($100 default)
-            display_balance = float(state.get('balance', 100.0))
-            logging.debug(f"🔵 Using VIRTUAL balance from state: ${display_balance:.2f}")
-        
-        # ✅ USE CACHED POSITIONS (updated in background every 5 sec)
-        real_position_data = cached_positions.get('data')
-        cached_balance = cached_positions.get('balance', 0)
-        cached_total = cached_positions.get('total_balance', 0)
-        
-        # ✅ ONLY use cached balance if in REAL mode (api_connected=True)
-        # In DEMO mode, use available from state file (margin is locked when position open)
-        available_balance = display_balance  # Default
-        if api_is_connected:  # REAL mode - use cached balance
-            if cached_total > 0:
-                display_balance = cached_total
-                available_balance = cached_balance
-            elif cached_balance > 0:
-                display_balance = cached_balance
-        else:
-            # DEMO mode - use available from state file
-            available_balance = float(state.get('available', 100.0))
-        
-        # Calculate unrealized P&L for DEMO position using CORRECT futures formula
-        if state.get('in_position') and state.get('position') and not api_is_connected:
-            pos = state['position']
-            entry_price = float(pos.get('entry_price', 0))
-            notional = float(pos.get('notional', 0))
-            side = pos.get('side', 'long')
-            margin = float(pos.get('margin', 0))
-            position_symbol = pos.get('symbol', current_trading_symbol)
+                logging.debug(f"Could not fetch {position_symbol} price: {e}")
+        
+        if entry_price > 0 and notional > 0 and position_current_price > 0:
+            # ✅ CORRECT FUTURES P&L FORMULA: P&L = notional × (price_change_percent)
+            if side == 'long':
+                price_change_pct = (position_current_price - entry_price) / entry_price
+            else:  # SHORT
+                price_change_pct = (entry_price - position_current_price) / entry_price
+            unrealized_pnl = notional * price_change_pct
             
-            # ✅ CRITICAL: Get price for POSITION symbol, not TOP1!
-            position_current_price = top1_current_price  # Default fallback
-            if fetcher and position_symbol:
-                try:
-                    position_current_price = fetcher.get_price_for_symbol(position_symbol)
-                except Exception as e:
-                    logging.debug(f"Could not fetch {position_symbol} price: {e}")
+            # Cap loss at margin (can't lose more than margin in futures)
+            if margin > 0 and unrealized_pnl < -margin:
+                unrealized_pnl = -margin
             
-            if entry_price > 0 and notional > 0 and position_current_price > 0:
-                # ✅ CORRECT FUTURES P&L FORMULA: P&L = notional × (price_change_percent)
-                if side == 'long':
-                    price_change_pct = (position_current_price - entry_price) / entry_price
-                else:  # SHORT
-                    price_change_pct = (entry_price - position_current_price) / entry_price
-                unrealized_pnl = notional * price_change_pct
-                
-                # Cap loss at margin (can't lose more than margin in futures)
-                if margin > 0 and unrealized_pnl < -margin:
-                    unrealized_pnl = -margin
-                
-                # Update position with current price and P&L
-                if position_data:
-                    position_data['current_price'] = position_current_price
-                    position_data['unrealized_pnl'] = round(unrealized_pnl, 2)
-        
-        # Use real position if found, otherwise use state position
-        if real_position_data:
-            position_data = real_position_data
-            state['in_position'] = True
-            state['position'] = real_position_data
-            unrealized_pnl = real_position_data.get('unrealized_pnl', 0)
-        
-        response = jsonify({
-            'bot_running': bot_running,
-            'paper_mode': os.getenv('RUN_IN_PAPER', '1') == '1',
-            'balance': round(display_balance, 2),
-            'available': round(max(0.0, available_balance), 2),
-            'in_position': state.get('in_position', False),
-            'position': position_data,
-            'top1_display': top1_display,
-            'current_price': round(top1_current_price, 6),
-            'unrealized_pnl': round(unrealized_pnl, 2),
-            'realized_pnl': round(realized_pnl, 2),
-            'total_pnl': round(total_pnl, 2),
-            'directions': directions,
-            'sar_directions': directions,
-            'trades': trades,
-            'current_symbol': current_trading_symbol,
-            'api_connected': api_is_connected,
-            'trading_mode': trading_mode,
-            'open_levels': strategy_config.get('open_levels', ['5m', '30m']),
-            'close_levels': strategy_config.get('close_levels', ['5m'])
-        })
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        return response
+            # Update position with current price and P&L
+            if position_data:
+                position_data['current_price'] = position_current_price
+                position_data['unrealized_pnl'] = round(unrealized_pnl, 2)
+    
+    # Use real position if found, otherwise use state position
+    if real_position_data:
+        position_data = real_position_data
+        state['in_position'] = True
+        state['position'] = real_position_data
+        unrealized_pnl = real_position_data.get('unrealized_pnl', 0)
+    
+    return {
+        'bot_running': bot_running,
+        'paper_mode': os.getenv('RUN_IN_PAPER', '1') == '1',
+        'balance': round(display_balance, 2),
+        'available': round(max(0.0, available_balance), 2),
+        'in_position': state.get('in_position', False),
+        'position': position_data,
+        'top1_display': top1_display,
+        'current_price': round(top1_current_price, 6),
+        'unrealized_pnl': round(unrealized_pnl, 2),
+        'realized_pnl': round(realized_pnl, 2),
+        'total_pnl': round(total_pnl, 2),
+        'directions': directions,
+        'sar_directions': directions,
+        'trades': trades,
+        'current_symbol': current_trading_symbol,
+        'api_connected': api_is_connected,
+        'trading_mode': trading_mode,
+        'open_levels': strategy_config.get('open_levels', ['5m', '30m']),
+        'close_levels': strategy_config.get('close_levels', ['5m']),
+        'strategy_schedule': bot_instance.scheduler.status() if bot_instance else None,
+        'engine_pid': os.getpid()
+    }
+
+def status_builder():
+    """Engine worker: rebuild the /api/status snapshot once per STATUS_TICK for every client"""
+    while True:
+        try:
+            status_snapshot.publish(build_status_payload())
+        except Exception as e:
+            logging.error(f"Status build error: {e}")
+        time.sleep(STATUS_TICK)
+
+def current_status():
+    """(body, etag) снимка /api/status; если снимка еще нет (движок стартует) - собрать один раз здесь"""
+    body, etag = status_snapshot.current()
+    if body is None:
+        status_snapshot.publish(build_status_payload())
+        body, etag = status_snapshot.current()
+    return body, etag
+
+@app.route('/api/status')
+def api_status():
+    """Получение текущего статуса бота - готовый снимок из памяти, ETag / 304 для неизмененного ответа"""
+    try:
+        sync_shared_state()
+        body, etag = current_status()
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # no-cache (not no-store): the browser keeps the body and revalidates it with If-None-Match
+        response.headers['Cache-Control'] = 'no-cache, must-revalidate'
+        return response.make_conditional(request)
     except Exception as e:
         logging.error(f"Status error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -786,6 +817,11 @@ def api_start_bot():
     if bot_running or bot_starting:
         return jsonify({'message': 'Бот уже запущен', 'status': 'running'})
     
+    state_store.set_flags(bot_enabled=True)
+    if not engine_lease.is_leader:
+        # The engine worker picks the flag up on its next supervisor tick
+        return jsonify({'message': 'Бот успешно запущен', 'status': 'running'})
+    
     try:
         bot_starting = True
         # Убедиться что TOP 1 гейнер загружен
@@ -821,21 +857,46 @@ def api_stop_bot():
     
     try:
         bot_running = False
+        state_store.set_flags(bot_enabled=False)
         logging.info("Trading bot stopped")
         return jsonify({'message': 'Бот успешно остановлен', 'status': 'stopped'})
     except Exception as e:
         logging.error(f"Stop bot error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def manual_trader():
+    """
+    Trader for manual open/close routes, with fresh state.
+    Workers without the engine lease trade through data_fetcher (state store CAS prevents duplicates),
+    but their trading_bot.state and price_book are only as fresh as the last sync: reload both first.
+    """
+    sync_shared_state()
+    sync_engine_snapshot()
+    trader = bot_instance or data_fetcher
+    if trader:
+        trader.sync_state()
+    return trader
+
+def simulator_on_leader(f):
+    """Decorator: with USE_SIMULATOR the simulated exchange lives in this process only - trade on the lease holder"""
+    def decorated_function(*args, **kwargs):
+        if USE_SIMULATOR and not engine_lease.is_leader:
+            return jsonify({'error': 'Симулятор работает в воркере-лидере, повторите запрос'}), 503
+        return f(*args, **kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
 @app.route('/api/open_long', methods=['POST'])
+@simulator_on_leader
 def api_open_long():
     """Открытие LONG позиции как исключение"""
+    trader = manual_trader()
     
     if state.get('in_position'):
         return jsonify({'error': 'Уже есть открытая позиция'}), 400
     
     try:
-        if bot_instance:
+        if trader:
             # 🔒 БЛОКИРОВКА: Запомнить TOP 1 пару при открытии позиции
             if top_gainers_cache['data'] and len(top_gainers_cache['data']) > 0:
                 price = top_gainers_cache['data'][0].get('price', 3000.0)
@@ -843,19 +904,19 @@ def api_open_long():
                 state["top1_entry"] = {"pair": symbol, "price": price}
                 state["current_top1"] = {"pair": symbol, "price": price}
             else:
-                price = bot_instance.get_current_price()
+                price = trader.get_current_price()
                 state["top1_entry"] = {"pair": current_trading_symbol, "price": price}
                 state["current_top1"] = {"pair": current_trading_symbol, "price": price}
             
             # ✅ CRITICAL: Get current SAR directions before opening position
             try:
-                sar_data = bot_instance.get_sar_signals()
+                sar_data = trader.get_sar_signals()
                 current_directions = sar_data.get('directions', {})
             except:
                 current_directions = {}
             
-            amount, notional = bot_instance.compute_order_size_usdt(state["available"], price)
-            position = bot_instance.place_market_order("buy", amount, price_override=price)  # LONG
+            amount, notional = trader.compute_order_size_usdt(state["available"], price)
+            position = trader.place_market_order("buy", amount, price_override=price)  # LONG
             if position:
                 # ✅ CRITICAL: Mark position as open
                 state['in_position'] = True
@@ -867,18 +928,17 @@ def api_open_long():
                 state["position_open_levels_directions"] = {level: current_directions.get(level) for level in open_levels}
                 logging.info(f"🔒 Position LOCKED on {state['top1_entry']['pair']} with open_levels {open_levels} {state['position_open_levels_directions']}")
                 
-                # ✅ Save state to file
+                # ✅ Save state to the store
                 try:
-                    with open("goldantelopegate_v1.0_state.json", "w") as f:
-                        json.dump(state, f, indent=2, default=str)
-                except:
-                    pass
+                    state_store.save_state(state)
+                except Exception as e:
+                    logging.error(f"Save state error: {e}")
                 
                 # ✅ Send Telegram notification when position opens
                 if telegram_notifier:
                     try:
                         trade_number = state.get("telegram_trade_counter", 1)
-                        current_price = bot_instance.get_current_price()
+                        current_price = trader.get_current_price()
                         telegram_notifier.send_position_opened(position, current_price, trade_number=trade_number, balance=state.get('balance', 0), symbol=current_trading_symbol)
                     except Exception as e:
                         logging.error(f"Failed to send Telegram notification: {e}")
@@ -894,14 +954,16 @@ def api_open_long():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/open_short', methods=['POST'])
+@simulator_on_leader
 def api_open_short():
     """Открытие SHORT позиции как исключение"""
+    trader = manual_trader()
     
     if state.get('in_position'):
         return jsonify({'error': 'Уже есть открытая позиция'}), 400
     
     try:
-        if bot_instance:
+        if trader:
             # 🔒 БЛОКИРОВКА: Запомнить TOP 1 пару при открытии позиции
             if top_gainers_cache['data'] and len(top_gainers_cache['data']) > 0:
                 price = top_gainers_cache['data'][0].get('price', 3000.0)
@@ -909,19 +971,19 @@ def api_open_short():
                 state["top1_entry"] = {"pair": symbol, "price": price}
                 state["current_top1"] = {"pair": symbol, "price": price}
             else:
-                price = bot_instance.get_current_price()
+                price = trader.get_current_price()
                 state["top1_entry"] = {"pair": current_trading_symbol, "price": price}
                 state["current_top1"] = {"pair": current_trading_symbol, "price": price}
             
             # ✅ CRITICAL: Get current SAR directions before opening position
             try:
-                sar_data = bot_instance.get_sar_signals()
+                sar_data = trader.get_sar_signals()
                 current_directions = sar_data.get('directions', {})
             except:
                 current_directions = {}
             
-            amount, notional = bot_instance.compute_order_size_usdt(state["available"], price)
-            position = bot_instance.place_market_order("sell", amount, price_override=price)  # SHORT
+            amount, notional = trader.compute_order_size_usdt(state["available"], price)
+            position = trader.place_market_order("sell", amount, price_override=price)  # SHORT
             if position:
                 # ✅ CRITICAL: Mark position as open
                 state['in_position'] = True
@@ -933,18 +995,17 @@ def api_open_short():
                 state["position_open_levels_directions"] = {level: current_directions.get(level) for level in open_levels}
                 logging.info(f"🔒 Position LOCKED on {state['top1_entry']['pair']} with open_levels {open_levels} {state['position_open_levels_directions']}")
                 
-                # ✅ Save state to file
+                # ✅ Save state to the store
                 try:
-                    with open("goldantelopegate_v1.0_state.json", "w") as f:
-                        json.dump(state, f, indent=2, default=str)
-                except:
-                    pass
+                    state_store.save_state(state)
+                except Exception as e:
+                    logging.error(f"Save state error: {e}")
                 
                 # ✅ Send Telegram notification when position opens
                 if telegram_notifier:
                     try:
                         trade_number = state.get("telegram_trade_counter", 1)
-                        current_price = bot_instance.get_current_price()
+                        current_price = trader.get_current_price()
                         telegram_notifier.send_position_opened(position, current_price, trade_number=trade_number, balance=state.get('balance', 0), symbol=current_trading_symbol)
                     except Exception as e:
                         logging.error(f"Failed to send Telegram notification: {e}")
@@ -960,14 +1021,16 @@ def api_open_short():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/close_position', methods=['POST'])
+@simulator_on_leader
 def api_close_position():
     """Принудительное закрытие позиции"""
+    trader = manual_trader()
     if not state.get('in_position'):
         return jsonify({'error': 'Нет открытой позиции'}), 400
     
     try:
-        if bot_instance:
-            trade = bot_instance.close_position(close_reason='manual')
+        if trader:
+            trade = trader.close_position(close_reason='manual')
             if trade:
                 return jsonify({'message': 'Позиция успешно закрыта', 'trade': trade})
             else:
@@ -1031,6 +1094,13 @@ def api_telegram_info():
         'bot_configured': telegram_notifier is not None
     })
 
+@app.route('/api/scanner')
+def api_scanner():
+    """Снимок сканера PSAR: кандидаты и выровненные по open_levels пары в порядке рейтинга"""
+    if not engine_lease.is_leader:
+        return jsonify(engine_snapshot.read().get('scanner', {}))
+    return jsonify(psar_scanner.export(state_watcher.strategy_config().get('open_levels', [])))
+
 @app.route('/api/debug_sar')
 def api_debug_sar():
     """Получение отладочной информации о SAR индикаторе"""
@@ -1047,8 +1117,8 @@ def api_debug_sar():
         for tf in ['15m', '5m', '1m']:
             df = bot_instance.fetch_ohlcv_tf(tf, limit=50)
             if df is not None and len(df) > 0:
-                psar = bot_instance.compute_psar(df)
-                direction = bot_instance.get_direction_from_psar(df)
+                psar = bot_instance.compute_psar(df, tf)
+                direction = bot_instance.get_direction_from_psar(df, tf)
                 
                 last_close = df['close'].iloc[-1]
                 last_psar = psar.iloc[-1] if psar is not None else 0
@@ -1088,64 +1158,68 @@ def api_get_global_state():
         'current_price': bot_instance.get_current_price() if bot_instance else 3000.0
     })
 
+def chart_timeframe(tf):
+    if tf not in ['1m', '5m', '15m', '30m', '1h', '60m']:
+        tf = '5m'
+    # Map 60m to 1h (Gate.io uses 1h, not 60m)
+    if tf == '60m':
+        tf = '1h'
+    return tf
+
+def build_chart_data(tf):
+    """OHLCV + SAR points for the chart (shared by /api/chart_data and /api/stream)"""
+    fetcher = bot_instance if bot_instance else data_fetcher
+    if not fetcher:
+        return {'candles': [], 'sar_points': []}
+    
+    df = fetcher.fetch_ohlcv_tf(tf, limit=100)
+    if df is None or len(df) == 0:
+        return {'candles': [], 'sar_points': []}
+    
+    # Get SAR values from the chart's own streaming PSAR engines (no full ta recompute)
+    psar = fetcher.compute_psar(df, tf, book=chart_psar_book)
+    
+    candles = []
+    sar_points = []
+    
+    for idx, (_, row) in enumerate(df.iterrows()):
+        timestamp = pd.to_datetime(row['datetime'])
+        time_str = timestamp.strftime('%H:%M')
+    
+        candles.append({
+            'time': time_str,
+            'open': float(row['open']),
+            'high': float(row['high']),
+            'low': float(row['low']),
+            'close': float(row['close'])
+        })
+    
+        # Add SAR point
+        if psar is not None and idx < len(psar):
+            sar_val = psar.iloc[idx]
+            if not pd.isna(sar_val):
+                # Determine if uptrend or downtrend
+                close = row['close']
+                is_uptrend = close > sar_val
+    
+                sar_points.append({
+                    'time': time_str,
+                    'value': float(sar_val),
+                    'color': '#000000',  # Black for all SAR points
+                    'trend': 'up' if is_uptrend else 'down'
+                })
+    
+    return {
+        'timeframe': tf,
+        'candles': candles,
+        'sar_points': sar_points
+    }
+
 @app.route('/api/chart_data')
 def api_chart_data(timeframe='5m'):
     """Get OHLCV chart data with SAR indicator"""
     try:
-        tf = request.args.get('timeframe', '5m')
-        if tf not in ['1m', '5m', '15m', '30m', '1h', '60m']:
-            tf = '5m'
-        
-        # Map 60m to 1h (Gate.io uses 1h, not 60m)
-        if tf == '60m':
-            tf = '1h'
-        
-        fetcher = bot_instance if bot_instance else data_fetcher
-        if not fetcher:
-            return jsonify({'candles': [], 'sar_points': []})
-        
-        df = fetcher.fetch_ohlcv_tf(tf, limit=100)
-        if df is None or len(df) == 0:
-            return jsonify({'candles': [], 'sar_points': []})
-        
-        # Get SAR values
-        psar = fetcher.compute_psar(df)
-        
-        candles = []
-        sar_points = []
-        
-        for idx, (_, row) in enumerate(df.iterrows()):
-            timestamp = pd.to_datetime(row['datetime'])
-            time_str = timestamp.strftime('%H:%M')
-            
-            candles.append({
-                'time': time_str,
-                'open': float(row['open']),
-                'high': float(row['high']),
-                'low': float(row['low']),
-                'close': float(row['close'])
-            })
-            
-            # Add SAR point
-            if psar is not None and idx < len(psar):
-                sar_val = psar.iloc[idx]
-                if not pd.isna(sar_val):
-                    # Determine if uptrend or downtrend
-                    close = row['close']
-                    is_uptrend = close > sar_val
-                    
-                    sar_points.append({
-                        'time': time_str,
-                        'value': float(sar_val),
-                        'color': '#000000',  # Black for all SAR points
-                        'trend': 'up' if is_uptrend else 'down'
-                    })
-        
-        return jsonify({
-            'timeframe': tf,
-            'candles': candles,
-            'sar_points': sar_points
-        })
+        return jsonify(build_chart_data(chart_timeframe(request.args.get('timeframe', '5m'))))
     except Exception as e:
         logging.error(f"Chart data error: {e}")
         return jsonify({
@@ -1162,6 +1236,7 @@ def api_delete_last_trade():
     try:
         deleted_trade = state['trades'].pop()
         state['balance'] -= deleted_trade.get('pnl', 0)
+        state_store.delete_trades([deleted_trade])
         
         if bot_instance:
             bot_instance.save_state_to_file()
@@ -1186,10 +1261,10 @@ def api_reset_balance():
         state['in_position'] = False
         state['position'] = None
         
-        # ✅ CRITICAL: Always save to file, even if bot_instance is None
-        import json
-        with open('goldantelopegate_v1.0_state.json', 'w') as f:
-            json.dump(state, f, indent=2)
+        # ✅ CRITICAL: Always save to the store, even if bot_instance is None
+        state_store.clear_position()
+        state_store.clear_trades()
+        state_store.save_state(state)
         
         logging.info(f"✅ Virtual balance reset to ${START_BANK:.2f}, trades cleared")
         return jsonify({'message': f'Баланс сброшен до ${START_BANK:.2f}'})
@@ -1256,11 +1331,7 @@ def api_set_trading_mode():
                     api_key = os.getenv('GATE_API_KEY')
                     api_secret = os.getenv('GATE_API_SECRET')
                     if api_key and api_secret:
-                        exchange = ccxt.gateio({
-                            'apiKey': api_key,
-                            'secret': api_secret,
-                            'options': {'defaultType': 'swap'}
-                        })
+                        exchange = get_exchange(api_key, api_secret)
                         
                         position = state['position']
                         symbol = state.get('current_symbol', 'XNY_USDT').replace('_', '/')
@@ -1333,11 +1404,11 @@ def api_set_trading_mode():
             
             logging.info("🎮 Режим DEMO активирован - Виртуальный баланс $100")
             
-            # ✅ SAVE STATE TO FILE after switching to DEMO
+            # ✅ SAVE STATE after switching to DEMO
             try:
-                with open("goldantelopegate_v1.0_state.json", "w") as f:
-                    json.dump(dict(state), f, default=str, indent=2)
-                logging.info("✅ State saved to file after DEMO switch")
+                state_store.clear_position()
+                state_store.save_state(state)
+                logging.info("✅ State saved after DEMO switch")
             except Exception as save_err:
                 logging.error(f"Save state error: {save_err}")
             
@@ -1355,21 +1426,16 @@ def api_set_trading_mode():
                 api_key = os.getenv('GATE_API_KEY')
                 api_secret = os.getenv('GATE_API_SECRET')
                 if api_key and api_secret:
-                    exchange = ccxt.gateio({
-                        'apiKey': api_key,
-                        'secret': api_secret,
-                        'options': {'defaultType': 'swap'}
-                    })
+                    exchange = get_exchange(api_key, api_secret)
                     balance_data = exchange.fetch_balance()
                     real_balance = float(balance_data.get('USDT', {}).get('free', 0))
                     state['balance'] = real_balance
                     state['available'] = real_balance
                     
-                    # ✅ SAVE STATE TO FILE after switching to REAL
+                    # ✅ SAVE STATE after switching to REAL
                     try:
-                        with open("goldantelopegate_v1.0_state.json", "w") as f:
-                            json.dump(dict(state), f, default=str, indent=2)
-                        logging.info("✅ State saved to file after REAL switch")
+                        state_store.save_state(state)
+                        logging.info("✅ State saved after REAL switch")
                     except Exception as save_err:
                         logging.error(f"Save state error: {save_err}")
                     
@@ -1473,22 +1539,23 @@ def api_set_strategy_config():
         if bot_instance:
             bot_instance.open_levels = strategy_config['open_levels'].copy()
             bot_instance.close_levels = strategy_config['close_levels'].copy()
+            bot_instance.scheduler.set_levels(strategy_config['open_levels'] + strategy_config['close_levels'])
             logging.info(f"✅ Strategy INSTANTLY applied to running bot!")
         
         # Also update state for persistence
         state['open_levels'] = strategy_config['open_levels'].copy()
         state['close_levels'] = strategy_config['close_levels'].copy()
         
-        # ✅ SAVE strategy_config to file for persistence across restarts
+        # ✅ SAVE strategy_config to the store for persistence across restarts
         try:
-            with open("goldantelopegate_v1.0_state.json", "r") as f:
-                saved_state = json.load(f)
-            saved_state['strategy_config'] = strategy_config.copy()
-            with open("goldantelopegate_v1.0_state.json", "w") as f:
-                json.dump(saved_state, f, indent=2)
-            logging.info(f"💾 Strategy saved to file!")
+            state_store.set_strategy_config(strategy_config)
+            logging.info(f"💾 Strategy saved to state store!")
         except Exception as e:
-            logging.warning(f"Could not save strategy to file: {e}")
+            logging.warning(f"Could not save strategy to state store: {e}")
+        
+        # ✅ Wake the strategy loop now instead of waiting for the next candle close
+        if bot_instance:
+            bot_instance.scheduler.trigger()
         
         logging.info(f"🎯 Strategy updated: OPEN={strategy_config['open_levels']}, CLOSE={strategy_config['close_levels']}")
         return jsonify({'message': 'Strategy config updated', 'config': strategy_config})
@@ -1496,6 +1563,40 @@ def api_set_strategy_config():
         logging.error(f"Set strategy config error: {e}")
         return jsonify({'error': str(e)}), 500
 
+BACKTEST_MAX_DAYS = float(os.getenv('BACKTEST_MAX_DAYS', '14'))
+
+@app.route('/api/backtest', methods=['POST'])
+def api_backtest():
+    """Прогнать strategy_config по истории 1m свечей перед /api/set_strategy_config"""
+    try:
+        import trading_bot
+        data = request.get_json() or {}
+        open_levels = data.get('open_levels') or strategy_config.get('open_levels', ['5m', '30m'])
+        close_levels = data.get('close_levels') or strategy_config.get('close_levels', ['5m'])
+        unknown = [level for level in open_levels + close_levels if level not in backtest_engine.LEVELS]
+        if unknown:
+            return jsonify({'error': f'Unknown levels: {unknown}'}), 400
+        try:
+            days = float(data.get('days', 3))
+        except (TypeError, ValueError):
+            days = float('nan')
+        if not 0 < days <= BACKTEST_MAX_DAYS:  # NaN тоже не проходит
+            return jsonify({'error': f'days must be a number in (0, {BACKTEST_MAX_DAYS:g}]'}), 400
+        symbol = data.get('symbol') or current_trading_symbol
+        since = int((time.time() - days * 86400) * 1000)
+        candles = backtest_engine.fetch_history(get_exchange(), to_ccxt_symbol(symbol), since)
+        result = backtest_engine.backtest(candles, open_levels, close_levels,
+                                          leverage=int(data.get('leverage', trading_bot.LEVERAGE)),
+                                          fee_rate=float(data.get('fee_rate', 0.0)))
+        if not data.get('trades'):
+            result.pop('trade_list')
+        result.update(symbol=symbol, days=days)
+        logging.info(f"🧪 Backtest {symbol} {days}d OPEN={open_levels} CLOSE={close_levels}: {result['trades']} trades, {result['return_pct']}%")
+        return jsonify(result)
+    except Exception as e:
+        logging.error(f"Backtest error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/verify_password', methods=['POST'])
 def api_verify_password():
     """Проверка пароля для контрольных действий"""
@@ -1649,71 +1750,36 @@ def api_signals():
 
 import time
 import requests
-top_gainers_cache = {'data': [], 'timestamp': 0}
+top_gainers_cache = {'data': [], 'timestamp': 0, 'version': 0}
 CACHE_DURATION = 60
+GAINERS_REFRESH_SECONDS = float(os.getenv('GAINERS_REFRESH_SECONDS', '10'))
+gainers_http = requests.Session()  # Keep-alive: одно соединение на хост вместо нового сокета на каждый refresh
 
 def fetch_top_gainers_background():
-    """Фоновая загрузка всех 591 фьючерсных пар с Gate.io"""
+    """Фоновая загрузка всех 591 фьючерсных пар с Gate.io (вызывать через gainers_refresher). False - ошибка"""
     global top_gainers_cache
     try:
-        import requests
-        
-        # Получаем все фьючерсные контракты
-        contracts_response = requests.get('https://api.gateio.ws/api/v4/futures/usdt/contracts', timeout=10)
-        if contracts_response.status_code != 200:
-            logging.error(f"Gate.io contracts API error: {contracts_response.status_code}")
-            return
-        
-        contracts = contracts_response.json()
-        logging.info(f"Found {len(contracts)} futures contracts from Gate.io API")
+        # Контракты: из индекса, если он свежий (фоновое обновление раз в час), иначе один запрос
+        if contract_index.is_stale() or not len(contract_index):
+            contracts_response = gainers_http.get(CONTRACTS_URL, timeout=10)
+            if contracts_response.status_code != 200:
+                logging.error(f"Gate.io contracts API error: {contracts_response.status_code}")
+                return False
+            contracts = contracts_response.json()
+            logging.info(f"Found {len(contracts)} futures contracts from Gate.io API")
+            contract_index.ingest(contracts)
+        else:
+            contracts = contract_index.contracts()
         
         # Получаем все тикеры за один запрос (более эффективно)
-        tickers_response = requests.get('https://api.gateio.ws/api/v4/futures/usdt/tickers', timeout=10)
+        tickers_response = gainers_http.get(TICKERS_URL, timeout=10)
         if tickers_response.status_code != 200:
             logging.error(f"Gate.io tickers API error: {tickers_response.status_code}")
-            return
+            return False
         
         tickers = tickers_response.json()
-        ticker_map = {t['contract']: t for t in tickers}
-        logging.info(f"Loaded {len(ticker_map)} tickers from Gate.io")
-        
-        gainers = []
-        # Обрабатываем ВСЕ контракты (без ограничения, только ASCII символы)
-        for contract in contracts:
-            try:
-                symbol = contract.get('name')
-                if not symbol or symbol not in ticker_map:
-                    continue
-                
-                # ❌ Пропускаем черные символы
-                if symbol in BLACKLISTED_SYMBOLS:
-                    continue
-                
-                # Фильтруем китайские символы и другие не-ASCII
-                symbol_base = symbol.split('_')[0] if '_' in symbol else symbol
-                if not all(ord(c) < 128 for c in symbol_base):
-                    continue  # Пропускаем символы с кириллицей и иероглифами
-                
-                ticker = ticker_map[symbol]
-                last_price = float(ticker.get('last', 0))
-                change_24h = float(ticker.get('change_percentage', 0))
-                
-                if last_price > 0:
-                    coin_name = symbol.split('_')[0].lower()
-                    gainers.append({
-                        'symbol': symbol,
-                        'coin': coin_name,
-                        'price': last_price,
-                        'change': change_24h,
-                        'volume': float(ticker.get('volume_24h', 0)),
-                        'gecko_rank': 'N/A'
-                    })
-            except Exception as e:
-                continue
-        
-        # Сортируем по 24ч изменению
-        gainers.sort(key=lambda x: x['change'] if x['change'] else 0, reverse=True)
-        logging.info(f"Sorted {len(gainers)} gainers by 24h change")
+        price_book.ingest_tickers(tickers)
+        logging.info(f"Loaded {len(tickers)} tickers from Gate.io")
         
         # 🔒 БЛОКИРОВКА: если позиция открыта, пара ПОЗИЦИИ должна быть на #1 до конца сделки
         # ✅ FIX: Use position symbol from state, NOT current_trading_symbol (which resets on restart)
@@ -1721,65 +1787,145 @@ def fetch_top_gainers_background():
         if state.get('in_position', False) and state.get('position'):
             position_symbol = state['position'].get('symbol')
         
-        if position_symbol:
-            for i, gainer in enumerate(gainers):
-                if gainer['symbol'] == position_symbol:
-                    # Переместить текущую монету на первое место
-                    current_gainer = gainers.pop(i)
-                    gainers.insert(0, current_gainer)
-                    logging.info(f"🔒 БЛОКИРОВКА: {position_symbol} на #1 (в сделке, даже если другие выросли больше)")
-                    break
+        # Колоночный рейтинг: ASCII/черный список/цена и сортировка по 24ч изменению - векторно
+        table = gainers_ranking.rank(contracts, tickers, BLACKLISTED_SYMBOLS, pinned=position_symbol)
+        logging.info(f"Sorted {len(table['symbol'])} gainers by 24h change")
         
-        # CoinGecko рейтинги для топ 100
-        if gainers:
-            unique_coins = list(set([g['coin'] for g in gainers[:100]]))[:50]
-            if unique_coins:
-                coin_ids = ','.join(unique_coins)
-                try:
-                    cg_response = requests.get(
-                        f'https://api.coingecko.com/api/v3/coins/markets',
-                        params={'vs_currency': 'usd', 'ids': coin_ids, 'per_page': 250},
-                        timeout=5
-                    )
-                    cg_data = cg_response.json()
-                    cg_map = {coin['id']: coin.get('market_cap_rank', 'N/A') for coin in cg_data}
-                    for coin in gainers:
-                        coin['gecko_rank'] = cg_map.get(coin['coin'], coin['gecko_rank'])
-                except:
-                    pass
+        # CoinGecko рейтинги для топ 100: только из кэша, догрузка в фоне (публикацию не блокирует)
+        top_coins = table['coin'][:100].tolist()
+        table['gecko_rank'][:len(top_coins)] = gecko_ranks.ranks(top_coins)
+        gecko_ranks.want(top_coins)
         
+        gainers, version = gainers_ranking.publish(table)
         top_gainers_cache['data'] = gainers
+        top_gainers_cache['version'] = version
         # Set current_top1 for position opening
         if gainers:
             state["current_top1"] = {"pair": gainers[0].get('symbol', 'TOP1'), "price": float(gainers[0].get('price', 0))}
         top_gainers_cache['timestamp'] = time.time()
-        logging.info(f"✅ Loaded ALL {len(gainers)} futures pairs with real data from Gate.io")
+        market_stream.set_symbols(current_trading_symbol, [g['symbol'] for g in gainers[:WS_TOP_N]])
+        psar_scanner.set_symbols(table['symbol'][:psar_scanner.top_n].tolist(), pinned=position_symbol)
+        engine_snapshot.publish(top_gainers=top_gainers_cache, current_trading_symbol=current_trading_symbol)
+        logging.info(f"✅ Loaded ALL {len(gainers)} futures pairs with real data from Gate.io (ranking v{version})")
+        return True
     except Exception as e:
         logging.error(f"Background fetch error: {e}", exc_info=True)
+        return False
+
+# ✅ Single flight: one download at a time per process, concurrent callers reuse its result;
+# only the engine worker refreshes (engine lease), so it is also one download per cluster
+gainers_refresher = SingleFlightRefresher(fetch_top_gainers_background, GAINERS_REFRESH_SECONDS, name="top-gainers")
+
+def top_gainers_payload():
+    is_fresh = time.time() - top_gainers_cache['timestamp'] < 5
+    return {
+        'gainers': top_gainers_cache['data'],
+        'total_pairs': len(top_gainers_cache['data']),
+        'cached': is_fresh,
+        'loading': len(top_gainers_cache['data']) == 0,
+        'version': top_gainers_cache.get('version', 0)
+    }
+
+def top_gainers_changes(since):
+    """Дифф рейтинга от версии since (full=False) или полный список, если версия уже вышла из журнала"""
+    diff = gainers_ranking.changes_since(since) if since is not None else None
+    if diff is None:
+        return dict(top_gainers_payload(), full=True)
+    return dict(diff, full=False, cached=time.time() - top_gainers_cache['timestamp'] < 5)
 
 @app.route('/api/top_gainers', methods=['GET'])
 def api_top_gainers():
-    """Получить все фьючерсные пары Gate.io"""
+    """Получить все фьючерсные пары Gate.io (?since=<version> - только изменения с этой версии)"""
     global top_gainers_cache
     
-    # Если кэш пустой или устарел, обновляем в фоне
-    if not top_gainers_cache['data'] or time.time() - top_gainers_cache['timestamp'] > CACHE_DURATION:
-        threading.Thread(target=fetch_top_gainers_background, daemon=True).start()
+    # Если кэш пустой или устарел, обновляем в фоне (только воркер движка, остальные читают снимок)
+    sync_engine_snapshot()
+    if engine_lease.is_leader and (not top_gainers_cache['data'] or time.time() - top_gainers_cache['timestamp'] > CACHE_DURATION):
+        gainers_refresher.trigger(max_age=CACHE_DURATION)
     
     # Возвращаем закэшированные данные (или пустой если первый раз)
-    is_fresh = time.time() - top_gainers_cache['timestamp'] < 5
-    return jsonify({
-        'gainers': top_gainers_cache['data'],
-        'total_pairs': len(top_gainers_cache['data']),
-        'cached': is_fresh,
-        'loading': len(top_gainers_cache['data']) == 0
-    })
+    since = request.args.get('since', type=int)
+    if since is not None:
+        return jsonify(top_gainers_changes(since))
+    return jsonify(top_gainers_payload())
 
 @app.route('/api/current_trading_symbol', methods=['GET'])
 def api_current_trading_symbol():
     """Получить текущий торгуемый символ"""
+    sync_engine_snapshot()
     return jsonify({'symbol': current_trading_symbol})
 
+# ✅ Push stream: one SSE connection per dashboard instead of five polling loops
+STREAM_TICK = float(os.getenv('STREAM_TICK', '0.5'))        # Секунд между проверками изменений
+STREAM_CHART_EVERY = float(os.getenv('STREAM_CHART_EVERY', '5'))  # Секунд между пересборками графика
+STREAM_KEEPALIVE = 15     # Комментарий-пинг, чтобы прокси не рвали тихое соединение
+STREAM_MAX_SECONDS = 300  # Соединение закрывается сервером, EventSource переподключается сам
+
+def sse_event(event, data):
+    """Один кадр text/event-stream (data - уже сериализованный JSON)"""
+    if not isinstance(data, str):
+        data = json.dumps(data, default=str, separators=(',', ':'))
+    return f"event: {event}\ndata: {data}\n\n"
+
+def market_events(timeframe):
+    """Генератор SSE: status, gainers, chart, symbol - только когда они изменились"""
+    last_etag = None
+    last_gainers_version = None
+    last_chart = None
+    last_chart_at = 0
+    last_symbol = None
+    last_sent = time.time()
+    started = last_sent
+    yield "retry: 3000\n\n"
+    while time.time() - started < STREAM_MAX_SECONDS:
+        frames = []
+        sync_engine_snapshot()
+        
+        # Статус: P&L позиции, SAR-направления, баланс, сделки - готовый снимок /api/status
+        body, etag = current_status()
+        if etag != last_etag and body is not None:
+            last_etag = etag
+            frames.append(sse_event('status', body.decode()))
+        
+        # Топ-гейнеры: первый кадр - весь список, дальше - дифф рейтинга от последней отправленной версии
+        version = top_gainers_cache.get('version', 0)
+        if version != last_gainers_version:
+            payload = top_gainers_changes(last_gainers_version)
+            last_gainers_version = payload.get('version', version)
+            if not payload.get('unchanged'):
+                frames.append(sse_event('gainers', payload))
+        
+        if current_trading_symbol != last_symbol:
+            last_symbol = current_trading_symbol
+            frames.append(sse_event('symbol', {'symbol': current_trading_symbol}))
+        
+        # График: свечи + SAR, отправляется только при новой/обновленной свече
+        if time.time() - last_chart_at >= STREAM_CHART_EVERY:
+            last_chart_at = time.time()
+            try:
+                chart = json.dumps(build_chart_data(timeframe), default=str, separators=(',', ':'))
+                if chart != last_chart:
+                    last_chart = chart
+                    frames.append(sse_event('chart', chart))
+            except Exception as e:
+                logging.debug(f"Stream chart error: {e}")
+        
+        if frames:
+            last_sent = time.time()
+            yield ''.join(frames)
+        elif time.time() - last_sent >= STREAM_KEEPALIVE:
+            last_sent = time.time()
+            yield ": keepalive\n\n"
+        time.sleep(STREAM_TICK)
+
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events: статус, позиция, SAR, свечи и топ-гейнеры одним соединением"""
+    timeframe = chart_timeframe(request.args.get('timeframe', '5m'))
+    response = Response(stream_with_context(market_events(timeframe)), mimetype='text/event-stream')
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx / Railway proxy: не буферизовать поток
+    return response
+
 @app.route('/api/futures_count', methods=['GET'])
 def api_futures_count():
     """Показать количество фьючерсных пар на Kucoin"""
@@ -1810,15 +1956,13 @@ def auto_authenticate_api():
         
         logging.info("🔐 Auto-authenticating with stored Gate.io API keys...")
         
-        # ✅ FIRST: Load saved trading mode from state file
+        # ✅ FIRST: Load saved trading mode from the state store
         saved_trading_mode = 'demo'
         saved_api_connected = False
         try:
-            with open('goldantelopegate_v1.0_state.json', 'r') as f:
-                file_state = json.load(f)
-                saved_trading_mode = file_state.get('trading_mode', 'demo')
-                saved_api_connected = file_state.get('api_connected', False)
-                logging.info(f"📂 Loaded saved mode from file: trading_mode={saved_trading_mode}, api_connected={saved_api_connected}")
+            saved_trading_mode = state_store.get('trading_mode', 'demo')
+            saved_api_connected = state_store.get('api_connected', False)
+            logging.info(f"📂 Loaded saved mode from state store: trading_mode={saved_trading_mode}, api_connected={saved_api_connected}")
         except Exception as e:
             logging.debug(f"Could not load saved mode: {e}")
         
@@ -1865,11 +2009,8 @@ def auto_start_bot():
         
         bot_starting = True
         
-        # Загружаем TOP gainers перед стартом
-        fetch_top_gainers_background()
-        
-        # Ждём пока загрузятся данные
-        time.sleep(2)
+        # Загружаем TOP gainers перед стартом (или ждём уже идущую загрузку)
+        gainers_refresher.refresh(max_age=GAINERS_REFRESH_SECONDS)
         
         # Получаем TOP 1 символ
         current_trading_symbol = get_top_trading_symbol()
@@ -1885,14 +2026,49 @@ def auto_start_bot():
         bot_starting = False
         logging.error(f"Auto-start bot error: {e}")
 
+def engine_supervisor():
+    """Engine worker: follow the bot_enabled flag (set by any worker) and publish bot status"""
+    global bot_running
+    while True:
+        try:
+            enabled = state_store.get('bot_enabled', True)
+            if enabled and not bot_running and not bot_starting:
+                auto_start_bot()
+            elif not enabled and bot_running:
+                bot_running = False
+                logging.info("Trading bot stopped (bot_enabled=False)")
+            engine_snapshot.publish(bot_running=bot_running, prices=price_book.export(),
+                                    scanner=psar_scanner.export(state_watcher.strategy_config().get('open_levels', [])))
+        except Exception as e:
+            logging.error(f"Engine supervisor error: {e}")
+        time.sleep(ENGINE_LEASE_RETRY)
+
+def start_engine():
+    """Runs only in the worker holding the engine lease: trading bot, pollers and market stream"""
+    threading.Thread(target=update_positions_cache, daemon=True).start()
+    # Contract metadata index: warm start from disk, bulk refresh in background
+    contract_index.start_background_refresh()
+    # Shared price book: one bulk tickers request feeds every price read
+    price_book.start_background_refresh()
+    if USE_MARKET_STREAM:
+        market_stream.set_symbols(current_trading_symbol)
+        market_stream.start()
+    # SAR directions for the top gainers, one batched pass per timeframe
+    if data_fetcher:
+        data_fetcher.start_scanner()
+    # Followers no longer poll Gate.io: the engine refreshes top gainers on a jittered schedule with backoff
+    gainers_refresher.start()
+    # Автоматически стартуем бота (auto_start_bot), затем следим за bot_enabled
+    threading.Thread(target=engine_supervisor, daemon=True).start()
+    # One /api/status payload per tick, served to every worker's clients
+    threading.Thread(target=status_builder, daemon=True).start()
+
 init_data_fetcher()
 init_telegram()
-# Запускаем загрузку TOP gainers в фоне перед автостартом бота
-threading.Thread(target=fetch_top_gainers_background, daemon=True).start()
-time.sleep(1)
 # Автоматическое подключение к API если secrets есть
 auto_authenticate_api()
-auto_start_bot()
+# ✅ Exactly one gunicorn worker runs the engine; the rest serve its snapshot and take over if it dies
+engine_lease.campaign(start_engine)
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))  # Railway uses PORT env var, default 5000 for Replit
@@ -0,0 +1,237 @@
+import sys
+import json
+import time
+import logging
+import argparse
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+import pandas as pd
+
+from candle_cache import timeframe_seconds
+from candle_store import candle_store
+from psar_engine import PSAR_STEP, PSAR_MAX_STEP
+from psar_scanner import psar_step
+
+LEVELS = ("1m", "5m", "15m", "30m", "1h")
+COOLDOWN_SECONDS = 20        # Пауза после закрытия, как в strategy_loop
+START_BANK = 100.0
+POSITION_PERCENT = 1.0       # Маржа = весь баланс, как в compute_order_size_usdt
+
+
+def psar_states(high, low, close, step=PSAR_STEP, max_step=PSAR_MAX_STEP):
+    """
+    Состояние PSAR после каждой закрытой свечи (та же рекурсия, что в
+    StreamingPSAR): массивы sar, up, af, up_high, down_low. Один проход
+    по свечам таймфрейма, скалярный - баров 1h за год меньше 10 тысяч.
+    """
+    n = len(close)
+    out = {name: np.empty(n) for name in ("sar", "af", "up_high", "down_low")}
+    out["up"] = np.empty(n, dtype=bool)
+    if n == 0:
+        return out
+    high, low, close = high.tolist(), low.tolist(), close.tolist()
+    sar, up, af, up_high, down_low = close[0], True, step, high[0], low[0]
+    for i in range(n):
+        h, l = high[i], low[i]
+        if i == 1:
+            sar = close[1]
+        elif i >= 2:
+            if up:
+                sar = sar + af * (up_high - sar)
+                if l < sar:
+                    up, sar, down_low, af = False, up_high, l, step
+                else:
+                    if h > up_high:
+                        up_high, af = h, min(af + step, max_step)
+                    if low[i - 2] < sar:
+                        sar = low[i - 2]
+                    elif low[i - 1] < sar:
+                        sar = low[i - 1]
+            else:
+                sar = sar - af * (sar - down_low)
+                if h > sar:
+                    up, sar, up_high, af = True, down_low, h, step
+                else:
+                    if l < down_low:
+                        down_low, af = l, min(af + step, max_step)
+                    if high[i - 2] > sar:
+                        sar = high[i - 2]
+                    elif high[i - 1] > sar:
+                        sar = high[i - 1]
+        out["sar"][i], out["up"][i], out["af"][i] = sar, up, af
+        out["up_high"][i], out["down_low"][i] = up_high, down_low
+    return out
+
+
+def level_directions(candles, tf, step=PSAR_STEP, max_step=PSAR_MAX_STEP):
+    """
+    Направление уровня tf на закрытии каждой 1m свечи: +1 long, -1 short, 0 - нет сигнала.
+
+    Как в живом цикле, свеча tf в этот момент еще не закрыта: ее high/low -
+    накопленные экстремумы 1m свечей, close - текущая цена; SAR считается
+    поверх состояния после предыдущей закрытой свечи tf (psar_step по всем
+    минутам сразу).
+    """
+    ts, high, low, close = candles[:, 0], candles[:, 2], candles[:, 3], candles[:, 4]
+    period_ms = timeframe_seconds(tf) * 1000
+    bucket = ts // period_ms
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    bar = np.cumsum(np.r_[True, bucket[1:] != bucket[:-1]]) - 1  # Номер свечи tf для каждой минуты
+    ends = np.r_[starts[1:], len(ts)] - 1
+    bar_high = np.maximum.reduceat(high, starts)
+    bar_low = np.minimum.reduceat(low, starts)
+    bar_close = close[ends]
+    part_high = pd.Series(high).groupby(bar).cummax().to_numpy()
+    part_low = pd.Series(low).groupby(bar).cummin().to_numpy()
+
+    state = psar_states(bar_high, bar_low, bar_close, step, max_step)
+    prev = np.maximum(bar - 1, 0)
+    prev2 = np.maximum(bar - 2, 0)
+    sar, _, _, _, _ = psar_step(state["sar"][prev], state["up"][prev], state["af"][prev],
+                                state["up_high"][prev], state["down_low"][prev],
+                                bar_high[prev], bar_high[prev2], bar_low[prev], bar_low[prev2],
+                                part_high, part_low, close, step, max_step)
+    directions = np.where(close > sar, 1, -1).astype(np.int8)
+    directions[bar < 4] = 0  # Меньше 5 свечей tf - нет сигнала (как StreamingPSAR.direction)
+    return directions
+
+
+def change_points(directions):
+    """Индексы минут, где направление уровня сменилось: {tf: ndarray}"""
+    return {tf: np.flatnonzero(np.diff(levels) != 0) + 1 for tf, levels in directions.items()}
+
+
+def find_trades(ts, directions, open_levels, close_levels, cooldown=COOLDOWN_SECONDS, changes=None):
+    """
+    Сделки по сигналам {tf: level_directions}: (entry, exit, side) индексами минут.
+
+    Цикл идет по сделкам, не по тикам: следующий вход и первая смена любого
+    close_level после него ищутся бинарным поиском по заранее найденным
+    точкам. changes - готовые change_points(directions) (для перебора параметров).
+    """
+    stacked = np.stack([directions[tf] for tf in open_levels])
+    aligned = (stacked[0] != 0) & (stacked == stacked[0]).all(axis=0)
+    entries = np.flatnonzero(aligned).tolist()
+    changes = changes or change_points({tf: directions[tf] for tf in close_levels})
+    # Выход - первая смена любого close_level: одна объединенная шкала вместо min по уровням
+    exits = np.unique(np.concatenate([changes[tf] for tf in close_levels])).tolist()
+    sides = stacked[0]
+    cooldown_ms = cooldown * 1000
+
+    opened, closed = [], []
+    t = 0
+    while True:
+        pos = bisect_left(entries, t)
+        if pos >= len(entries):
+            break
+        entry = entries[pos]
+        pos = bisect_right(exits, entry)
+        if pos >= len(exits):
+            break  # Позиция открыта до конца данных - в статистику не идет
+        exit_ = exits[pos]
+        opened.append(entry)
+        closed.append(exit_)
+        t = exit_ + 1
+        while t < len(ts) and ts[t] < ts[exit_] + cooldown_ms:
+            t += 1
+    opened, closed = np.array(opened, dtype=int), np.array(closed, dtype=int)
+    return opened, closed, sides[opened].astype(int)
+
+
+def score(ts, price, trades, leverage=10, bank=START_BANK, position_percent=POSITION_PERCENT, fee_rate=0.0):
+    """Сделки -> P&L, баланс, просадка, доля прибыльных (векторно по сделкам)"""
+    opened, closed, sides = trades
+    entry_price, exit_price = price[opened], price[closed]
+    # Доходность на маржу: плечо x движение цены - комиссии, убыток ограничен маржой (ликвидация)
+    ret = sides * (exit_price / entry_price - 1) * leverage - 2 * fee_rate * leverage
+    ret = np.maximum(ret, -1.0)
+    equity = np.r_[bank, bank * np.cumprod(1 + position_percent * ret)]
+    pnl = np.diff(equity)
+    drawdown = 1 - equity / np.maximum.accumulate(equity)
+    return {
+        "trades": int(len(opened)),
+        "pnl": round(float(equity[-1] - bank), 4),
+        "final_balance": round(float(equity[-1]), 4),
+        "return_pct": round(float(equity[-1] / bank - 1) * 100, 2),
+        "max_drawdown_pct": round(float(drawdown.max()) * 100, 2),
+        "hit_rate": round(float((pnl > 0).mean()) * 100, 2) if len(pnl) else None,
+        "avg_duration_min": round(float((ts[closed] - ts[opened]).mean()) / 60000, 2) if len(opened) else None,
+        "pnl_list": pnl,
+    }
+
+
+def backtest(candles, open_levels, close_levels, leverage=10, bank=START_BANK,
+             position_percent=POSITION_PERCENT, cooldown=COOLDOWN_SECONDS, fee_rate=0.0,
+             step=PSAR_STEP, max_step=PSAR_MAX_STEP, directions=None):
+    """
+    Прогон правил strategy_loop по 1m свечам [ts, open, high, low, close, volume].
+
+    Открытие - все open_levels в одну сторону, закрытие - любой close_level
+    отличается от своего направления при открытии, COOLDOWN_SECONDS после
+    закрытия, убыток сделки не больше маржи. Сигналы считаются векторно для
+    всех минут (level_directions), сделки - find_trades, итог - score.
+    directions - уже посчитанные {tf: level_directions} (для перебора параметров).
+    """
+    started = time.time()
+    candles = np.asarray(candles, dtype=float)
+    if directions is None:
+        directions = {tf: level_directions(candles, tf, step, max_step) for tf in set(open_levels) | set(close_levels)}
+    ts, price = candles[:, 0], candles[:, 4]
+    opened, closed, sides = trades = find_trades(ts, directions, open_levels, close_levels, cooldown)
+    result = score(ts, price, trades, leverage, bank, position_percent, fee_rate)
+    pnl = result.pop("pnl_list")
+    result.update({
+        "candles": int(len(candles)),
+        "open_levels": list(open_levels),
+        "close_levels": list(close_levels),
+        "leverage": leverage,
+        "elapsed": round(time.time() - started, 3),
+        "trade_list": [
+            {"entry_time": int(ts[o]), "exit_time": int(ts[c]), "side": "long" if s > 0 else "short",
+             "entry_price": float(price[o]), "exit_price": float(price[c]), "pnl": round(float(p), 4)}
+            for o, c, s, p in zip(opened.tolist(), closed.tolist(), sides.tolist(), pnl.tolist())
+        ],
+    })
+    return result
+
+
+def fetch_history(exchange, symbol, since, until=None, tf="1m", store=None):
+    """
+    Свечи symbol с since (мс) до until -> ndarray (N x 6). Читаются из
+    локального хранилища свечей; с биржи докачиваются только недостающие диапазоны.
+    """
+    def fetch(timeframe, start, limit):
+        return exchange.fetch_ohlcv(symbol, timeframe=timeframe, since=start, limit=limit)
+    return (store or candle_store).history(symbol, tf, since, until, fetch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest open_levels/close_levels PSAR strategy on 1m candles")
+    parser.add_argument("symbol", help="Gate.io pair, e.g. XNY_USDT")
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--open", default="5m,30m", help="open_levels, comma separated")
+    parser.add_argument("--close", default="5m", help="close_levels, comma separated")
+    parser.add_argument("--leverage", type=int, default=10)
+    parser.add_argument("--fee", type=float, default=0.0, help="Taker fee rate per side, e.g. 0.0005")
+    parser.add_argument("--trades", action="store_true", help="Print every trade")
+    args = parser.parse_args(argv)
+
+    from exchange_gateway import get_exchange
+    from contract_index import normalize_symbol
+
+    base, quote = normalize_symbol(args.symbol).split("_")
+    since = int((time.time() - args.days * 86400) * 1000)
+    loaded = time.time()
+    candles = fetch_history(get_exchange(), f"{base}/{quote}:{quote}", since)
+    logging.info(f"Loaded {len(candles)} 1m candles in {time.time() - loaded:.1f}s")
+    result = backtest(candles, args.open.split(","), args.close.split(","), leverage=args.leverage, fee_rate=args.fee)
+    if not args.trades:
+        result.pop("trade_list")
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    main()
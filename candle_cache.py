@@ -0,0 +1,178 @@
+import time
+import threading
+import logging
+from collections import deque
+
+TIMEFRAME_SECONDS = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400, "1d": 86400}
+
+
+def timeframe_seconds(tf):
+    """'5m' -> 300, '1h' -> 3600"""
+    if tf in TIMEFRAME_SECONDS:
+        return TIMEFRAME_SECONDS[tf]
+    unit = tf[-1]
+    value = int(tf[:-1])
+    return value * {"m": 60, "h": 3600, "d": 86400}.get(unit, 60)
+
+
+def next_candle_boundary(tf, now=None):
+    """Unix-время (сек) закрытия текущей свечи таймфрейма"""
+    now = time.time() if now is None else now
+    period = timeframe_seconds(tf)
+    return (int(now) // period + 1) * period
+
+
+class _Series:
+    """Кольцевой буфер свечей одной пары (symbol, timeframe)"""
+
+    def __init__(self, maxlen, symbol=None):
+        self.symbol = symbol
+        self.rows = deque(maxlen=maxlen)
+        self.expires = 0.0
+        self.lock = threading.Lock()
+
+
+class CandleCache:
+    """
+    Общий кэш OHLCV по (symbol, timeframe).
+
+    Закрытые свечи хранятся в кольцевом буфере и больше не запрашиваются;
+    при обновлении с биржи скачиваются только свечи начиная с последней
+    (незакрытой) свечи через since=. Незакрытая свеча живет не дольше
+    live_ttl секунд и всегда обновляется сразу после границы свечи.
+    Все потребители (strategy_loop, /api/status, /api/chart_data, /api/debug_sar)
+    читают из памяти, параллельные запросы одной пары ждут один fetch.
+    С store (CandleStore) закрытые свечи сохраняются на диск, а пустая
+    серия после рестарта поднимается из локальной истории и докачивает
+    с биржи только хвост.
+    """
+
+    def __init__(self, maxlen=500, live_ttl=5.0, store=None):
+        self.maxlen = maxlen
+        self.live_ttl = live_ttl
+        self.store = store
+        self._series = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "incremental": 0, "full": 0, "warm": 0}
+
+    def _get_series(self, symbol, tf):
+        key = (symbol, tf)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = _Series(self.maxlen, symbol)
+                self._series[key] = series
+            return series
+
+    def get(self, symbol, tf, limit, fetch):
+        """
+        Вернуть последние limit свечей [ts, open, high, low, close, volume].
+        fetch(since, limit) - функция запроса к бирже (since=None для полного окна).
+        """
+        series = self._get_series(symbol, tf)
+        with series.lock:
+            now = time.time()
+            if len(series.rows) >= limit and now < series.expires:
+                self.stats["hits"] += 1
+                return list(series.rows)[-limit:]
+            self._refresh(series, tf, limit, fetch, now)
+            return list(series.rows)[-limit:]
+
+    def _warm_start(self, series, tf, now):
+        """Пустая серия: последние закрытые свечи из локальной истории, если она не старше буфера"""
+        period_ms = timeframe_seconds(tf) * 1000
+        try:
+            stored = self.store.tail(series.symbol, tf, self.maxlen)
+        except Exception as e:
+            logging.debug(f"Candle store read failed for {series.symbol} {tf}: {e}")
+            return
+        if stored and now * 1000 - stored[-1][0] < self.maxlen * period_ms:
+            series.rows.extend(stored)
+            self.stats["warm"] += 1
+
+    def _refresh(self, series, tf, limit, fetch, now):
+        period_ms = timeframe_seconds(tf) * 1000
+        rows = series.rows
+        if not rows and self.store is not None:
+            self._warm_start(series, tf, now)
+        if len(rows) < limit:
+            fresh = fetch(None, min(max(limit, len(rows)), self.maxlen))
+            self.stats["full"] += 1
+            if fresh:
+                rows.clear()
+                rows.extend(list(r) for r in fresh)
+        else:
+            last_ts = rows[-1][0]
+            missed = int((now * 1000 - last_ts) // period_ms) + 2
+            fresh = fetch(last_ts, min(missed, self.maxlen))
+            self.stats["incremental"] += 1
+            if fresh and fresh[0][0] > last_ts + period_ms:
+                # Разрыв: пропущено больше свечей, чем вернула биржа - полная перезагрузка
+                logging.debug(f"Candle gap for {tf}: last={last_ts}, got={fresh[0][0]} - full refetch")
+                fresh = fetch(None, min(max(limit, len(rows)), self.maxlen))
+                self.stats["full"] += 1
+                if fresh:
+                    rows.clear()
+                    rows.extend(list(r) for r in fresh)
+            elif fresh:
+                self._merge(rows, fresh)
+        if fresh and self.store is not None:
+            # Окно запроса и свеча перед ним: она могла только что отстояться (CANDLE_STORE_SETTLE_PERIODS)
+            self.store.record(series.symbol, tf, rows[-len(fresh) - 1:], now)
+        series.expires = min(now + self.live_ttl, next_candle_boundary(tf, now))
+
+    def _merge(self, rows, fresh):
+        """Заменить свечи с совпадающим timestamp и дописать новые"""
+        first_ts = fresh[0][0]
+        while rows and rows[-1][0] >= first_ts:
+            rows.pop()
+        rows.extend(list(r) for r in fresh)
+
+    def apply(self, symbol, tf, row):
+        """
+        Свеча из потока (WebSocket): заменить свечу с тем же timestamp или
+        дописать следующую. Пока приходят обновления, серия считается свежей;
+        при разрыве серия помечается устаревшей и докачивается через REST.
+        Возвращает True, если свеча принята.
+        """
+        with self._lock:
+            series = self._series.get((symbol, tf))
+        if series is None:
+            return False
+        period_ms = timeframe_seconds(tf) * 1000
+        with series.lock:
+            rows = series.rows
+            if not rows:
+                return False
+            last_ts = rows[-1][0]
+            if row[0] == last_ts:
+                rows[-1] = list(row)
+            elif row[0] == last_ts + period_ms:
+                rows.append(list(row))
+                if self.store is not None:
+                    self.store.record(symbol, tf, rows[-3:-1])  # Сохраняются только отстоявшиеся свечи
+            elif row[0] < last_ts:
+                return False  # Запоздавший кадр
+            else:
+                series.expires = 0.0
+                return False
+            now = time.time()
+            series.expires = max(series.expires, min(now + self.live_ttl, next_candle_boundary(tf, now)))
+            self.stats["pushed"] = self.stats.get("pushed", 0) + 1
+            return True
+
+    def expire(self, symbol=None):
+        """Пометить серии устаревшими (свечи остаются, следующий get докачает через since=)"""
+        with self._lock:
+            series_list = [s for k, s in self._series.items() if symbol is None or k[0] == symbol]
+        for series in series_list:
+            series.expires = 0.0
+
+    def invalidate(self, symbol=None):
+        """Сбросить кэш пары (или весь кэш)"""
+        with self._lock:
+            if symbol is None:
+                self._series.clear()
+            else:
+                for key in [k for k in self._series if k[0] == symbol]:
+                    del self._series[key]
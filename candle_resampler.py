@@ -0,0 +1,147 @@
+import threading
+import logging
+from collections import deque
+from concurrent.futures import wait
+
+import numpy as np
+
+from candle_cache import timeframe_seconds
+
+
+def resample_ohlcv(rows, tf):
+    """
+    Собрать свечи таймфрейма tf из более мелких свечей (векторно, NumPy).
+    Первая корзина отбрасывается, если исходные свечи начинаются не с ее начала.
+    Последняя корзина - незакрытая свеча, как у биржи.
+    """
+    if len(rows) == 0:
+        return []
+    arr = np.asarray(rows, dtype=np.float64)[:, :6]
+    period_ms = timeframe_seconds(tf) * 1000
+    bucket = (arr[:, 0] // period_ms) * period_ms
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(arr)] - 1
+
+    out = np.empty((len(starts), 6), dtype=np.float64)
+    out[:, 0] = bucket[starts]
+    out[:, 1] = arr[starts, 1]
+    out[:, 2] = np.maximum.reduceat(arr[:, 2], starts)
+    out[:, 3] = np.minimum.reduceat(arr[:, 3], starts)
+    out[:, 4] = arr[ends, 4]
+    out[:, 5] = np.add.reduceat(arr[:, 5], starts)
+
+    if arr[0, 0] != bucket[0]:
+        out = out[1:]
+    result = out.tolist()
+    for r in result:
+        r[0] = int(r[0])
+    return result
+
+
+class _Seed:
+    """Закрытые свечи старшего таймфрейма: разовая загрузка + локально собранные бары"""
+
+    def __init__(self, maxlen):
+        self.rows = deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+
+
+class CandleResampler:
+    """
+    Один поток 1m свечей на символ, старшие таймфреймы строятся локально.
+
+    Для прогрева PSAR история старшего таймфрейма один раз скачивается с
+    биржи (seed), дальше закрытые бары дописываются из 1m потока. Все уровни
+    одного вызова get_many считаются из одного снимка 1m свечей.
+    """
+
+    def __init__(self, cache, base_tf="1m", base_limit=180, seed_maxlen=500):
+        self.cache = cache
+        self.base_tf = base_tf
+        self.base_limit = base_limit
+        self.seed_maxlen = seed_maxlen
+        self._seeds = {}
+        self._lock = threading.Lock()
+
+    def _get_seed(self, symbol, tf):
+        key = (symbol, tf)
+        with self._lock:
+            seed = self._seeds.get(key)
+            if seed is None:
+                seed = _Seed(self.seed_maxlen)
+                self._seeds[key] = seed
+            return seed
+
+    def _base(self, symbol, limit, fetch):
+        base_limit = max(limit, self.base_limit)
+        return self.cache.get(symbol, self.base_tf, base_limit,
+                              lambda since, fetch_limit: fetch(self.base_tf, since, fetch_limit))
+
+    def get(self, symbol, tf, limit, fetch):
+        """
+        Вернуть последние limit свечей tf.
+        fetch(tf, since, limit) - запрос свечей к бирже.
+        """
+        return self.get_many(symbol, [tf], limit, fetch)[tf]
+
+    def get_many(self, symbol, timeframes, limit, fetch, executor=None, timeout=None):
+        """
+        {tf: свечи} для нескольких таймфреймов из одного снимка 1m.
+        С executor загрузка seed по таймфреймам идет параллельно; таймфреймы,
+        не успевшие за timeout или упавшие с ошибкой, в результат не попадают.
+        """
+        base = self._base(symbol, limit, fetch)
+        result = {}
+        pending = {}
+        for tf in timeframes:
+            if tf == self.base_tf:
+                result[tf] = base[-limit:]
+                continue
+            local = resample_ohlcv(base, tf)
+            if executor is None:
+                result[tf] = self._merge_with_seed(symbol, tf, local, limit, fetch)
+            else:
+                pending[executor.submit(self._merge_with_seed, symbol, tf, local, limit, fetch)] = tf
+        if pending:
+            done, not_done = wait(pending, timeout=timeout)
+            for future in done:
+                tf = pending[future]
+                try:
+                    result[tf] = future.result()
+                except Exception as e:
+                    logging.error(f"Error building {tf} candles for {symbol}: {e}")
+            for future in not_done:
+                logging.warning(f"⏱️ {pending[future]} candles for {symbol} not ready after {timeout}s - skipped this cycle")
+        return result
+
+    def _merge_with_seed(self, symbol, tf, local, limit, fetch):
+        period_ms = timeframe_seconds(tf) * 1000
+        seed = self._get_seed(symbol, tf)
+        with seed.lock:
+            rows = seed.rows
+            local_start = local[0][0] if local else None
+            older = [r for r in rows if local_start is None or r[0] < local_start]
+            stale = bool(older) and local_start is not None and older[-1][0] + period_ms < local_start
+            if len(older) + len(local) < limit or stale:
+                fresh = fetch(tf, None, min(limit, self.seed_maxlen))
+                if fresh:
+                    logging.debug(f"Seeded {len(fresh)} {tf} candles for {symbol}")
+                    rows.clear()
+                    # Последняя свеча биржи незакрыта - в seed только закрытые
+                    rows.extend(list(r) for r in fresh[:-1])
+                    older = [r for r in rows if local_start is None or r[0] < local_start]
+                    if not local:
+                        return [list(r) for r in fresh[-limit:]]
+            # Закрытые локальные бары продлевают историю seed
+            for r in local[:-1]:
+                if not rows or r[0] > rows[-1][0]:
+                    rows.append(r)
+            return (older + local)[-limit:]
+
+    def invalidate(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                self._seeds.clear()
+            else:
+                for key in [k for k in self._seeds if k[0] == symbol]:
+                    del self._seeds[key]
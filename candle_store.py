@@ -0,0 +1,375 @@
+import os
+import time
+import fcntl
+import shutil
+import logging
+import threading
+
+import numpy as np
+
+from candle_cache import timeframe_seconds
+from contract_index import normalize_symbol
+
+CANDLE_STORE_DIR = os.getenv('CANDLE_STORE_DIR', 'candle_store')
+CANDLE_STORE_PAGE = 1000        # Свечей в одном запросе при догрузке истории
+CANDLE_STORE_SETTLE_PERIODS = 2  # Свеча пишется, когда с ее начала прошло столько периодов (биржа успела дописать финал)
+
+COLUMNS = (('ts', np.int64), ('open', np.float64), ('high', np.float64),
+           ('low', np.float64), ('close', np.float64), ('volume', np.float64))
+CURRENT_FILE = 'CURRENT'        # Имя каталога текущего поколения колонок
+EMPTY_FILE = 'empty.bin'        # Диапазоны [start, end), которых на бирже нет (int64 пары)
+
+
+def _subtract(ranges, spans):
+    """Диапазоны ranges [(start, end)] за вычетом отсортированных spans"""
+    result = []
+    for start, end in ranges:
+        for span_start, span_end in spans:
+            if span_end <= start or span_start >= end:
+                continue
+            if span_start > start:
+                result.append((start, span_start))
+            start = max(start, span_end)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+class _Series:
+    """
+    Файлы одной пары (symbol, timeframe): по файлу на колонку в каталоге
+    поколения, на который указывает CURRENT, общий lock-файл. Старая
+    раскладка (колонки прямо в каталоге пары) читается без CURRENT.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._maps = None
+        self._key = None
+
+    def data_path(self):
+        """Каталог текущего поколения колонок"""
+        try:
+            with open(os.path.join(self.path, CURRENT_FILE)) as f:
+                return os.path.join(self.path, f.read().strip())
+        except FileNotFoundError:
+            return self.path
+
+    def column_path(self, name, path=None):
+        return os.path.join(path or self.data_path(), f"{name}.bin")
+
+    def _stat_key(self, path):
+        try:
+            stats = [os.stat(self.column_path(name, path)) for name, _ in COLUMNS]
+        except FileNotFoundError:
+            return None
+        return (path,) + tuple((s.st_ino, s.st_size) for s in stats)
+
+    def _open(self, path, key):
+        length = min(size // np.dtype(dtype).itemsize for (_, size), (_, dtype) in zip(key[1:], COLUMNS))
+        return {name: (np.memmap(self.column_path(name, path), dtype=dtype, mode='r', shape=(length,))
+                       if length else np.empty(0, dtype=dtype))
+                for name, dtype in COLUMNS}
+
+    def columns(self):
+        """
+        {колонка: np.memmap} без копирования. Переоткрывается, только если
+        файлы выросли или заменены (дозапись/перезапись другим процессом).
+        Все колонки открываются из одного поколения; колонки обрезаются до
+        общей длины: запись, прерванная посередине, не видна.
+        """
+        for _ in range(3):
+            path = self.data_path()
+            key = self._stat_key(path)
+            try:
+                if key is not None and key != self._key:
+                    self._maps, self._key = self._open(path, key), key
+            except FileNotFoundError:
+                key = None
+            if key is not None:
+                return self._maps
+            if path == self.data_path():
+                return None
+            # Поколение сменилось между чтением CURRENT и открытием файлов - читаем новое
+        return None
+
+
+class CandleStore:
+    """
+    Локальная история OHLCV на диске по (symbol, timeframe).
+
+    Колоночный формат: ts.bin (int64) и open/high/low/close/volume.bin
+    (float64), только дозапись закрытых свечей в конец. Чтение - np.memmap
+    без копирования, диапазон по времени - бинарный поиск по ts. gaps()
+    находит пропуски, backfill() докачивает их (и начало/конец диапазона)
+    постранично с биржи. Запись защищена flock на lock-файл пары, поэтому
+    файлы могут делить все воркеры gunicorn.
+    """
+
+    def __init__(self, root=CANDLE_STORE_DIR):
+        self.root = root
+        self._series = {}
+        self._lock = threading.Lock()
+        self.stats = {"appended": 0, "rewrites": 0, "backfill_requests": 0}
+
+    def _get_series(self, symbol, tf):
+        key = (normalize_symbol(symbol).replace('/', '_'), tf)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = _Series(os.path.join(self.root, key[0], tf))
+                self._series[key] = series
+            return series
+
+    def _flock(self, series):
+        os.makedirs(series.path, exist_ok=True)
+        fd = os.open(os.path.join(series.path, '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    @staticmethod
+    def _unflock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    # ----- Чтение -----
+
+    def columns(self, symbol, tf, start=None, end=None):
+        """{колонка: срез memmap} свечей с ts в [start, end] (мс) - без копирования"""
+        series = self._get_series(symbol, tf)
+        with series.lock:
+            maps = series.columns()
+        if maps is None:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+        ts = maps['ts']
+        lo = 0 if start is None else int(np.searchsorted(ts, start, side='left'))
+        hi = len(ts) if end is None else int(np.searchsorted(ts, end, side='right'))
+        return {name: column[lo:hi] for name, column in maps.items()}
+
+    def range(self, symbol, tf, start=None, end=None):
+        """Свечи [ts, open, high, low, close, volume] в [start, end] одним массивом (N x 6)"""
+        cols = self.columns(symbol, tf, start, end)
+        return np.column_stack([cols[name].astype(np.float64) for name, _ in COLUMNS]).reshape(-1, 6)
+
+    def tail(self, symbol, tf, limit):
+        """Последние limit свечей списком строк (формат fetch_ohlcv)"""
+        cols = self.columns(symbol, tf)
+        count = len(cols['ts'])
+        rows = self.range(symbol, tf, int(cols['ts'][max(0, count - limit)]), None).tolist() if count else []
+        for row in rows:
+            row[0] = int(row[0])
+        return rows
+
+    def bounds(self, symbol, tf):
+        """(первый ts, последний ts) или (None, None)"""
+        ts = self.columns(symbol, tf)['ts']
+        return (int(ts[0]), int(ts[-1])) if len(ts) else (None, None)
+
+    def gaps(self, symbol, tf, start=None, end=None):
+        """Пропуски [(from_ts, to_ts)] - диапазоны отсутствующих свечей внутри сохраненной истории"""
+        ts = self.columns(symbol, tf, start, end)['ts']
+        period_ms = timeframe_seconds(tf) * 1000
+        holes = np.flatnonzero(np.diff(ts) > period_ms)
+        return [(int(ts[i]) + period_ms, int(ts[i + 1]) - period_ms) for i in holes]
+
+    # ----- Запись -----
+
+    def append(self, symbol, tf, rows):
+        """
+        Дописать закрытые свечи новее последней сохраненной (остальные
+        пропускаются). Возвращает число записанных свечей.
+        """
+        if not rows:
+            return 0
+        arr = np.asarray([r[:6] for r in rows], dtype=np.float64).reshape(-1, 6)
+        series = self._get_series(symbol, tf)
+        with series.lock:
+            fd = self._flock(series)
+            try:
+                maps = series.columns()
+                last = int(maps['ts'][-1]) if maps is not None and len(maps['ts']) else None
+                if last is not None:
+                    arr = arr[arr[:, 0] > last]
+                if len(arr) == 0:
+                    return 0
+                arr = arr[np.r_[True, np.diff(arr[:, 0]) > 0]]  # Строго возрастающие ts
+                length = len(maps['ts']) if maps is not None else 0
+                for i, (name, dtype) in enumerate(COLUMNS):
+                    with open(series.column_path(name), 'ab') as f:
+                        # Хвост, оставшийся от прерванной записи, отрезается до общей длины
+                        f.truncate(length * np.dtype(dtype).itemsize)
+                        f.write(arr[:, i].astype(dtype).tobytes())
+                self.stats["appended"] += len(arr)
+                return len(arr)
+            finally:
+                self._unflock(fd)
+
+    def _rewrite(self, series, arr):
+        """
+        Заменить историю пары целиком (вставка в начало или в пропуски).
+        Колонки пишутся в новый каталог поколения, CURRENT переключается одним
+        os.replace: читатель видит либо старое поколение целиком, либо новое.
+        """
+        old_path = series.data_path()
+        generation = f"gen-{time.time_ns()}"
+        new_path = os.path.join(series.path, generation)
+        os.makedirs(new_path)
+        for i, (name, dtype) in enumerate(COLUMNS):
+            with open(series.column_path(name, new_path), 'wb') as f:
+                f.write(arr[:, i].astype(dtype).tobytes())
+        tmp_path = os.path.join(series.path, f"{CURRENT_FILE}.tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(generation)
+        os.replace(tmp_path, os.path.join(series.path, CURRENT_FILE))
+        # Открытые memmap старого поколения остаются валидными и после удаления файлов
+        if old_path == series.path:
+            for name, _ in COLUMNS:
+                try:
+                    os.remove(series.column_path(name, old_path))
+                except FileNotFoundError:
+                    pass
+        for entry in os.listdir(series.path):
+            if entry.startswith('gen-') and entry != generation:
+                shutil.rmtree(os.path.join(series.path, entry), ignore_errors=True)
+        self.stats["rewrites"] += 1
+
+    def merge(self, symbol, tf, rows):
+        """Вставить свечи в любое место истории (дубликаты по ts заменяются новыми)"""
+        if not rows:
+            return 0
+        new = np.asarray([r[:6] for r in rows], dtype=np.float64).reshape(-1, 6)
+        series = self._get_series(symbol, tf)
+        with series.lock:
+            maps = series.columns()
+            if maps is None or not len(maps['ts']) or new[:, 0].min() > maps['ts'][-1]:
+                pass  # Только новые свечи - обычная дозапись
+            else:
+                fd = self._flock(series)
+                try:
+                    old = np.column_stack([series.columns()[name].astype(np.float64) for name, _ in COLUMNS])
+                    both = np.concatenate([new, old])
+                    _, first = np.unique(both[:, 0], return_index=True)  # Первое вхождение - новая свеча
+                    self._rewrite(series, both[first])
+                    return len(new)
+                finally:
+                    self._unflock(fd)
+        return self.append(symbol, tf, rows)
+
+    # ----- Пустые диапазоны -----
+
+    def _empty_spans(self, series):
+        """Диапазоны [(start, end)], которых, по ответу биржи, нет (до листинга, постоянные пропуски)"""
+        try:
+            spans = np.fromfile(os.path.join(series.path, EMPTY_FILE), dtype=np.int64).reshape(-1, 2)
+        except FileNotFoundError:
+            return []
+        return [(int(start), int(end)) for start, end in spans]
+
+    def _remember_empty(self, series, spans):
+        """Добавить подтвержденные пустые диапазоны (пересекающиеся и соседние склеиваются)"""
+        if not spans:
+            return
+        with series.lock:
+            fd = self._flock(series)
+            try:
+                merged = []
+                for start, end in sorted(self._empty_spans(series) + spans):
+                    if merged and start <= merged[-1][1]:
+                        merged[-1][1] = max(merged[-1][1], end)
+                    else:
+                        merged.append([start, end])
+                tmp_path = os.path.join(series.path, f"{EMPTY_FILE}.tmp")
+                np.asarray(merged, dtype=np.int64).tofile(tmp_path)
+                os.replace(tmp_path, os.path.join(series.path, EMPTY_FILE))
+            finally:
+                self._unflock(fd)
+
+    def _fetch_range(self, fetch, tf, since, until):
+        """Постраничная загрузка свечей [since, until) через fetch(tf, since, limit)"""
+        period_ms = timeframe_seconds(tf) * 1000
+        rows = []
+        while since < until:
+            page = fetch(tf, since, CANDLE_STORE_PAGE)
+            self.stats["backfill_requests"] += 1
+            if not page:
+                break
+            rows.extend(r for r in page if r[0] < until and (not rows or r[0] > rows[-1][0]))
+            since = page[-1][0] + period_ms
+            if len(page) < CANDLE_STORE_PAGE:
+                break
+        return rows
+
+    def backfill(self, symbol, tf, since, until, fetch):
+        """
+        Догрузить с биржи начало, пропуски и конец [since, until) (закрытые свечи).
+        Диапазоны, которых на бирже нет (до листинга, постоянные пропуски),
+        запоминаются и больше не запрашиваются. Пустым диапазон считается,
+        только если биржа не вернула в нем свечей, а более поздняя свеча
+        известна: пустой хвост может быть просто еще не опубликован.
+        """
+        period_ms = timeframe_seconds(tf) * 1000
+        until = min(until, (int(time.time() * 1000) // period_ms) * period_ms)  # Незакрытая свеча не хранится
+        series = self._get_series(symbol, tf)
+        first, last = self.bounds(symbol, tf)
+        if first is None:
+            missing = [(since, until, False)]
+        else:
+            # Справа от начала и пропусков лежит сохраненная свеча - их пустоту биржа подтверждает
+            missing = [(since, first, True)] if since < first else []
+            missing += [(start, end + period_ms, True) for start, end in self.gaps(symbol, tf, since, until)]
+            if last + period_ms < until:
+                missing.append((max(since, last + period_ms), until, False))
+        known_empty = self._empty_spans(series)
+        missing = [(start, end, bounded) for s, e, bounded in missing for start, end in _subtract([(s, e)], known_empty)]
+        fetched = 0
+        empty = []
+        for start, end, bounded in missing:
+            rows = self._fetch_range(fetch, tf, start, end)
+            if rows:
+                fetched += self.merge(symbol, tf, rows)
+            # Между известными свечами (и до первой из них) пусто, раз биржа ничего не отдала
+            edges = [start - period_ms] + [int(r[0]) for r in rows] + ([end] if bounded else [])
+            empty += [(a + period_ms, b) for a, b in zip(edges, edges[1:]) if b - a > period_ms]
+        self._remember_empty(series, empty)
+        if fetched:
+            logging.info(f"🗄️ Candle store: backfilled {fetched} {tf} candles for {symbol} ({len(missing)} ranges)")
+        return fetched
+
+    def history(self, symbol, tf, since, until=None, fetch=None):
+        """Свечи [since, until) из локальной истории; с fetch - сначала докачать недостающее"""
+        until = until or int(time.time() * 1000)
+        if fetch is not None:
+            self.backfill(symbol, tf, since, until, fetch)
+        return self.range(symbol, tf, since, until - 1)
+
+    def record(self, symbol, tf, rows, now=None):
+        """
+        Живой путь: из окна свечей сохранить только отстоявшиеся (CANDLE_STORE_SETTLE_PERIODS
+        после начала) - только что закрытая свеча может еще не иметь финальных значений.
+        Если окно принесло другие значения для последней сохраненной свечи, она заменяется.
+        """
+        if not rows:
+            return 0
+        period_ms = timeframe_seconds(tf) * 1000
+        now_ms = (time.time() if now is None else now) * 1000
+        closed = [r for r in rows if r[0] + CANDLE_STORE_SETTLE_PERIODS * period_ms <= now_ms]
+        if not closed:
+            return 0
+        try:
+            cols = self.columns(symbol, tf)
+            if len(cols['ts']):
+                last = int(cols['ts'][-1])
+                stored = [float(cols[name][-1]) for name, _ in COLUMNS[1:]]
+                revised = [r for r in closed if r[0] == last and [float(v) for v in r[1:6]] != stored]
+                if revised:
+                    self.merge(symbol, tf, revised)
+            return self.append(symbol, tf, closed)
+        except Exception as e:
+            logging.debug(f"Candle store append failed for {symbol} {tf}: {e}")
+            return 0
+
+
+candle_store = CandleStore()
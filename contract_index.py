@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import logging
+import threading
+
+import requests
+
+GATE_DEFAULT_REST_URL = 'https://api.gateio.ws/api/v4'
+GATE_REST_URL = os.getenv('GATE_REST_URL', GATE_DEFAULT_REST_URL).rstrip('/')  # Локальная подмена: gate_stub.py
+CONTRACTS_URL = f'{GATE_REST_URL}/futures/usdt/contracts'
+CONTRACTS_CACHE_FILE = 'gate_contracts_cache.json'
+CONTRACTS_REFRESH_SECONDS = 3600
+CONTRACTS_RELOAD_SECONDS = 30         # Как часто проверять, не обновил ли файл индекса другой процесс
+CONTRACTS_MISS_FETCH_SECONDS = 60     # Не чаще одного запроса /contracts на неизвестную пару
+
+
+def normalize_symbol(symbol):
+    """'XNY/USDT:USDT' или 'XNY/USDT' -> 'XNY_USDT' (формат Gate.io)"""
+    if not symbol:
+        return symbol
+    if '/' in symbol:
+        base, quote = symbol.split(':')[0].split('/')
+        return f"{base}_{quote}"
+    return symbol
+
+
+def _float(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class ContractIndex:
+    """
+    Индекс метаданных фьючерсных контрактов Gate.io по имени XNY_USDT.
+
+    Строится из одного запроса /futures/usdt/contracts, обновляется в фоне,
+    сохраняется на диск для теплого старта. Чтение - O(1) поиск в dict,
+    без load_markets() и сетевых запросов. Процессы без фонового обновления
+    (воркеры без аренды движка) перечитывают файл, когда меняется его mtime;
+    неизвестная пара (новый листинг) - один запрос /contracts, а не default.
+    """
+
+    def __init__(self, path=CONTRACTS_CACHE_FILE, refresh_seconds=CONTRACTS_REFRESH_SECONDS):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._contracts = {}
+        self.updated_at = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._mtime = None
+        self._checked_at = 0
+        self._miss_fetched_at = 0
+        self.load_from_disk()
+
+    def __len__(self):
+        return len(self._contracts)
+
+    @staticmethod
+    def parse_contract(contract):
+        """Контракт из API Gate.io -> компактная запись индекса"""
+        return {
+            'name': contract.get('name'),
+            'contract_size': _float(contract.get('quanto_multiplier'), 1.0),
+            'min_order': _float(contract.get('order_size_min'), 1.0),
+            'max_order': _float(contract.get('order_size_max')),
+            'tick_size': _float(contract.get('order_price_round')),
+            'leverage_min': _float(contract.get('leverage_min')),
+            'leverage_max': _float(contract.get('leverage_max')),
+            'in_delisting': bool(contract.get('in_delisting', False)),
+        }
+
+    def ingest(self, contracts, save=True):
+        """Заменить индекс списком контрактов (ответ /futures/usdt/contracts)"""
+        index = {}
+        for contract in contracts or []:
+            name = contract.get('name')
+            if name:
+                index[name] = self.parse_contract(contract)
+        if not index:
+            return 0
+        with self._lock:
+            self._contracts = index
+            self.updated_at = time.time()
+        if save:
+            self.save_to_disk()
+        return len(index)
+
+    def refresh(self):
+        """Скачать все контракты одним запросом"""
+        try:
+            response = requests.get(CONTRACTS_URL, timeout=10)
+            if response.status_code != 200:
+                logging.error(f"Gate.io contracts API error: {response.status_code}")
+                return False
+            count = self.ingest(response.json())
+            logging.info(f"📇 Contract index refreshed: {count} contracts")
+            return True
+        except Exception as e:
+            logging.warning(f"Contract index refresh failed: {e}")
+            return False
+
+    def save_to_disk(self):
+        """Атомарная запись (временный файл + os.replace)"""
+        try:
+            with self._lock:
+                payload = {'updated_at': self.updated_at, 'contracts': self._contracts}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(payload, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime
+        except Exception as e:
+            logging.debug(f"Could not save contract index: {e}")
+
+    def load_from_disk(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, 'r') as f:
+                payload = json.load(f)
+            self._mtime = mtime
+            with self._lock:
+                self._contracts = payload.get('contracts', {})
+                self.updated_at = payload.get('updated_at', 0)
+            logging.info(f"📇 Contract index loaded from disk: {len(self._contracts)} contracts")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug(f"Could not load contract index: {e}")
+
+    def is_stale(self):
+        return time.time() - self.updated_at > self.refresh_seconds
+
+    def reload_if_changed(self, force=False):
+        """Перечитать файл, если его записал другой процесс (проверка mtime не чаще CONTRACTS_RELOAD_SECONDS)"""
+        now = time.time()
+        if not force and now - self._checked_at < CONTRACTS_RELOAD_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load_from_disk()
+
+    def get(self, symbol, fetch_missing=True):
+        """Метаданные контракта или None (промах: свежий файл, затем один запрос /contracts)"""
+        self.reload_if_changed()
+        name = normalize_symbol(symbol)
+        contract = self._contracts.get(name)
+        if contract is None and fetch_missing:
+            self.reload_if_changed(force=True)
+            contract = self._contracts.get(name)
+            if contract is None and time.time() - self._miss_fetched_at > CONTRACTS_MISS_FETCH_SECONDS:
+                self._miss_fetched_at = time.time()
+                logging.info(f"📇 {name} not in contract index - fetching contracts")
+                if self.refresh():
+                    contract = self._contracts.get(name)
+        return contract
+
+    def contracts(self):
+        """Все контракты в порядке /futures/usdt/contracts (записи индекса, поле name)"""
+        self.reload_if_changed()
+        return list(self._contracts.values())
+
+    def contract_size(self, symbol, default=1.0, fetch_missing=True):
+        contract = self.get(symbol, fetch_missing)
+        if contract and contract.get('contract_size'):
+            return contract['contract_size']
+        return default
+
+    def _refresh_loop(self):
+        while True:
+            if self.is_stale():
+                self.refresh()
+            time.sleep(60)
+
+    def start_background_refresh(self):
+        """Фоновое обновление индекса (один поток на процесс)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name="contract-index", daemon=True)
+            self._thread.start()
+
+
+contract_index = ContractIndex()
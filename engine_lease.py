@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import fcntl
+import socket
+import logging
+import threading
+
+ENGINE_LOCK_FILE = os.getenv('ENGINE_LOCK_FILE', 'goldantelopegate_engine.lock')
+ENGINE_SNAPSHOT_FILE = os.getenv('ENGINE_SNAPSHOT_FILE', 'goldantelopegate_engine_snapshot.json')
+ENGINE_LEASE_RETRY = float(os.getenv('ENGINE_LEASE_RETRY', '2'))  # Секунд между попытками взять аренду
+
+
+class EngineLease:
+    """
+    Аренда торгового движка: из всех воркеров gunicorn только один держит
+    fcntl.flock на ENGINE_LOCK_FILE и запускает бота и фоновые опросы.
+    Блокировку снимает ядро при смерти процесса, поэтому остальные
+    воркеры, повторяя попытку каждые retry секунд, подхватывают движок
+    автоматически.
+    """
+
+    def __init__(self, path=ENGINE_LOCK_FILE, retry=ENGINE_LEASE_RETRY):
+        self.path = path
+        self.retry = retry
+        self._fd = None
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.acquired_at = None
+
+    @property
+    def is_leader(self):
+        return self._fd is not None and self._pid == os.getpid()
+
+    def try_acquire(self):
+        """Неблокирующая попытка стать лидером"""
+        with self._lock:
+            if self.is_leader:
+                return True
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            os.ftruncate(fd, 0)
+            os.write(fd, json.dumps({'pid': os.getpid(), 'host': socket.gethostname(),
+                                     'acquired_at': time.time()}).encode())
+            self._fd = fd
+            self._pid = os.getpid()
+            self.acquired_at = time.time()
+            return True
+
+    def leader_info(self):
+        """Кто держит аренду (pid, host, acquired_at) - по содержимому lock-файла"""
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def _campaign(self, on_elected):
+        while not self.try_acquire():
+            time.sleep(self.retry)
+        logging.info(f"👑 Engine lease acquired by pid {os.getpid()} - running trading engine in this worker")
+        try:
+            on_elected()
+        except Exception as e:
+            logging.error(f"Engine start error: {e}", exc_info=True)
+
+    def campaign(self, on_elected):
+        """Стать лидером сейчас или позже (failover) и один раз вызвать on_elected()"""
+        if self.try_acquire():
+            self._campaign(on_elected)
+            return True
+        logging.info(f"Engine lease held by {self.leader_info()} - pid {os.getpid()} serves the shared snapshot")
+        self._thread = threading.Thread(target=self._campaign, args=(on_elected,), name="engine-lease", daemon=True)
+        self._thread.start()
+        return False
+
+
+class SharedSnapshot:
+    """
+    Снимок данных движка (позиции, топ-гейнеры, цены) для воркеров без
+    аренды. Лидер публикует его атомарно (временный файл + os.replace),
+    читатели перечитывают файл только при изменении mtime.
+    """
+
+    def __init__(self, path=ENGINE_SNAPSHOT_FILE):
+        self.path = path
+        self._mtime = None
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def publish(self, **sections):
+        """Обновить разделы снимка и записать его"""
+        with self._lock:
+            self._data.update(sections)
+            self._data['published_at'] = time.time()
+            self._data['leader_pid'] = os.getpid()
+            payload = json.dumps(self._data, default=str, separators=(',', ':'))
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.debug(f"Could not publish engine snapshot: {e}")
+
+    def read(self):
+        """Последний опубликованный снимок (dict, пустой - если его еще нет)"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    with open(self.path, 'r') as f:
+                        self._data = json.load(f)
+                    self._mtime = mtime
+                except Exception as e:
+                    logging.debug(f"Could not read engine snapshot: {e}")
+            return self._data
+
+
+engine_lease = EngineLease()
+engine_snapshot = SharedSnapshot()
@@ -0,0 +1,166 @@
+import os
+import asyncio
+import atexit
+import inspect
+import logging
+import threading
+
+import ccxt.async_support as ccxt_async
+
+from contract_index import GATE_REST_URL, GATE_DEFAULT_REST_URL
+
+REQUEST_TIMEOUT = 10  # Секунд на один запрос к Gate.io
+
+
+def rebase_urls(urls, base):
+    """URL-ы API ccxt (вложенные dict) с базой Gate.io, замененной на base (GATE_REST_URL)"""
+    if isinstance(urls, dict):
+        return {name: rebase_urls(value, base) for name, value in urls.items()}
+    if isinstance(urls, str):
+        return urls.replace(GATE_DEFAULT_REST_URL, base)
+    return urls
+
+
+class GatewayClient:
+    """
+    Синхронный фасад над общим async-клиентом ccxt.
+
+    Повторяет интерфейс ccxt.gateio (gate): корутины (fetch_positions, create_order,
+    load_markets, ...) выполняются в event loop шлюза и возвращают результат,
+    обычные атрибуты (markets, id, ...) читаются напрямую. Безопасен для
+    вызова из любых потоков (Flask, strategy_loop, фоновые кэши).
+    """
+
+    def __init__(self, gateway, key):
+        self._gateway = gateway
+        self._key = key
+
+    def _resolve(self):
+        return self._gateway._get_exchange(self._key)
+
+    def __getattr__(self, name):
+        attr = getattr(self._resolve(), name)
+        if inspect.iscoroutinefunction(attr):
+            def call(*args, **kwargs):
+                return self._gateway.run(attr(*args, **kwargs))
+            call.__name__ = name
+            return call
+        return attr
+
+    def load_markets(self, reload=False, params={}):
+        """Рынки загружаются один раз на процесс и общие для всех клиентов"""
+        return self._gateway.load_markets(self._key, reload=reload)
+
+
+class ExchangeGateway:
+    """
+    Один долгоживущий async-клиент Gate.io (ccxt.async_support) на процесс
+    и набор ключей API. Event loop крутится в отдельном daemon-потоке;
+    aiohttp-сессия клиента держит keep-alive соединения, поэтому запросы
+    не платят за TLS-рукопожатие. Рынки загружаются один раз и раздаются
+    всем клиентам шлюза.
+    """
+
+    def __init__(self, timeout=REQUEST_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._exchanges = {}
+        self._markets = None
+        self._markets_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            # После fork (gunicorn) loop родителя в дочернем процессе не работает
+            if self._loop is not None and self._pid == os.getpid():
+                return self._loop
+            self._loop = asyncio.new_event_loop()
+            self._pid = os.getpid()
+            self._exchanges = {}
+            self._markets = None
+            self._thread = threading.Thread(target=self._loop.run_forever, name="exchange-gateway", daemon=True)
+            self._thread.start()
+            logging.info("Exchange gateway event loop started")
+            return self._loop
+
+    def run(self, coro, timeout=None):
+        """Выполнить корутину в loop шлюза и дождаться результата"""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        return future.result(timeout=timeout or self.timeout * 3)
+
+    def _get_exchange(self, key):
+        loop = self._ensure_loop()
+        with self._lock:
+            exchange = self._exchanges.get(key)
+            if exchange is None:
+                api_key, api_secret = key
+                exchange = ccxt_async.gate({
+                    "apiKey": api_key,
+                    "secret": api_secret,
+                    "sandbox": False,
+                    "enableRateLimit": True,
+                    "timeout": self.timeout * 1000,
+                    "asyncio_loop": loop,
+                    "options": {"defaultType": "swap"},
+                })
+                if GATE_REST_URL != GATE_DEFAULT_REST_URL:
+                    exchange.urls['api'] = rebase_urls(exchange.urls['api'], GATE_REST_URL)
+                if self._markets is not None:
+                    exchange.set_markets(self._markets)
+                self._exchanges[key] = exchange
+            return exchange
+
+    def client(self, api_key="", api_secret=""):
+        """Клиент для пары ключей (пустые ключи - публичные данные)"""
+        return GatewayClient(self, ((api_key or "").strip(), (api_secret or "").strip()))
+
+    def load_markets(self, key=("", ""), reload=False):
+        """Загрузить рынки один раз на процесс и раздать всем клиентам"""
+        exchange = self._get_exchange(key)
+        with self._markets_lock:
+            if self._markets is not None and not reload:
+                if exchange.markets is None:
+                    exchange.set_markets(self._markets)
+                return self._markets
+            markets = self.run(exchange.load_markets(reload))
+            self._markets = markets
+            with self._lock:
+                others = [ex for ex in self._exchanges.values() if ex is not exchange]
+            for ex in others:
+                ex.set_markets(markets)
+            return markets
+
+    def close(self):
+        """Закрыть aiohttp-сессии всех клиентов"""
+        with self._lock:
+            loop = self._loop
+            exchanges = list(self._exchanges.values())
+            self._exchanges = {}
+            if loop is None or self._pid != os.getpid():
+                return
+        for exchange in exchanges:
+            try:
+                asyncio.run_coroutine_threadsafe(exchange.close(), loop).result(timeout=5)
+            except Exception as e:
+                logging.debug(f"Exchange close error: {e}")
+
+
+_gateway = ExchangeGateway()
+atexit.register(_gateway.close)
+
+
+def get_gateway():
+    """Общий шлюз процесса"""
+    return _gateway
+
+
+def get_exchange(api_key=None, api_secret=None):
+    """Клиент Gate.io для ключей (по умолчанию - из GATE_API_KEY/GATE_API_SECRET)"""
+    if api_key is None:
+        api_key = os.getenv("GATE_API_KEY", "")
+    if api_secret is None:
+        api_secret = os.getenv("GATE_API_SECRET", "")
+    return _gateway.client(api_key, api_secret)
@@ -0,0 +1,197 @@
+import os
+import bisect
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+GAINERS_TOP_N = int(os.getenv('GAINERS_TOP_N', '20'))         # Размер "топа" для entered/left в диффах
+GAINERS_HISTORY = int(os.getenv('GAINERS_HISTORY', '30'))     # Сколько прошлых версий держать для ?since=
+
+COLUMNS = ('symbol', 'coin', 'price', 'change', 'volume', 'gecko_rank')
+
+
+def _floats(values, default=np.nan):
+    """Строки/числа из JSON -> float64 одним вызовом; битые значения -> default"""
+    try:
+        return np.array([default if v is None or v == '' else v for v in values], dtype=float)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').fillna(default).to_numpy(dtype=float)
+
+
+def _ascii(strings):
+    """Маска строк только из ASCII: максимум кода символа по UCS-4 представлению < 128"""
+    if strings.size == 0 or strings.dtype.itemsize == 0:
+        return np.ones(len(strings), dtype=bool)
+    return np.ascontiguousarray(strings).view(np.uint32).reshape(len(strings), -1).max(axis=1) < 128
+
+
+def _increasing(positions):
+    """Маска наибольшей возрастающей подпоследовательности positions (пары, сохранившие взаимный порядок)"""
+    tails, tail_index = [], []
+    prev = np.full(len(positions), -1)
+    for i, p in enumerate(positions.tolist()):
+        k = bisect.bisect_left(tails, p)
+        if k == len(tails):
+            tails.append(p)
+            tail_index.append(i)
+        else:
+            tails[k] = p
+            tail_index[k] = i
+        prev[i] = tail_index[k - 1] if k else -1
+    keep = np.zeros(len(positions), dtype=bool)
+    i = tail_index[-1] if tail_index else -1
+    while i >= 0:
+        keep[i] = True
+        i = prev[i]
+    return keep
+
+
+class GainersRanking:
+    """
+    Колоночный рейтинг фьючерсных пар по 24ч изменению.
+
+    rank() разбирает contracts + tickers в массивы и фильтрует/сортирует
+    их векторно (NumPy, без цикла по парам с проверками). publish() присваивает
+    рейтингу номер версии и хранит последние GAINERS_HISTORY таблиц, так
+    что changes_since(version) отдает компактный дифф: новые/измененные
+    пары, исчезнувшие пары, вход и выход из топ-N и перемещения (moves):
+    только пары, сменившие место относительно остальных, с новым индексом. На других воркерах рейтинг восстанавливается из снимка
+    движка через load() с той же версией.
+    """
+
+    def __init__(self, top_n=GAINERS_TOP_N, history=GAINERS_HISTORY):
+        self.top_n = top_n
+        self.version = 0
+        self._history = deque(maxlen=history)  # (version, table)
+        self._lock = threading.Lock()
+
+    # ----- Рейтинг -----
+
+    @staticmethod
+    def rank(contracts, tickers, blacklist=(), pinned=None):
+        """contracts + tickers (JSON Gate.io) -> таблица {column: ndarray}, отсортированная по change"""
+        names = np.array([contract.get('name') or '' for contract in contracts], dtype=str)
+        tickers = tickers or []
+        tick_symbols = np.array([ticker.get('contract') or '' for ticker in tickers], dtype=str)
+        # Порядок контрактов сохраняется: при равном change пары идут как в /contracts
+        sorter = np.argsort(tick_symbols, kind='stable')
+        pos = np.searchsorted(tick_symbols, names, sorter=sorter)
+        pos = np.minimum(pos, max(len(tick_symbols) - 1, 0))
+        idx = sorter[pos] if len(tick_symbols) else np.zeros(len(names), dtype=int)
+        listed = (names != '') & (tick_symbols[idx] == names) if len(tick_symbols) else np.zeros(len(names), dtype=bool)
+        symbols, idx = names[listed], idx[listed]
+        price = _floats([tickers[i].get('last', 0) for i in idx], 0.0)
+        change = _floats([tickers[i].get('change_percentage', 0) for i in idx])
+        volume = _floats([tickers[i].get('volume_24h', 0) for i in idx], 0.0)
+        base = np.char.partition(symbols, '_')[:, 0] if len(symbols) else symbols
+        # Только ASCII-символы, без черного списка, с ценой
+        keep = _ascii(base) & ~np.isin(symbols, list(blacklist)) & (price > 0) & np.isfinite(change)
+        symbols, base, price, change, volume = symbols[keep], base[keep], price[keep], change[keep], volume[keep]
+        order = np.argsort(-change, kind='stable')
+        # 🔒 Пара открытой позиции - всегда #1 до конца сделки
+        if pinned is not None:
+            hit = np.flatnonzero(symbols[order] == pinned)
+            if len(hit):
+                order = np.concatenate(([order[hit[0]]], np.delete(order, hit[0])))
+        return {
+            'symbol': symbols[order],
+            'coin': np.char.lower(base[order]),
+            'price': price[order],
+            'change': change[order],
+            'volume': volume[order],
+            'gecko_rank': np.full(len(order), 'N/A', dtype=object),
+        }
+
+    @staticmethod
+    def to_records(table):
+        """Таблица -> список dict (формат /api/top_gainers)"""
+        return [dict(zip(COLUMNS, row)) for row in zip(*(table[column].tolist() for column in COLUMNS))]
+
+    @staticmethod
+    def from_records(records):
+        records = records or []
+        return {
+            'symbol': np.array([r.get('symbol') for r in records], dtype=str),
+            'coin': np.array([r.get('coin') for r in records], dtype=str),
+            'price': np.array([r.get('price') or 0 for r in records], dtype=float),
+            'change': np.array([r.get('change') or 0 for r in records], dtype=float),
+            'volume': np.array([r.get('volume') or 0 for r in records], dtype=float),
+            'gecko_rank': np.array([r.get('gecko_rank', 'N/A') for r in records], dtype=object),
+        }
+
+    # ----- Версии и диффы -----
+
+    def publish(self, table):
+        """Новая версия рейтинга -> (records, version)"""
+        with self._lock:
+            self.version += 1
+            self._history.append((self.version, table))
+            return self.to_records(table), self.version
+
+    def load(self, records, version):
+        """Рейтинг, опубликованный движком (воркеры без аренды): та же версия, свой журнал диффов"""
+        if version is None:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            if version < self.version:
+                self._history.clear()  # Движок перезапустился - старые версии не сравнимы
+            self.version = version
+            self._history.append((version, self.from_records(records)))
+
+    def changes_since(self, since):
+        """Дифф от версии since до текущей; None - версия неизвестна (клиенту нужен полный список)"""
+        with self._lock:
+            if not self._history:
+                return None
+            current_version, current = self._history[-1]
+            if since == current_version:
+                return {'version': current_version, 'since': since, 'unchanged': True}
+            old = next((table for version, table in self._history if version == since), None)
+        if old is None:
+            return None
+        return dict(self.diff(old, current, self.top_n), version=current_version, since=since)
+
+    @classmethod
+    def diff(cls, old, new, top_n=GAINERS_TOP_N):
+        """
+        Векторное сравнение двух таблиц: changed (полные записи), removed, entered/left топ-N, moves.
+        moves - [[symbol, index]] по возрастанию index: остальные пары сохраняют взаимный порядок,
+        клиент вставляет перемещенные на их индексы по очереди.
+        """
+        old_symbols, new_symbols = old['symbol'], new['symbol']
+        sorter = np.argsort(old_symbols)
+        pos = np.searchsorted(old_symbols, new_symbols, sorter=sorter)
+        pos = np.minimum(pos, max(len(old_symbols) - 1, 0))
+        if len(old_symbols):
+            idx = sorter[pos]
+            found = old_symbols[idx] == new_symbols
+        else:
+            idx = np.zeros(len(new_symbols), dtype=int)
+            found = np.zeros(len(new_symbols), dtype=bool)
+        changed = ~found
+        if len(old_symbols):
+            changed |= old['price'][idx] != new['price']
+            changed |= old['change'][idx] != new['change']
+            changed |= old['volume'][idx] != new['volume']
+            changed |= old['gecko_rank'][idx] != new['gecko_rank']
+        changed_table = {column: new[column][changed] for column in COLUMNS}
+        # Новые пары и пары вне наибольшей возрастающей подпоследовательности старых позиций
+        moved = ~found
+        kept = np.flatnonzero(found)
+        moved[kept[~_increasing(idx[kept])]] = True
+        moves = np.flatnonzero(moved)
+        return {
+            'changed': cls.to_records(changed_table),
+            'removed': old_symbols[~np.isin(old_symbols, new_symbols)].tolist(),
+            'entered': np.setdiff1d(new_symbols[:top_n], old_symbols[:top_n]).tolist(),
+            'left': np.setdiff1d(old_symbols[:top_n], new_symbols[:top_n]).tolist(),
+            'moves': [[symbol, index] for symbol, index in zip(new_symbols[moves].tolist(), moves.tolist())],
+            'total_pairs': int(len(new_symbols)),
+        }
+
+
+gainers_ranking = GainersRanking()
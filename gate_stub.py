@@ -0,0 +1,460 @@
+"""
+Локальная подмена Gate.io futures REST + WebSocket для нагрузочных тестов.
+
+REST /api/v4/futures/usdt: contracts, tickers, candlesticks, positions,
+orders, accounts, leverage. WS /v4/ws/usdt: futures.tickers и
+futures.candlesticks 1m. Данные синтетические (SimulatedExchange: пути
+цен из seed, позиции и заявки), либо контракты из записанного ответа
+/contracts (--contracts-json) и WS-кадры из записи MarketStream (--frames,
+как ws_replay.py). Ключи API не проверяются.
+
+Неисправности для REST: задержка (база + экспоненциальный хвост + редкие
+всплески), доля ответов 500 и лимит запросов в секунду на маршрут (429,
+как у Gate.io). Меняются на лету через POST /stub/faults, счетчики и
+перцентили задержки - GET /stub/stats.
+
+    python gate_stub.py --port 8765 --contracts 200 --latency-ms 40 --jitter-ms 30 --error-rate 0.01 --rps 20
+    GATE_REST_URL=http://127.0.0.1:8765/api/v4 GATE_WS_URL=ws://127.0.0.1:8765/v4/ws/usdt \\
+        CANDLE_STORE_DIR=/tmp/stub_candles python app.py
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+from collections import deque, defaultdict
+
+import numpy as np
+from aiohttp import web, WSMsgType
+from ccxt.base.errors import BadSymbol, InsufficientFunds, InvalidOrder
+
+from candle_cache import timeframe_seconds
+from simulated_exchange import SimulatedExchange
+from ws_replay import load_frames, replay
+
+COINS = ("BTC", "ETH", "SOL", "XRP", "DOGE", "ADA", "AVAX", "LINK", "DOT", "TON", "TRX", "LTC", "BCH", "NEAR",
+         "APT", "ARB", "OP", "SUI", "PEPE", "WIF", "SHIB", "ATOM", "FIL", "INJ", "TIA", "SEI", "ORDI", "JUP")
+TICKERS_TTL = 1.0           # Снимок тикеров пересчитывается не чаще раза в секунду (как у биржи)
+MAX_CANDLES = 2000          # Лимит свечей на запрос Gate.io
+
+
+class Faults:
+    """Задержка, ошибки и лимит запросов, которые middleware добавляет к каждому REST-запросу"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, spike_rate=0.0, spike_ms=0.0, error_rate=0.0,
+                 rps=0.0, burst=None, seed=None):
+        self.rng = random.Random(seed)
+        self.update(latency_ms=latency_ms, jitter_ms=jitter_ms, spike_rate=spike_rate, spike_ms=spike_ms,
+                    error_rate=error_rate, rps=rps, burst=burst)
+        self._buckets = {}  # маршрут -> (токены, время)
+
+    def update(self, **knobs):
+        for name, value in knobs.items():
+            setattr(self, name, float(value) if value is not None else None)
+        self._buckets = {}
+
+    def export(self):
+        return {name: getattr(self, name) for name in
+                ("latency_ms", "jitter_ms", "spike_rate", "spike_ms", "error_rate", "rps", "burst")}
+
+    def delay(self):
+        """Задержка ответа (сек): база + экспоненциальный хвост, с вероятностью spike_rate - всплеск"""
+        ms = self.latency_ms
+        if self.jitter_ms:
+            ms += self.rng.expovariate(1 / self.jitter_ms)
+        if self.spike_rate and self.rng.random() < self.spike_rate:
+            ms += self.spike_ms
+        return ms / 1000
+
+    def allow(self, route):
+        """Token bucket на маршрут: rps токенов в секунду, не больше burst"""
+        if not self.rps:
+            return True
+        capacity = self.burst or self.rps
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(route, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * self.rps)
+        allowed = tokens >= 1
+        self._buckets[route] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+    def fail(self):
+        return bool(self.error_rate) and self.rng.random() < self.error_rate
+
+
+class Stats:
+    """Счетчики по маршрутам и кодам ответа, перцентили полного времени ответа"""
+
+    def __init__(self, window=10000):
+        self.started = time.time()
+        self.requests = defaultdict(int)
+        self.statuses = defaultdict(int)
+        self.durations = deque(maxlen=window)
+
+    def record(self, route, status, duration):
+        self.requests[route] += 1
+        self.statuses[status] += 1
+        self.durations.append(duration)
+
+    def export(self):
+        durations = np.array(self.durations) * 1000
+        percentiles = ({f"p{p}": round(float(np.percentile(durations, p)), 2) for p in (50, 90, 99, 99.9)}
+                       if len(durations) else {})
+        return {"uptime": round(time.time() - self.started, 1), "requests": dict(self.requests),
+                "statuses": {str(k): v for k, v in self.statuses.items()}, "latency_ms": percentiles}
+
+
+def _error(status, label, message, headers=None):
+    return web.json_response({"label": label, "message": message}, status=status, headers=headers)
+
+
+class GateStub:
+    """Состояние подмены: биржа-симулятор, список контрактов, неисправности и статистика"""
+
+    def __init__(self, exchange, contracts, faults, frames=None, ws_interval=1.0, ws_drop_rate=0.0):
+        self.exchange = exchange
+        self.contracts = contracts      # Объекты /futures/usdt/contracts (без цен - цены подставляются при отдаче)
+        self.faults = faults
+        self.frames = frames
+        self.ws_interval = ws_interval
+        self.ws_drop_rate = ws_drop_rate
+        self.stats = Stats()
+        self._tickers = (0, [])
+        self._order_id = int(time.time() * 1000)
+
+    # ----- Данные -----
+
+    def tickers(self):
+        """Тикеры всех контрактов (снимок кэшируется на TICKERS_TTL)"""
+        updated, tickers = self._tickers
+        if time.time() - updated < TICKERS_TTL:
+            return tickers
+        tickers = [self.ticker(contract["name"]) for contract in self.contracts]
+        self._tickers = (time.time(), tickers)
+        return tickers
+
+    def ticker(self, name):
+        day = self.exchange.simulator(name).summary(1440)
+        last = day["last"]
+        volume_quote = day["volume"] * last
+        return {
+            "contract": name, "last": str(last), "mark_price": str(last), "index_price": str(last),
+            "change_percentage": f"{(last / day['open'] - 1) * 100:.2f}",
+            "high_24h": str(day["high"]), "low_24h": str(day["low"]),
+            "volume_24h": str(int(day["volume"])), "volume_24h_base": str(int(day["volume"])),
+            "volume_24h_quote": str(int(volume_quote)), "volume_24h_settle": str(int(volume_quote)),
+            "funding_rate": "0.0001", "funding_rate_indicative": "0.0001",
+            "lowest_ask": str(last), "highest_bid": str(last), "total_size": "0",
+        }
+
+    def contract(self, template):
+        """Контракт с текущими ценами"""
+        price = str(self.exchange.price(template["name"]))
+        return dict(template, last_price=price, mark_price=price, index_price=price)
+
+    def candles(self, name, interval, limit, since, until):
+        period = timeframe_seconds(interval)
+        history = self.exchange.history_minutes * 60 // period
+        rows = self.exchange.simulator(name).fetch_ohlcv(interval, limit=max(1, history - 1))
+        if since is not None:
+            rows = [r for r in rows if r[0] >= since * 1000]
+        if until is not None:
+            rows = [r for r in rows if r[0] <= until * 1000]
+        rows = rows[:limit] if since is not None else rows[-limit:]
+        return [{"t": r[0] // 1000, "o": str(r[1]), "h": str(r[2]), "l": str(r[3]), "c": str(r[4]),
+                 "v": int(r[5]), "sum": str(r[5] * r[4])} for r in rows]
+
+    def position(self, pos):
+        """Позиция ccxt -> объект позиции Gate.io"""
+        market = self.exchange.market(pos["symbol"])
+        sign = 1 if pos["side"] == "long" else -1
+        return {
+            "contract": market["id"], "size": int(pos["contracts"]) * sign, "leverage": str(int(pos["leverage"])),
+            "risk_limit": "1000000", "leverage_max": "100", "maintenance_rate": "0.005",
+            "value": str(pos["notional"]), "margin": str(pos["initialMargin"]),
+            "entry_price": str(pos["entryPrice"]), "liq_price": str(pos["liquidationPrice"]),
+            "mark_price": str(pos["markPrice"]), "unrealised_pnl": str(pos["unrealizedPnl"]),
+            "realised_pnl": "0", "history_pnl": "0", "last_close_pnl": "0", "realised_point": "0",
+            "history_point": "0", "adl_ranking": 5, "pending_orders": 0, "mode": "single",
+            "cross_leverage_limit": "0", "update_time": int(time.time()), "open_time": pos["timestamp"] // 1000,
+        }
+
+    # ----- REST -----
+
+    async def get_contracts(self, request):
+        if request.match_info["settle"] != "usdt":
+            return web.json_response([])
+        return web.json_response([self.contract(c) for c in self.contracts])
+
+    async def get_contract(self, request):
+        name = request.match_info["contract"]
+        template = next((c for c in self.contracts if c["name"] == name), None)
+        if template is None:
+            return _error(400, "CONTRACT_NOT_FOUND", f"Contract {name} not found")
+        return web.json_response(self.contract(template))
+
+    async def get_tickers(self, request):
+        contract = request.query.get("contract")
+        if contract:
+            return web.json_response([self.ticker(contract)])
+        return web.json_response(self.tickers())
+
+    async def get_candlesticks(self, request):
+        query = request.query
+        if "contract" not in query:
+            return _error(400, "MISSING_REQUIRED_PARAM", "Missing required parameter: contract")
+        since = int(query["from"]) if "from" in query else None
+        until = int(query["to"]) if "to" in query else None
+        limit = min(int(query.get("limit", 100)), MAX_CANDLES)
+        return web.json_response(self.candles(query["contract"], query.get("interval", "5m"), limit, since, until))
+
+    async def get_positions(self, request):
+        positions = self.exchange.fetch_positions()
+        contract = request.match_info.get("contract")
+        result = [self.position(p) for p in positions]
+        if contract:
+            found = next((p for p in result if p["contract"] == contract), None)
+            return web.json_response(found or {"contract": contract, "size": 0, "leverage": "10", "mode": "single",
+                                               "value": "0", "margin": "0", "entry_price": "0",
+                                               "mark_price": str(self.exchange.price(contract)),
+                                               "unrealised_pnl": "0", "liq_price": "0"})
+        return web.json_response(result)
+
+    async def post_leverage(self, request):
+        contract = request.match_info["contract"]
+        self.exchange.set_leverage(float(request.query.get("leverage", 10)), contract)
+        return await self.get_positions(request)
+
+    async def post_order(self, request):
+        body = await request.json()
+        size = int(body.get("size", 0))
+        contract = body.get("contract")
+        try:
+            order = self.exchange.create_order(contract, "market", "buy" if size > 0 else "sell", abs(size),
+                                               params={"reduceOnly": bool(body.get("reduce_only"))})
+        except InsufficientFunds as e:
+            return _error(400, "INSUFFICIENT_AVAILABLE", str(e))
+        except BadSymbol as e:
+            return _error(400, "CONTRACT_NOT_FOUND", str(e))
+        except InvalidOrder as e:
+            return _error(400, "INVALID_PARAM_VALUE", str(e))
+        self._order_id += 1
+        now = order["timestamp"] / 1000
+        return web.json_response({
+            "id": self._order_id, "user": 1, "contract": contract, "size": size, "left": 0,
+            "price": "0", "fill_price": str(order["average"]), "status": "finished", "finish_as": "filled",
+            "tif": body.get("tif", "ioc"), "is_reduce_only": bool(body.get("reduce_only")), "is_close": False,
+            "is_liq": False, "iceberg": 0, "text": body.get("text", "api"), "create_time": now, "finish_time": now,
+            "tkfr": str(self.exchange.fee_rate), "mkfr": str(self.exchange.fee_rate), "refu": 0,
+        }, status=201)
+
+    async def get_accounts(self, request):
+        balance = self.exchange.fetch_balance()["USDT"]
+        unrealized = sum(p["unrealizedPnl"] for p in self.exchange.fetch_positions())
+        return web.json_response({
+            "currency": "USDT", "total": str(balance["total"] - unrealized), "unrealised_pnl": str(unrealized),
+            "position_margin": str(balance["used"]), "order_margin": "0", "available": str(balance["free"]),
+            "point": "0", "bonus": "0", "in_dual_mode": False, "enable_credit": False,
+            "position_initial_margin": str(balance["used"]), "maintenance_margin": "0",
+        })
+
+    async def get_empty(self, request):
+        """Остальные разделы API (спот, delivery, опционы) - пустые списки, чтобы ccxt.load_markets() проходил"""
+        return web.json_response([])
+
+    # ----- Служебное -----
+
+    async def get_faults(self, request):
+        return web.json_response(self.faults.export())
+
+    async def post_faults(self, request):
+        self.faults.update(**await request.json())
+        logging.info(f"Stub faults: {self.faults.export()}")
+        return web.json_response(self.faults.export())
+
+    async def get_stats(self, request):
+        return web.json_response(dict(self.stats.export(), exchange=self.exchange.stats))
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        """Задержка, 429 и 500 для REST; служебные маршруты и WS - без неисправностей"""
+        if request.path.startswith("/stub/") or request.path.startswith("/v4/ws"):
+            return await handler(request)
+        started = time.monotonic()
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        await asyncio.sleep(self.faults.delay())
+        if not self.faults.allow(route):
+            response = _error(429, "TOO_MANY_REQUESTS", "Request Rate Limit Exceeded",
+                              headers={"X-Gate-RateLimit-Requests-Remain": "0",
+                                       "X-Gate-RateLimit-Limit": str(int(self.faults.rps)),
+                                       "X-Gate-RateLimit-Reset-Timestamp": str(int(time.time()) + 1)})
+        elif self.faults.fail():
+            response = _error(500, "SERVER_ERROR", "Internal server error")
+        else:
+            try:
+                response = await handler(request)
+            except web.HTTPException:
+                raise
+            except Exception as e:
+                logging.error(f"Stub handler error on {request.path}: {e}")
+                response = _error(500, "SERVER_ERROR", str(e))
+        self.stats.record(route, response.status, time.monotonic() - started)
+        return response
+
+    # ----- WebSocket -----
+
+    def ws_frames(self, tickers, candles):
+        now = int(time.time())
+        frames = []
+        if tickers:
+            frames.append({"time": now, "channel": "futures.tickers", "event": "update",
+                           "result": [self.ticker(name) for name in sorted(tickers)]})
+        for name in sorted(candles):
+            row = self.exchange.simulator(name).fetch_ohlcv("1m", limit=1)[-1]
+            frames.append({"time": now, "channel": "futures.candlesticks", "event": "update",
+                           "result": [{"t": row[0] // 1000, "o": str(row[1]), "h": str(row[2]), "l": str(row[3]),
+                                       "c": str(row[4]), "v": int(row[5]), "a": str(row[5] * row[4]),
+                                       "n": f"1m_{name}", "w": False}]})
+        return frames
+
+    async def ws_push(self, ws, tickers, candles):
+        """Синтетический поток: тикеры и текущая 1m свеча подписанных пар каждые ws_interval секунд"""
+        while not ws.closed:
+            if self.ws_drop_rate and self.faults.rng.random() < self.ws_drop_rate:
+                logging.info("Stub WS: dropping connection")
+                await ws.close()
+                return
+            for frame in self.ws_frames(tickers, candles):
+                await ws.send_str(json.dumps(frame))
+            await asyncio.sleep(self.ws_interval)
+
+    async def ws_handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        tickers, candles = set(), set()
+        task = None
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            frame = json.loads(msg.data)
+            channel, event, payload = frame.get("channel"), frame.get("event"), frame.get("payload") or []
+            if channel == "futures.ping":
+                await ws.send_json({"time": int(time.time()), "channel": "futures.pong", "result": None})
+                continue
+            if event not in ("subscribe", "unsubscribe"):
+                continue
+            if channel == "futures.tickers":
+                (tickers.update if event == "subscribe" else tickers.difference_update)(payload)
+            elif channel == "futures.candlesticks" and len(payload) == 2:
+                (candles.add if event == "subscribe" else candles.discard)(payload[1])
+            await ws.send_json({"time": int(time.time()), "channel": channel, "event": event, "error": None,
+                                "result": {"status": "success"}})
+            if task is None and event == "subscribe":
+                task = asyncio.ensure_future(replay(ws, self.frames, 1.0) if self.frames
+                                             else self.ws_push(ws, tickers, candles))
+        if task is not None:
+            task.cancel()
+        return ws
+
+    def make_app(self):
+        app = web.Application(middlewares=[self.middleware])
+        prefix = "/api/v4/futures"
+        app.router.add_get(prefix + "/{settle}/contracts", self.get_contracts)
+        app.router.add_get(prefix + "/usdt/contracts/{contract}", self.get_contract)
+        app.router.add_get(prefix + "/usdt/tickers", self.get_tickers)
+        app.router.add_get(prefix + "/usdt/candlesticks", self.get_candlesticks)
+        app.router.add_get(prefix + "/usdt/positions", self.get_positions)
+        app.router.add_get(prefix + "/usdt/positions/{contract}", self.get_positions)
+        app.router.add_post(prefix + "/usdt/positions/{contract}/leverage", self.post_leverage)
+        app.router.add_post(prefix + "/usdt/orders", self.post_order)
+        app.router.add_get(prefix + "/usdt/accounts", self.get_accounts)
+        app.router.add_get("/api/v4/{tail:.*}", self.get_empty)
+        app.router.add_get("/stub/faults", self.get_faults)
+        app.router.add_post("/stub/faults", self.post_faults)
+        app.router.add_get("/stub/stats", self.get_stats)
+        app.router.add_get("/v4/ws/usdt", self.ws_handler)
+        return app
+
+
+def contract_template(name, contract_size, fee_rate):
+    """Синтетический объект /futures/usdt/contracts (поля, которые читают contract_index и ccxt)"""
+    return {
+        "name": name, "type": "direct", "quanto_multiplier": str(contract_size), "leverage_min": "1",
+        "leverage_max": "100", "maintenance_rate": "0.005", "mark_type": "index", "order_price_round": "0.0000001",
+        "mark_price_round": "0.0000001", "order_size_min": 1, "order_size_max": 1000000,
+        "maker_fee_rate": str(fee_rate), "taker_fee_rate": str(fee_rate), "funding_rate": "0.0001",
+        "funding_interval": 28800, "in_delisting": False, "orders_limit": 100, "enable_bonus": True,
+        "enable_credit": True, "create_time": 1600000000, "status": "trading",
+    }
+
+
+class _Recorded:
+    """Цены и размеры контрактов из записанного ответа /contracts (интерфейс price_book/contract_index)"""
+
+    def __init__(self, contracts):
+        self._contracts = {c["name"]: c for c in contracts}
+
+    def get(self, symbol):
+        contract = self._contracts.get(symbol)
+        return float(contract.get("last_price") or 0) if contract else None
+
+    def contract_size(self, symbol, default=None):
+        contract = self._contracts.get(symbol)
+        if not contract:
+            return default
+        return float(contract.get("quanto_multiplier") or 0) or default
+
+
+def build_stub(args):
+    recorded = None
+    if args.contracts_json:
+        with open(args.contracts_json, "r") as f:
+            recorded = json.load(f)
+        recorded = recorded[:args.contracts] if args.contracts else recorded
+    reference = _Recorded(recorded) if recorded else None
+    exchange = SimulatedExchange(balance=args.balance, seed=args.seed, speed=args.speed,
+                                 slippage_bps=args.slippage_bps, fee_rate=args.fee, latency_ms=0, latency_jitter_ms=0,
+                                 history_minutes=args.history_minutes, price_book=reference, contract_index=reference)
+    if recorded:
+        names = [c["name"] for c in recorded]
+    else:
+        names = [f"{coin}_USDT" for coin in COINS[:args.contracts]]
+        names += [f"SIM{i:03d}_USDT" for i in range(args.contracts - len(names))]
+    started = time.time()
+    contracts = []
+    for name in names:
+        market = exchange.market(name)
+        contracts.append(recorded[len(contracts)] if recorded else contract_template(name, market["contractSize"], args.fee))
+    logging.info(f"Stub: {len(contracts)} contracts, {args.history_minutes} minutes of history each "
+                 f"in {time.time() - started:.1f}s")
+    faults = Faults(args.latency_ms, args.jitter_ms, args.spike_rate, args.spike_ms, args.error_rate,
+                    args.rps, args.burst, seed=args.seed)
+    frames = load_frames(args.frames) if args.frames else None
+    return GateStub(exchange, contracts, faults, frames, args.ws_interval, args.ws_drop_rate)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Local Gate.io futures REST/WS stand-in with latency and error knobs")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--contracts", type=int, default=200, help="Synthetic contracts (or first N recorded)")
+    parser.add_argument("--contracts-json", default=None, help="Recorded /futures/usdt/contracts response")
+    parser.add_argument("--frames", default=None, help="Recorded WS frames (GATE_WS_RECORD) instead of synthetic feed")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--speed", type=float, default=1.0, help="Simulated seconds per real second")
+    parser.add_argument("--history-minutes", type=int, default=6000, help="1m history kept per contract")
+    parser.add_argument("--balance", type=float, default=100.0)
+    parser.add_argument("--fee", type=float, default=0.0005)
+    parser.add_argument("--slippage-bps", type=float, default=2.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Base REST latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Mean of the exponential latency tail")
+    parser.add_argument("--spike-rate", type=float, default=0.0, help="Share of requests with an extra spike")
+    parser.add_argument("--spike-ms", type=float, default=0.0, help="Spike size, e.g. above the client timeout")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of REST requests answered with 500")
+    parser.add_argument("--rps", type=float, default=0.0, help="Requests per second per route before 429 (0 - off)")
+    parser.add_argument("--burst", type=float, default=None, help="Token bucket size (default: rps)")
+    parser.add_argument("--ws-interval", type=float, default=1.0, help="Seconds between synthetic WS pushes")
+    parser.add_argument("--ws-drop-rate", type=float, default=0.0, help="Chance to drop a WS connection per push")
+    args = parser.parse_args()
+    web.run_app(build_stub(args).make_app(), port=args.port)
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+import requests
+
+from single_flight import SingleFlightRefresher
+
+GECKO_API = 'https://api.coingecko.com/api/v3'
+GECKO_CACHE_FILE = 'gecko_ranks_cache.json'
+GECKO_RANK_TTL = float(os.getenv('GECKO_RANK_TTL', str(6 * 3600)))    # Рейтинг капитализации меняется медленно
+GECKO_IDS_TTL = float(os.getenv('GECKO_IDS_TTL', str(24 * 3600)))     # Справочник symbol -> id (/coins/list)
+GECKO_MAX_REQUESTS = int(os.getenv('GECKO_MAX_REQUESTS', '3'))        # Бюджет запросов на одно обновление
+GECKO_MIN_INTERVAL = float(os.getenv('GECKO_MIN_INTERVAL', '2.5'))    # Пауза между запросами (бесплатный лимит ~30/мин)
+GECKO_BATCH = 250               # Максимум ids в одном /coins/markets (per_page)
+GECKO_IDS_PER_SYMBOL = 8        # Клоны с тем же тикером: проверяем не больше стольких id
+
+_MULTIPLIER = re.compile(r'^10+(?=[a-z])')
+
+
+def gecko_symbol(coin):
+    """Базовая монета Gate.io -> тикер CoinGecko: 'PEPE' -> 'pepe', '1000PEPE' -> 'pepe'"""
+    return _MULTIPLIER.sub('', (coin or '').lower())
+
+
+class GeckoRankCache:
+    """
+    Рейтинг капитализации CoinGecko по тикеру монеты, вне горячего пути.
+
+    Базовый символ тикера Gate.io - это не id CoinGecko, поэтому кэш
+    держит справочник symbol -> [id] (/coins/list, раз в сутки) и рейтинги
+    с долгим TTL; оба сохраняются на диск для теплого старта. ranks() -
+    только чтение из памяти. want() запоминает нужные символы и запускает
+    фоновое обновление: устаревшие символы запрашиваются пачками по
+    GECKO_BATCH id через /coins/markets, не больше GECKO_MAX_REQUESTS
+    запросов с паузой GECKO_MIN_INTERVAL за раз. Остаток догружается
+    следующими обновлениями, после 429 - экспоненциальная пауза.
+    """
+
+    def __init__(self, path=GECKO_CACHE_FILE, rank_ttl=GECKO_RANK_TTL, ids_ttl=GECKO_IDS_TTL,
+                 max_requests=GECKO_MAX_REQUESTS, min_interval=GECKO_MIN_INTERVAL):
+        self.path = path
+        self.rank_ttl = rank_ttl
+        self.ids_ttl = ids_ttl
+        self.max_requests = max_requests
+        self.min_interval = min_interval
+        self._ids = {}            # symbol -> [coingecko id]
+        self.ids_updated_at = 0
+        self._ranks = {}          # symbol -> [rank или None, fetched_at]
+        self._wanted = []
+        self._last_request = 0
+        self._lock = threading.Lock()
+        self.http = requests.Session()
+        self.refresher = SingleFlightRefresher(self.refresh, min_interval, max_backoff=900, name="gecko-ranks")
+        self.load_from_disk()
+
+    # ----- Чтение (горячий путь, без сети) -----
+
+    def rank(self, coin, default='N/A'):
+        entry = self._ranks.get(gecko_symbol(coin))
+        if not entry or entry[0] is None:
+            return default
+        return entry[0]
+
+    def ranks(self, coins, default='N/A'):
+        """Рейтинги для списка монет (тот же порядок)"""
+        return [self.rank(coin, default) for coin in coins]
+
+    def want(self, coins):
+        """Запомнить монеты топа и запустить фоновое обновление, если есть что обновлять"""
+        symbols = list(dict.fromkeys(gecko_symbol(coin) for coin in coins if coin))
+        with self._lock:
+            self._wanted = symbols
+        if self.ids_stale() or self.pending():
+            self.refresher.trigger(max_age=0)
+
+    def ids_stale(self):
+        return time.time() - self.ids_updated_at > self.ids_ttl
+
+    def pending(self):
+        """Нужные символы без рейтинга или с истекшим TTL (в порядке топа)"""
+        now = time.time()
+        with self._lock:
+            wanted = list(self._wanted)
+        return [symbol for symbol in wanted
+                if symbol in self._ids
+                and (symbol not in self._ranks or now - self._ranks[symbol][1] > self.rank_ttl)]
+
+    # ----- Фоновое обновление -----
+
+    def _get(self, path, params=None):
+        # Троттлинг: не чаще одного запроса в min_interval секунд
+        wait = self._last_request + self.min_interval - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_request = time.time()
+        response = self.http.get(f"{GECKO_API}{path}", params=params, timeout=10)
+        if response.status_code == 429:
+            raise RuntimeError("CoinGecko rate limit (429)")
+        response.raise_for_status()
+        return response.json()
+
+    def refresh_ids(self):
+        """Справочник symbol -> ids; при дублях тикера первыми идут id == symbol, затем короткие"""
+        ids = {}
+        for coin in self._get('/coins/list'):
+            symbol, coin_id = (coin.get('symbol') or '').lower(), coin.get('id')
+            if symbol and coin_id:
+                ids.setdefault(symbol, []).append(coin_id)
+        for symbol, candidates in ids.items():
+            candidates.sort(key=lambda coin_id: (coin_id != symbol, len(coin_id), coin_id))
+            del candidates[GECKO_IDS_PER_SYMBOL:]
+        with self._lock:
+            self._ids = ids
+            self.ids_updated_at = time.time()
+        logging.info(f"🦎 CoinGecko ids refreshed: {len(ids)} symbols")
+
+    def _batches(self, symbols):
+        """Символы -> пачки (symbols, ids) не больше GECKO_BATCH id"""
+        batch, batch_ids = [], []
+        for symbol in symbols:
+            candidates = self._ids.get(symbol, [])
+            if batch and len(batch_ids) + len(candidates) > GECKO_BATCH:
+                yield batch, batch_ids
+                batch, batch_ids = [], []
+            batch.append(symbol)
+            batch_ids.extend(candidates)
+        if batch:
+            yield batch, batch_ids
+
+    def refresh(self):
+        """Одно обновление в пределах бюджета запросов (вызывать через refresher)"""
+        budget = self.max_requests
+        if self.ids_stale():
+            self.refresh_ids()
+            budget -= 1
+        updated = 0
+        for symbols, ids in self._batches(self.pending()):
+            if budget <= 0:
+                break
+            budget -= 1
+            markets = self._get('/coins/markets', {'vs_currency': 'usd', 'ids': ','.join(ids), 'per_page': GECKO_BATCH})
+            by_id = {coin.get('id'): coin.get('market_cap_rank') for coin in markets}
+            now = time.time()
+            with self._lock:
+                for symbol in symbols:
+                    # Лучший (наименьший) рейтинг среди клонов; промах тоже кэшируется до истечения TTL
+                    found = [by_id[coin_id] for coin_id in self._ids.get(symbol, []) if by_id.get(coin_id)]
+                    self._ranks[symbol] = [min(found) if found else None, now]
+            updated += len(symbols)
+        if updated:
+            logging.info(f"🦎 CoinGecko ranks refreshed: {updated} symbols, {len(self.pending())} pending")
+        self.save_to_disk()
+        return True
+
+    # ----- Диск -----
+
+    def save_to_disk(self):
+        """Атомарная запись (временный файл + os.replace)"""
+        try:
+            with self._lock:
+                payload = {'ids_updated_at': self.ids_updated_at, 'ids': self._ids, 'ranks': self._ranks}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(payload, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.debug(f"Could not save CoinGecko ranks: {e}")
+
+    def load_from_disk(self):
+        try:
+            with open(self.path, 'r') as f:
+                payload = json.load(f)
+            with self._lock:
+                self._ids = payload.get('ids', {})
+                self.ids_updated_at = payload.get('ids_updated_at', 0)
+                self._ranks = payload.get('ranks', {})
+            logging.info(f"🦎 CoinGecko ranks loaded from disk: {len(self._ranks)} symbols")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug(f"Could not load CoinGecko ranks: {e}")
+
+
+gecko_ranks = GeckoRankCache()
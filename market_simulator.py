@@ -1,83 +1,202 @@
-import random
+import os
 import time
-from datetime import datetime, timedelta
+import threading
+
+import numpy as np
+
+from candle_cache import timeframe_seconds
+from candle_resampler import resample_ohlcv
+
+SIMULATOR_SEED = int(os.getenv('SIMULATOR_SEED', '42'))
+SIMULATOR_SPEED = float(os.getenv('SIMULATOR_SPEED', '1'))              # Секунд симуляции на секунду реального времени
+SIMULATOR_HISTORY = int(os.getenv('SIMULATOR_HISTORY', str(15000)))     # Минут в кольцевом буфере (200 свечей 1h + запас)
+SIMULATOR_START = os.getenv('SIMULATOR_START')                          # Начало истории (мс) для побитового повтора
+
+SUBSTEPS = 60                   # Шагов цены внутри 1m свечи (по секунде)
+BLOCK_MINUTES = 60              # Минут в блоке генерации: случайность блока k - из (seed, k)
+REGIME_MEAN_MINUTES = 90        # Средняя длительность режима
+# Режимы: (дрейф за час, множитель волатильности) - флэт, обычный, рост, падение, всплеск
+REGIMES = np.array([(0.0, 0.5), (0.0, 1.0), (0.01, 1.0), (-0.01, 1.0), (0.0, 2.5)])
+
 
 class MarketSimulator:
     """
-    Симулятор рынка для тестирования торговой стратегии без реальных денег
+    Симулятор рынка для тестирования торговой стратегии без реальных денег.
+
+    Путь цены - геометрическое броуновское движение с переключением
+    режимов (флэт/тренд/всплеск), по SUBSTEPS шагов на минуту, генерируется
+    NumPy блоками по BLOCK_MINUTES минут, генератор блока k получает
+    seed (seed, k): тот же seed - та же история, как бы ни шел опрос
+    (fast_forward(3600) и 60 x fast_forward(60) дают одни и те же свечи). 1m свечи
+    лежат в кольцевом буфере, старшие таймфреймы собираются из них
+    (resample_ohlcv), поэтому все таймфреймы согласованы и развиваются во
+    времени, а не генерируются заново на каждый запрос. Текущая минута
+    отдается незакрытой свечой. Время симуляции идет со скоростью speed,
+    fast_forward() проматывает вперед, replay() начинает тот же путь сначала.
     """
-    def __init__(self, initial_price=3000, volatility=0.02):
-        self.current_price = initial_price
-        self.volatility = volatility
-        self.last_update = datetime.utcnow()
-        self.price_history = []
-        
-    def get_current_price(self):
-        """Возвращает текущую цену с симуляцией изменения"""
-        self.update_price()
-        return self.current_price
-    
+
+    def __init__(self, initial_price=3000, volatility=0.02, seed=SIMULATOR_SEED, speed=SIMULATOR_SPEED,
+                 history_minutes=SIMULATOR_HISTORY, start=SIMULATOR_START):
+        self.initial_price = initial_price
+        self.volatility = volatility            # Стандартное отклонение доходности за час
+        self.seed = seed
+        self.speed = speed
+        self.capacity = history_minutes
+        self.start = int(start) if start else None
+        self._lock = threading.Lock()
+        self.replay()
+
+    # ----- Часы -----
+
+    def replay(self, seed=None):
+        """Начать путь заново (тот же seed - те же свечи)"""
+        with self._lock:
+            if seed is not None:
+                self.seed = seed
+            self._candles = np.empty((self.capacity, 6))
+            self._count = 0                     # Сгенерировано минут всего (включая текущую)
+            self._last_close = float(self.initial_price)
+            self._regime = 1
+            self._regime_left = 0
+            self._current_path = None           # Шаги цены текущей минуты
+            self._block = -1                    # Номер последнего сгенерированного блока
+            self._block_candles = None
+            self._block_paths = None
+            start_ms = self.start if self.start else int(time.time() * 1000)
+            # История: capacity закрытых минут до старта
+            self._origin_ms = (start_ms // 60000) * 60000 - self.capacity * 60000
+            self._wall_start = time.time()
+            self._offset = 0.0
+            self._advance()
+
+    def now_ms(self):
+        """Текущее время симуляции (мс)"""
+        elapsed = (time.time() - self._wall_start) * self.speed + self._offset
+        return self._origin_ms + self.capacity * 60000 + int(elapsed * 1000)
+
+    def fast_forward(self, seconds):
+        """Промотать время симуляции вперед (свечи генерируются векторно, блоками)"""
+        with self._lock:
+            self._offset += seconds
+            self._advance()
+
+    # ----- Генерация -----
+
+    def _regimes(self, rng, n):
+        """Режим каждой из n следующих минут: длительность режима - геометрическое распределение"""
+        regimes = np.empty(n, dtype=int)
+        filled = 0
+        while filled < n:
+            if not self._regime_left:
+                self._regime = int(rng.integers(len(REGIMES)))
+                self._regime_left = int(rng.geometric(1 / REGIME_MEAN_MINUTES))
+            take = min(self._regime_left, n - filled)
+            regimes[filled:filled + take] = self._regime
+            self._regime_left -= take
+            filled += take
+        return regimes
+
+    def _generate(self, block):
+        """Блок из BLOCK_MINUTES минут: шаги цены (BLOCK_MINUTES x SUBSTEPS) -> свечи OHLCV"""
+        n = BLOCK_MINUTES
+        rng = np.random.default_rng([self.seed, block])
+        regimes = self._regimes(rng, n)
+        drift = REGIMES[regimes, 0][:, None] / 3600
+        sigma = self.volatility / np.sqrt(3600) * REGIMES[regimes, 1][:, None]
+        log_returns = drift - 0.5 * sigma ** 2 + sigma * rng.standard_normal((n, SUBSTEPS))
+        path = self._last_close * np.exp(np.cumsum(log_returns.ravel())).reshape(n, SUBSTEPS)
+        opens = np.r_[self._last_close, path[:-1, -1]]
+        candles = np.empty((n, 6))
+        candles[:, 0] = self._origin_ms + (block * n + np.arange(n)) * 60000
+        candles[:, 1] = opens
+        candles[:, 2] = np.maximum(opens, path.max(axis=1))
+        candles[:, 3] = np.minimum(opens, path.min(axis=1))
+        candles[:, 4] = path[:, -1]
+        # Объем растет с амплитудой свечи
+        candles[:, 5] = rng.gamma(2.0, 250.0, size=n) * (1 + (candles[:, 2] - candles[:, 3]) / opens * 100)
+        self._last_close = float(path[-1, -1])
+        self._block = block
+        self._block_candles = candles
+        self._block_paths = path
+
+    def _advance(self):
+        """Догенерировать минуты до текущего времени симуляции (последняя - текущая, незакрытая)"""
+        target = (self.now_ms() - self._origin_ms) // 60000 + 1
+        while self._count < target:
+            block = self._count // BLOCK_MINUTES
+            if block != self._block:
+                self._generate(block)
+            start = self._count - block * BLOCK_MINUTES
+            take = int(min(target - self._count, BLOCK_MINUTES - start))
+            index = (self._count + np.arange(take)) % self.capacity
+            self._candles[index] = self._block_candles[start:start + take]
+            self._count += take
+            self._current_path = self._block_paths[start + take - 1]
+
     def update_price(self):
-        """Обновляет цену с учетом волатильности"""
-        now = datetime.utcnow()
-        time_diff = (now - self.last_update).total_seconds()
-        
-        if time_diff > 1:
-            change_percent = random.gauss(0, self.volatility)
-            self.current_price *= (1 + change_percent)
-            
-            self.current_price = max(1000, min(10000, self.current_price))
-            
-            self.last_update = now
-            self.price_history.append({
-                'timestamp': now.timestamp() * 1000,
-                'price': self.current_price
-            })
-            
-            if len(self.price_history) > 1000:
-                self.price_history.pop(0)
-    
+        """Продвинуть симуляцию до текущего времени"""
+        with self._lock:
+            self._advance()
+
+    # ----- Чтение -----
+
+    def _minutes(self, count):
+        """Последние count минут по порядку; текущая минута - незакрытая, по прошедшим секундам"""
+        count = min(count, self._count, self.capacity)
+        index = (self._count - count + np.arange(count)) % self.capacity
+        rows = self._candles[index]
+        second = min(SUBSTEPS - 1, (self.now_ms() % 60000) * SUBSTEPS // 60000)
+        seen = self._current_path[:second + 1]
+        current = rows[-1]
+        current[2] = max(current[1], seen.max())
+        current[3] = min(current[1], seen.min())
+        current[4] = seen[-1]
+        current[5] *= (second + 1) / SUBSTEPS
+        return rows
+
+    def get_current_price(self):
+        """Текущая цена (последний шаг текущей минуты)"""
+        with self._lock:
+            self._advance()
+            return float(self._minutes(1)[-1, 4])
+
+    @property
+    def current_price(self):
+        return self.get_current_price()
+
+    def summary(self, minutes=1440):
+        """Сводка за последние minutes минут (24h-поля тикера): open, high, low, last, volume"""
+        with self._lock:
+            self._advance()
+            rows = self._minutes(minutes)
+        return {'open': float(rows[0, 1]), 'high': float(rows[:, 2].max()), 'low': float(rows[:, 3].min()),
+                'last': float(rows[-1, 4]), 'volume': float(rows[:, 5].sum())}
+
     def fetch_ohlcv(self, timeframe, limit=200):
         """
-        Генерирует OHLCV данные для заданного таймфрейма
+        OHLCV для заданного таймфрейма из общей истории 1m
         Возвращает список [timestamp, open, high, low, close, volume]
         """
-        tf_minutes = self._timeframe_to_minutes(timeframe)
-        
-        ohlcv = []
-        current_time = datetime.utcnow()
-        
-        for i in range(limit):
-            candle_time = current_time - timedelta(minutes=tf_minutes * (limit - i))
-            timestamp = int(candle_time.timestamp() * 1000)
-            
-            base_price = self.current_price * (1 + random.gauss(0, self.volatility * (limit - i) / limit))
-            
-            open_price = base_price
-            high_price = open_price * (1 + abs(random.gauss(0, self.volatility / 2)))
-            low_price = open_price * (1 - abs(random.gauss(0, self.volatility / 2)))
-            close_price = open_price + random.gauss(0, (high_price - low_price) / 2)
-            close_price = max(low_price, min(high_price, close_price))
-            
-            volume = random.uniform(100, 1000)
-            
-            ohlcv.append([timestamp, open_price, high_price, low_price, close_price, volume])
-        
-        if ohlcv:
-            ohlcv[-1][1] = self.current_price * 0.998
-            ohlcv[-1][2] = self.current_price * 1.001
-            ohlcv[-1][3] = self.current_price * 0.997
-            ohlcv[-1][4] = self.current_price
-        
-        return ohlcv
-    
-    def _timeframe_to_minutes(self, timeframe):
-        """Конвертирует строку таймфрейма в минуты"""
-        if timeframe.endswith('m'):
-            return int(timeframe[:-1])
-        elif timeframe.endswith('h'):
-            return int(timeframe[:-1]) * 60
-        elif timeframe.endswith('d'):
-            return int(timeframe[:-1]) * 1440
-        else:
-            return 1
+        tf_minutes = timeframe_seconds(timeframe) // 60
+        with self._lock:
+            self._advance()
+            rows = self._minutes((limit + 1) * tf_minutes)
+        if tf_minutes == 1:
+            ohlcv = rows[-limit:].tolist()
+            for row in ohlcv:
+                row[0] = int(row[0])
+            return ohlcv
+        return resample_ohlcv(rows, timeframe)[-limit:]
+
+
+_simulator = None
+_simulator_lock = threading.Lock()
+
+
+def get_simulator(initial_price=3000, volatility=0.02):
+    """Один симулятор на процесс: все экземпляры TradingBot видят один и тот же путь цены"""
+    global _simulator
+    with _simulator_lock:
+        if _simulator is None:
+            _simulator = MarketSimulator(initial_price=initial_price, volatility=volatility)
+        return _simulator
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+
+import aiohttp
+
+from contract_index import normalize_symbol
+
+GATE_WS_URL = os.getenv('GATE_WS_URL', 'wss://fx-ws.gateio.ws/v4/ws/usdt')
+WS_TOP_N = int(os.getenv('WS_TOP_N', '20'))  # Сколько топ-гейнеров слушать по тикерам
+WS_PING_SECONDS = 15
+WS_MAX_RECONNECT_DELAY = 30
+
+
+def to_ccxt_symbol(contract):
+    """'XNY_USDT' -> 'XNY/USDT:USDT' (ключ candle_cache)"""
+    base, quote = normalize_symbol(contract).split('_', 1)
+    return f"{base}/{quote}:{quote}"
+
+
+class MarketStream:
+    """
+    Поток рыночных данных Gate.io futures по WebSocket.
+
+    Подписывается на futures.tickers (активная пара + топ-N гейнеров) и
+    futures.candlesticks 1m (активная пара), обновляет price_book и
+    candle_cache по мере прихода кадров. При обрыве переподключается с
+    экспоненциальной задержкой, переподписывается и помечает свечи
+    устаревшими - следующий читатель докачивает разрыв через REST
+    (since=). Пока поток молчит, кэши работают как раньше через REST.
+
+    url переопределяется через GATE_WS_URL, поэтому клиент можно
+    прогнать против ws_replay.py с записанными кадрами (record_path).
+    """
+
+    def __init__(self, price_book, candle_cache=None, url=GATE_WS_URL, record_path=None):
+        self.url = url
+        self.price_book = price_book
+        self.candle_cache = candle_cache
+        self.record_path = record_path
+        self._tickers = set()
+        self._candles = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._ws = None
+        self._stopped = False
+        self.connected = False
+        self.last_message_at = 0
+        self.stats = {"messages": 0, "reconnects": 0, "tickers": 0, "candles": 0}
+
+    # ----- Подписки -----
+
+    def set_symbols(self, active=None, tickers=()):
+        """Активная пара (тикер + 1m свечи) и дополнительные пары только по тикерам"""
+        tickers = {normalize_symbol(s) for s in tickers if s}
+        candles = set()
+        if active:
+            active = normalize_symbol(active)
+            tickers.add(active)
+            candles.add(active)
+        with self._lock:
+            added_t, removed_t = tickers - self._tickers, self._tickers - tickers
+            added_c, removed_c = candles - self._candles, self._candles - candles
+            self._tickers, self._candles = tickers, candles
+        if self.connected and (added_t or removed_t or added_c or removed_c):
+            self._submit(self._apply_subscriptions(added_t, removed_t, added_c, removed_c))
+
+    def add_listener(self, callback):
+        """callback(kind, symbol, data) на каждый тикер ('ticker', price) и свечу ('candle', row)"""
+        self._listeners.append(callback)
+
+    # ----- Обработка кадров -----
+
+    def handle_message(self, message):
+        """Разобрать кадр Gate.io WS v4 и обновить кэши"""
+        if isinstance(message, (str, bytes)):
+            message = json.loads(message)
+        self.stats["messages"] += 1
+        self.last_message_at = time.time()
+        if message.get("event") != "update":
+            if message.get("error"):
+                logging.warning(f"WS error frame: {message.get('error')}")
+            return
+        channel = message.get("channel")
+        result = message.get("result") or []
+        if isinstance(result, dict):
+            result = [result]
+        if channel == "futures.tickers":
+            for ticker in result:
+                self._on_ticker(ticker)
+        elif channel == "futures.candlesticks":
+            for candle in result:
+                self._on_candle(candle)
+
+    def _on_ticker(self, ticker):
+        contract = ticker.get("contract")
+        try:
+            price = float(ticker.get("last") or 0)
+        except (TypeError, ValueError):
+            return
+        if not contract or price <= 0:
+            return
+        mark = ticker.get("mark_price")
+        self.price_book.update(contract, price, mark_price=float(mark) if mark else None)
+        self.stats["tickers"] += 1
+        self._notify("ticker", contract, price)
+
+    def _on_candle(self, candle):
+        name = candle.get("n", "")  # '1m_BTC_USDT'
+        if "_" not in name:
+            return
+        tf, contract = name.split("_", 1)
+        try:
+            row = [int(candle["t"]) * 1000, float(candle["o"]), float(candle["h"]),
+                   float(candle["l"]), float(candle["c"]), float(candle.get("v", 0))]
+        except (KeyError, TypeError, ValueError):
+            return
+        if self.candle_cache is not None:
+            self.candle_cache.apply(to_ccxt_symbol(contract), tf, row)
+        self.stats["candles"] += 1
+        self._notify("candle", contract, row)
+
+    def _notify(self, kind, symbol, data):
+        for callback in self._listeners:
+            try:
+                callback(kind, symbol, data)
+            except Exception as e:
+                logging.debug(f"Market stream listener error: {e}")
+
+    # ----- Соединение -----
+
+    def _frame(self, channel, event=None, payload=None):
+        frame = {"time": int(time.time()), "channel": channel}
+        if event:
+            frame["event"] = event
+        if payload is not None:
+            frame["payload"] = payload
+        return frame
+
+    async def _send(self, frame):
+        if self._ws is not None and not self._ws.closed:
+            await self._ws.send_json(frame)
+
+    async def _apply_subscriptions(self, add_tickers, remove_tickers, add_candles, remove_candles):
+        if remove_tickers:
+            await self._send(self._frame("futures.tickers", "unsubscribe", sorted(remove_tickers)))
+        for contract in sorted(remove_candles):
+            await self._send(self._frame("futures.candlesticks", "unsubscribe", ["1m", contract]))
+        if add_tickers:
+            await self._send(self._frame("futures.tickers", "subscribe", sorted(add_tickers)))
+        for contract in sorted(add_candles):
+            await self._send(self._frame("futures.candlesticks", "subscribe", ["1m", contract]))
+
+    async def _ping(self):
+        while self._ws is not None and not self._ws.closed:
+            await asyncio.sleep(WS_PING_SECONDS)
+            await self._send(self._frame("futures.ping"))
+
+    async def _session(self, session):
+        async with session.ws_connect(self.url, heartbeat=WS_PING_SECONDS * 2) as ws:
+            self._ws = ws
+            self.connected = True
+            logging.info(f"📡 Market stream connected: {self.url}")
+            with self._lock:
+                tickers, candles = set(self._tickers), set(self._candles)
+            await self._apply_subscriptions(tickers, set(), candles, set())
+            ping = asyncio.ensure_future(self._ping())
+            record = open(self.record_path, "a") if self.record_path else None
+            try:
+                async for msg in ws:
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        if record:
+                            record.write(msg.data.rstrip("\n") + "\n")
+                        self.handle_message(msg.data)
+                    elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                        break
+            finally:
+                ping.cancel()
+                if record:
+                    record.close()
+                self.connected = False
+                self._ws = None
+
+    async def _run(self):
+        delay = 1
+        async with aiohttp.ClientSession() as session:
+            while not self._stopped:
+                try:
+                    await self._session(session)
+                    delay = 1
+                except Exception as e:
+                    logging.warning(f"Market stream disconnected: {e}")
+                if self._stopped:
+                    break
+                self.stats["reconnects"] += 1
+                # Кадры за время обрыва потеряны - свечи докачает REST при следующем чтении
+                if self.candle_cache is not None:
+                    self.candle_cache.expire()
+                await asyncio.sleep(delay + random.random())
+                delay = min(delay * 2, WS_MAX_RECONNECT_DELAY)
+
+    def _submit(self, coro):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def start(self):
+        """Запустить поток в отдельном daemon-потоке (один раз на процесс)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self._run(),),
+                                            name="market-stream", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._ws is not None and self._loop is not None:
+            self._submit(self._ws.close())
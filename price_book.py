@@ -0,0 +1,109 @@
+import os
+import time
+import logging
+import threading
+
+import requests
+
+from contract_index import normalize_symbol, GATE_REST_URL
+
+TICKERS_URL = f'{GATE_REST_URL}/futures/usdt/tickers'
+PRICE_MAX_AGE = float(os.getenv('PRICE_MAX_AGE', '30'))  # Секунд, после которых цена считается устаревшей
+PRICE_REFRESH_SECONDS = float(os.getenv('PRICE_REFRESH_SECONDS', '5'))
+
+
+class PriceBook:
+    """
+    Общая книга последних цен фьючерсов Gate.io по имени XNY_USDT.
+
+    Наполняется одним запросом /futures/usdt/tickers (фоновый поток и
+    fetch_top_gainers_background), позже - потоком WebSocket. Для каждой
+    пары хранится время обновления; чтение - O(1) поиск в dict без сети,
+    цены старше max_age считаются отсутствующими.
+    """
+
+    def __init__(self, max_age=PRICE_MAX_AGE, refresh_seconds=PRICE_REFRESH_SECONDS):
+        self.max_age = max_age
+        self.refresh_seconds = refresh_seconds
+        self._prices = {}  # symbol -> (price, mark_price, updated_at)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def update(self, symbol, price, mark_price=None, ts=None):
+        if not symbol or not price or price <= 0:
+            return
+        with self._lock:
+            self._prices[normalize_symbol(symbol)] = (float(price), mark_price, ts or time.time())
+
+    def ingest_tickers(self, tickers, ts=None):
+        """Тикеры из /futures/usdt/tickers -> книга цен"""
+        ts = ts or time.time()
+        fresh = {}
+        for ticker in tickers or []:
+            try:
+                price = float(ticker.get('last') or 0)
+                if price > 0:
+                    mark = ticker.get('mark_price')
+                    fresh[ticker['contract']] = (price, float(mark) if mark else None, ts)
+            except (KeyError, TypeError, ValueError):
+                continue
+        with self._lock:
+            self._prices.update(fresh)
+        return len(fresh)
+
+    def get(self, symbol, max_age=None):
+        """Последняя цена или None, если пары нет или цена старше max_age"""
+        entry = self._prices.get(normalize_symbol(symbol))
+        if entry is None:
+            return None
+        limit = self.max_age if max_age is None else max_age
+        if time.time() - entry[2] > limit:
+            return None
+        return entry[0]
+
+    def age(self, symbol):
+        """Возраст цены в секундах (None - цены нет)"""
+        entry = self._prices.get(normalize_symbol(symbol))
+        return None if entry is None else time.time() - entry[2]
+
+    def export(self):
+        """{symbol: [price, mark_price, updated_at]} для снимка движка"""
+        with self._lock:
+            return {symbol: list(entry) for symbol, entry in self._prices.items()}
+
+    def load_export(self, data):
+        """Принять цены из снимка движка (более свежие локальные цены не затираются)"""
+        with self._lock:
+            for symbol, (price, mark, ts) in (data or {}).items():
+                current = self._prices.get(symbol)
+                if current is None or current[2] < ts:
+                    self._prices[symbol] = (price, mark, ts)
+
+    def refresh(self):
+        """Загрузить все тикеры одним запросом"""
+        try:
+            response = requests.get(TICKERS_URL, timeout=10)
+            if response.status_code != 200:
+                logging.error(f"Gate.io tickers API error: {response.status_code}")
+                return False
+            self.ingest_tickers(response.json())
+            return True
+        except Exception as e:
+            logging.debug(f"Price book refresh failed: {e}")
+            return False
+
+    def _refresh_loop(self):
+        while True:
+            self.refresh()
+            time.sleep(self.refresh_seconds)
+
+    def start_background_refresh(self):
+        """Фоновое обновление цен (один поток на процесс)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._refresh_loop, name="price-book", daemon=True)
+            self._thread.start()
+
+
+price_book = PriceBook()
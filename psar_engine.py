@@ -0,0 +1,210 @@
+import threading
+import logging
+from collections import deque
+
+PSAR_STEP = 0.05
+PSAR_MAX_STEP = 0.5
+
+
+class StreamingPSAR:
+    """
+    Потоковый Parabolic SAR для одной пары (symbol, timeframe).
+
+    Повторяет рекурсию ta.trend.PSARIndicator шаг в шаг: закрытые свечи
+    фиксируются в состоянии (SAR, экстремум, ускорение), а текущая
+    незакрытая свеча считается "поверх" зафиксированного состояния без его
+    изменения. Каждое обновление O(1), результат совпадает с ta,
+    запущенным на той же истории свечей.
+    """
+
+    def __init__(self, step=PSAR_STEP, max_step=PSAR_MAX_STEP, history=200):
+        self.step = step
+        self.max_step = max_step
+        self.history = deque(maxlen=history)  # [(timestamp, close, sar)] закрытых свечей
+        self.reset()
+
+    def reset(self):
+        self.count = 0              # Сколько закрытых свечей учтено
+        self.up_trend = True
+        self.af = self.step
+        self.up_trend_high = None
+        self.down_trend_low = None
+        self.sar = None             # SAR последней закрытой свечи
+        self.high1 = self.high2 = None
+        self.low1 = self.low2 = None
+        self.last_closed_ts = None
+        self.first_ts = None        # Timestamp первой свечи, с которой начата рекурсия
+        self.current = None         # (timestamp, high, low, close, sar, up_trend) незакрытой свечи
+        self.history.clear()
+
+    def _step(self, high, low, close):
+        """Один шаг рекурсии ta. Возвращает новое состояние, не меняя self."""
+        if self.count == 0:
+            return dict(sar=close, up_trend=True, af=self.step,
+                        up_trend_high=high, down_trend_low=low)
+        if self.count == 1:
+            return dict(sar=close, up_trend=self.up_trend, af=self.af,
+                        up_trend_high=self.up_trend_high, down_trend_low=self.down_trend_low)
+
+        up_trend = self.up_trend
+        af = self.af
+        up_trend_high = self.up_trend_high
+        down_trend_low = self.down_trend_low
+        prev_sar = self.sar
+        reversal = False
+
+        if up_trend:
+            sar = prev_sar + af * (up_trend_high - prev_sar)
+            if low < sar:
+                reversal = True
+                sar = up_trend_high
+                down_trend_low = low
+                af = self.step
+            else:
+                if high > up_trend_high:
+                    up_trend_high = high
+                    af = min(af + self.step, self.max_step)
+                if self.low2 < sar:
+                    sar = self.low2
+                elif self.low1 < sar:
+                    sar = self.low1
+        else:
+            sar = prev_sar - af * (prev_sar - down_trend_low)
+            if high > sar:
+                reversal = True
+                sar = down_trend_low
+                up_trend_high = high
+                af = self.step
+            else:
+                if low < down_trend_low:
+                    down_trend_low = low
+                    af = min(af + self.step, self.max_step)
+                if self.high2 > sar:
+                    sar = self.high2
+                elif self.high1 > sar:
+                    sar = self.high1
+
+        return dict(sar=sar, up_trend=up_trend != reversal, af=af,
+                    up_trend_high=up_trend_high, down_trend_low=down_trend_low)
+
+    def _commit(self, ts, high, low, close):
+        """Зафиксировать закрытую свечу в состоянии"""
+        nxt = self._step(high, low, close)
+        self.sar = nxt["sar"]
+        self.up_trend = nxt["up_trend"]
+        self.af = nxt["af"]
+        self.up_trend_high = nxt["up_trend_high"]
+        self.down_trend_low = nxt["down_trend_low"]
+        self.high2, self.high1 = self.high1, high
+        self.low2, self.low1 = self.low1, low
+        self.count += 1
+        self.last_closed_ts = ts
+        self.history.append((ts, close, self.sar))
+
+    def update(self, ts, high, low, close):
+        """
+        Обновить движок свечой. Тот же timestamp - тик незакрытой свечи,
+        новый timestamp - предыдущая свеча закрылась. Возвращает SAR текущей свечи.
+        """
+        if self.current is not None:
+            if ts < self.current[0]:
+                return self.current[4]  # Устаревшие данные
+            if ts > self.current[0]:
+                cur_ts, cur_high, cur_low, cur_close = self.current[:4]
+                self._commit(cur_ts, cur_high, cur_low, cur_close)
+        nxt = self._step(high, low, close)
+        self.current = (ts, high, low, close, nxt["sar"], nxt["up_trend"])
+        return nxt["sar"]
+
+    def seed(self, candles):
+        """Пересчитать состояние с нуля по списку [ts, open, high, low, close, ...]"""
+        self.reset()
+        if candles:
+            self.first_ts = candles[0][0]
+        for c in candles:
+            self.update(c[0], float(c[2]), float(c[3]), float(c[4]))
+
+    def sync(self, candles):
+        """
+        Подать окно свечей (как из fetch_ohlcv). Обрабатываются только свечи
+        новее последней закрытой; если между состоянием и окном есть разрыв
+        или окно начинается раньше истории движка, движок пересобирается по окну.
+        """
+        if not candles:
+            return
+        if self.current is None or candles[0][0] < self.first_ts:
+            # Первое окно или окно длиннее известной истории (например, график на 100 свечей)
+            self.seed(candles)
+            return
+        cur_ts = self.current[0]
+        # Ищем с конца первую свечу, которую движок еще не зафиксировал
+        start = len(candles)
+        while start > 0 and candles[start - 1][0] >= cur_ts:
+            start -= 1
+        if start == len(candles):
+            return  # Окно целиком старее состояния
+        if candles[start][0] != cur_ts:
+            # Разрыв: в окне нет финальных значений текущей свечи
+            logging.debug(f"PSAR gap detected (state={cur_ts}, window_next={candles[start][0]}) - reseeding")
+            self.seed(candles)
+            return
+        for c in candles[start:]:
+            self.update(c[0], float(c[2]), float(c[3]), float(c[4]))
+
+    @property
+    def last_sar(self):
+        return self.current[4] if self.current else None
+
+    @property
+    def last_close(self):
+        return self.current[3] if self.current else None
+
+    def direction(self):
+        """'long' если close выше SAR, иначе 'short' (как get_direction_from_psar)"""
+        if self.current is None or self.count + 1 < 5:
+            return None  # Как compute_psar: меньше 5 свечей - нет сигнала
+        return "long" if self.current[3] > self.current[4] else "short"
+
+    def sar_by_timestamp(self):
+        """{timestamp: sar} для закрытых свечей из истории и текущей свечи"""
+        points = {ts: sar for ts, _, sar in self.history}
+        if self.current is not None:
+            points[self.current[0]] = self.current[4]
+        return points
+
+
+class PSARBook:
+    """Набор StreamingPSAR, по одному на (symbol, timeframe). Потокобезопасен."""
+
+    def __init__(self, step=PSAR_STEP, max_step=PSAR_MAX_STEP):
+        self.step = step
+        self.max_step = max_step
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def engine(self, symbol, timeframe):
+        key = (symbol, timeframe)
+        with self._lock:
+            eng = self._engines.get(key)
+            if eng is None:
+                eng = StreamingPSAR(step=self.step, max_step=self.max_step)
+                self._engines[key] = eng
+            return eng
+
+    def sync(self, symbol, timeframe, candles):
+        """Подать свечи и вернуть движок для (symbol, timeframe)"""
+        eng = self.engine(symbol, timeframe)
+        with self._lock:
+            eng.sync(candles)
+        return eng
+
+    def direction(self, symbol, timeframe):
+        with self._lock:
+            eng = self._engines.get((symbol, timeframe))
+            return eng.direction() if eng else None
+
+    def drop(self, symbol):
+        """Удалить все движки символа (например, после смены торговой пары)"""
+        with self._lock:
+            for key in [k for k in self._engines if k[0] == symbol]:
+                del self._engines[key]
@@ -0,0 +1,237 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from psar_engine import PSAR_STEP, PSAR_MAX_STEP
+
+SCAN_TOP_N = int(os.getenv('SCAN_TOP_N', '20'))             # Сколько топ-гейнеров сканировать
+SCAN_INTERVAL = float(os.getenv('SCAN_INTERVAL', '15'))     # Секунд между проходами сканера
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', '8'))          # Параллельные загрузки свечей
+SCAN_WINDOW = 50                                            # Свечей на уровень, как в get_directions
+
+
+def stack_candles(windows, width):
+    """
+    Окна свечей [ts, open, high, low, close, ...] разной длины -> матрицы
+    high/low/close (rows x width), выровненные по правому краю, и индекс
+    первой свечи каждой строки (слева NaN).
+    """
+    high = np.full((len(windows), width), np.nan)
+    low = np.full((len(windows), width), np.nan)
+    close = np.full((len(windows), width), np.nan)
+    start = np.full(len(windows), width, dtype=int)
+    for row, candles in enumerate(windows):
+        candles = candles[-width:] if candles else []
+        if not candles:
+            continue
+        arr = np.asarray(candles, dtype=float)
+        start[row] = width - len(arr)
+        high[row, start[row]:] = arr[:, 2]
+        low[row, start[row]:] = arr[:, 3]
+        close[row, start[row]:] = arr[:, 4]
+    return high, low, close, start
+
+
+def psar_step(sar, up, af, up_high, down_low, high1, high2, low1, low2, high, low, close,
+              step=PSAR_STEP, max_step=PSAR_MAX_STEP):
+    """
+    Шаг рекурсии PSAR (третья свеча и дальше) для массивов состояний:
+    prev SAR, тренд, ускорение, экстремумы и две предыдущие свечи.
+    Возвращает (sar, up, af, up_high, down_low) после свечи high/low/close.
+    """
+    with np.errstate(invalid='ignore'):
+        # Восходящий тренд
+        sar_up = sar + af * (up_high - sar)
+        rev_up = low < sar_up
+        new_high = high > up_high
+        keep_up = np.where(low2 < sar_up, low2, np.where(low1 < sar_up, low1, sar_up))
+        # Нисходящий тренд
+        sar_dn = sar - af * (sar - down_low)
+        rev_dn = high > sar_dn
+        new_low = low < down_low
+        keep_dn = np.where(high2 > sar_dn, high2, np.where(high1 > sar_dn, high1, sar_dn))
+
+        rev = np.where(up, rev_up, rev_dn)
+        grow = np.where(up, new_high, new_low)
+        new_sar = np.where(up, np.where(rev_up, up_high, keep_up), np.where(rev_dn, down_low, keep_dn))
+        new_af = np.where(rev, step, np.where(grow, np.minimum(af + step, max_step), af))
+        new_up_high = np.where(up & ~rev & new_high, high, np.where(~up & rev, high, up_high))
+        new_down_low = np.where(~up & ~rev & new_low, low, np.where(up & rev, low, down_low))
+    return new_sar, up != rev, new_af, new_up_high, new_down_low
+
+
+def batch_psar(high, low, close, start, step=PSAR_STEP, max_step=PSAR_MAX_STEP):
+    """
+    Parabolic SAR сразу для многих строк (символов): цикл по времени,
+    NumPy по строкам. Рекурсия та же, что в StreamingPSAR/ta, строка
+    начинается со свечи start[row]. Возвращает (sar, close) последней свечи.
+    """
+    rows, width = close.shape
+    sar = np.full(rows, np.nan)
+    up = np.ones(rows, dtype=bool)
+    af = np.full(rows, step)
+    up_high = np.full(rows, np.nan)
+    down_low = np.full(rows, np.nan)
+    high1 = high2 = low1 = low2 = np.full(rows, np.nan)
+    with np.errstate(invalid='ignore'):
+        for t in range(width):
+            i = t - start
+            active = i >= 0
+            h, l, c = high[:, t], low[:, t], close[:, t]
+
+            rec_sar, rec_up, rec_af, rec_high, rec_low = psar_step(
+                sar, up, af, up_high, down_low, high1, high2, low1, low2, h, l, c, step, max_step)
+
+            first, second = i == 0, i == 1
+            warm = first | second
+            new_sar = np.where(warm, c, rec_sar)
+            new_up = np.where(first, True, np.where(second, up, rec_up))
+            new_af = np.where(first, step, np.where(second, af, rec_af))
+            new_up_high = np.where(first, h, np.where(second, up_high, rec_high))
+            new_down_low = np.where(first, l, np.where(second, down_low, rec_low))
+
+            sar = np.where(active, new_sar, sar)
+            up = np.where(active, new_up, up)
+            af = np.where(active, new_af, af)
+            up_high = np.where(active, new_up_high, up_high)
+            down_low = np.where(active, new_down_low, down_low)
+            high2, high1 = np.where(active, high1, high2), np.where(active, h, high1)
+            low2, low1 = np.where(active, low1, low2), np.where(active, l, low1)
+    return sar, close[:, -1]
+
+
+def batch_directions(windows, width=SCAN_WINDOW, step=PSAR_STEP, max_step=PSAR_MAX_STEP):
+    """Окна свечей -> ['long'/'short'/None] (как StreamingPSAR.direction: меньше 5 свечей - None)"""
+    if not windows:
+        return []
+    high, low, close, start = stack_candles(windows, width)
+    sar, last_close = batch_psar(high, low, close, start, step, max_step)
+    directions = np.where(last_close > sar, 'long', 'short')
+    valid = (width - start >= 5) & np.isfinite(sar) & np.isfinite(last_close)
+    return [str(d) if ok else None for d, ok in zip(directions.tolist(), valid.tolist())]
+
+
+class PSARScanner:
+    """
+    SAR-направления для всего топа гейнеров сразу.
+
+    Раз в interval секунд свечи всех кандидатов по всем таймфреймам
+    грузятся параллельно (общие candle_cache/candle_resampler, так что
+    после прогрева это инкрементальные since= запросы), складываются в
+    матрицы и считаются batch_psar одним проходом на таймфрейм. Результат
+    публикуется целиком: pick(levels) и directions(symbol) - чтение
+    готового снимка без сети и без пересчета.
+    """
+
+    def __init__(self, timeframes, top_n=SCAN_TOP_N, interval=SCAN_INTERVAL, workers=SCAN_WORKERS,
+                 window=SCAN_WINDOW, step=PSAR_STEP, max_step=PSAR_MAX_STEP):
+        self.timeframes = list(timeframes)
+        self.top_n = top_n
+        self.interval = interval
+        self.window = window
+        self.step = step
+        self.max_step = max_step
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="psar-scan")
+        self.max_age = interval * 3
+        self._symbols = []
+        self._load = None
+        self._snapshot = {'updated_at': 0, 'symbols': [], 'directions': {}}
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.last_duration = None
+
+    def set_symbols(self, symbols, pinned=None):
+        """Кандидаты в порядке рейтинга; пара открытой позиции сканируется всегда"""
+        symbols = [s for s in symbols if s][:self.top_n]
+        if pinned and pinned not in symbols:
+            symbols = [pinned] + symbols
+        with self._lock:
+            changed = symbols != self._symbols
+            self._symbols = symbols
+        if changed:
+            self._wake.set()
+
+    def scan(self):
+        """Один проход: загрузка свечей параллельно, PSAR векторно по таймфреймам"""
+        with self._lock:
+            symbols = list(self._symbols)
+        if not symbols or self._load is None:
+            return None
+        started = time.time()
+        loaded = list(self.pool.map(self._safe_load, symbols))
+        directions = {symbol: {} for symbol in symbols}
+        for tf in self.timeframes:
+            windows = [frames.get(tf) or [] for frames in loaded]
+            for symbol, direction in zip(symbols, batch_directions(windows, self.window, self.step, self.max_step)):
+                directions[symbol][tf] = direction
+        snapshot = {'updated_at': time.time(), 'symbols': symbols, 'directions': directions}
+        with self._lock:
+            self._snapshot = snapshot
+        self.last_duration = time.time() - started
+        logging.info(f"🛰️ PSAR scan: {len(symbols)} symbols x {len(self.timeframes)} timeframes in {self.last_duration * 1000:.0f}ms")
+        return snapshot
+
+    def _safe_load(self, symbol):
+        try:
+            return self._load(symbol, self.timeframes, self.window) or {}
+        except Exception as e:
+            logging.debug(f"PSAR scan: no candles for {symbol}: {e}")
+            return {}
+
+    # ----- Чтение готового снимка -----
+
+    def is_fresh(self):
+        return time.time() - self._snapshot['updated_at'] <= self.max_age
+
+    def directions(self, symbol):
+        """{tf: direction} символа из последнего прохода (пусто, если символ не сканировался)"""
+        return dict(self._snapshot['directions'].get(symbol, {}))
+
+    def aligned(self, levels):
+        """[(symbol, direction, {tf: direction})] символов, где все levels совпадают, в порядке рейтинга"""
+        snapshot = self._snapshot
+        result = []
+        for symbol in snapshot['symbols']:
+            directions = snapshot['directions'].get(symbol, {})
+            values = {directions.get(level) for level in levels}
+            if len(values) == 1 and values <= {'long', 'short'}:
+                result.append((symbol, values.pop(), dict(directions)))
+        return result
+
+    def pick(self, levels, exclude=()):
+        """Лучший выровненный символ (symbol, direction, directions) или None; None и при устаревшем снимке"""
+        if not levels or not self.is_fresh():
+            return None
+        return next((entry for entry in self.aligned(levels) if entry[0] not in exclude), None)
+
+    def export(self, levels=None):
+        snapshot = self._snapshot
+        export = {'updated_at': snapshot['updated_at'], 'duration': self.last_duration, 'symbols': snapshot['symbols']}
+        if levels:
+            export['aligned'] = [{'symbol': s, 'direction': d} for s, d, _ in self.aligned(levels)]
+        return export
+
+    # ----- Фон -----
+
+    def _loop(self):
+        while True:
+            try:
+                self.scan()
+            except Exception as e:
+                logging.error(f"PSAR scan error: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self, load):
+        """load(symbol, timeframes, limit) -> {tf: свечи}; один поток сканера на процесс"""
+        self._load = load
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name="psar-scanner", daemon=True)
+            self._thread.start()
@@ -0,0 +1,319 @@
+import os
+import time
+import uuid
+import zlib
+import logging
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+from ccxt.base.errors import BadSymbol, InsufficientFunds, InvalidOrder
+
+from contract_index import normalize_symbol
+from market_simulator import MarketSimulator, SIMULATOR_SEED, SIMULATOR_SPEED
+
+SIM_BALANCE = float(os.getenv('SIM_BALANCE', '100'))                  # Стартовый баланс USDT
+SIM_SLIPPAGE_BPS = float(os.getenv('SIM_SLIPPAGE_BPS', '2'))          # Проскальзывание рыночной заявки против нас
+SIM_FEE_RATE = float(os.getenv('SIM_FEE_RATE', '0.0005'))             # Taker-комиссия Gate.io
+SIM_LATENCY_MS = float(os.getenv('SIM_LATENCY_MS', '30'))             # Базовая задержка ответа
+SIM_LATENCY_JITTER_MS = float(os.getenv('SIM_LATENCY_JITTER_MS', '20'))  # Экспоненциальный хвост задержки
+SIM_HISTORY = int(os.getenv('SIM_HISTORY', str(15000)))               # Минут истории на символ
+SIM_VOLATILITY = float(os.getenv('SIM_VOLATILITY', '0.02'))           # Волатильность за час
+
+
+def _iso(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class SimulatedExchange:
+    """
+    Биржа-симулятор с интерфейсом ccxt.gate (той частью, что использует бот).
+
+    Каждая пара - свой MarketSimulator (seed из общего seed и имени пары),
+    все на общих ускоренных часах. Цена и размер контракта новой пары
+    берутся из price_book/contract_index, если они ее знают, иначе
+    генерируются из seed. Позиции - one-way, как на Gate.io: встречная
+    заявка уменьшает позицию. Рыночные заявки исполняются после задержки
+    по цене симулятора с проскальзыванием и комиссией; изолированная маржа,
+    нереализованный P&L по mark price, ликвидация при убытке больше маржи.
+    Сеть не нужна.
+    """
+
+    id = 'gate-sim'
+
+    def __init__(self, balance=SIM_BALANCE, seed=SIMULATOR_SEED, speed=SIMULATOR_SPEED,
+                 slippage_bps=SIM_SLIPPAGE_BPS, fee_rate=SIM_FEE_RATE, latency_ms=SIM_LATENCY_MS,
+                 latency_jitter_ms=SIM_LATENCY_JITTER_MS, history_minutes=SIM_HISTORY,
+                 volatility=SIM_VOLATILITY, price_book=None, contract_index=None):
+        self.seed = seed
+        self.speed = speed
+        self.slippage_bps = slippage_bps
+        self.fee_rate = fee_rate
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.history_minutes = history_minutes
+        self.volatility = volatility
+        self.price_book = price_book
+        self.contract_index = contract_index
+        self.markets = {}
+        self._simulators = {}
+        self._leverage = {}
+        self._margin_mode = {}
+        self._positions = {}        # id пары -> {'contracts': со знаком, 'entry_price', 'margin', 'timestamp'}
+        self._cash = float(balance)
+        self._lock = threading.RLock()
+        self._latency_rng = np.random.default_rng(seed)
+        self._wall_start = time.time()
+        self._start_ms = int(self._wall_start * 1000)
+        self._offset = 0.0
+        self.stats = {"orders": 0, "fees": 0.0, "liquidations": 0}
+
+    # ----- Часы -----
+
+    def milliseconds(self):
+        """Время симуляции (мс), общее для всех пар"""
+        return self._start_ms + int(((time.time() - self._wall_start) * self.speed + self._offset) * 1000)
+
+    def fast_forward(self, seconds):
+        """Промотать время всех пар вперед"""
+        with self._lock:
+            self._offset += seconds
+            simulators = list(self._simulators.values())
+        for simulator in simulators:
+            simulator.fast_forward(seconds)
+
+    def _sleep(self):
+        """Задержка ответа биржи: база + экспоненциальный хвост"""
+        delay = self.latency_ms
+        if self.latency_jitter_ms:
+            with self._lock:
+                delay += self._latency_rng.exponential(self.latency_jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    # ----- Рынки -----
+
+    def market(self, symbol):
+        """ccxt-описание рынка; новая пара создается при первом обращении"""
+        market_id = normalize_symbol(symbol)
+        if not market_id or '_' not in market_id:
+            raise BadSymbol(f"{self.id} does not have market symbol {symbol}")
+        with self._lock:
+            if market_id not in self._simulators:
+                self._add_market(market_id)
+            base, quote = market_id.split('_', 1)
+            return self.markets[f"{base}/{quote}:{quote}"]
+
+    def _add_market(self, market_id):
+        base, quote = market_id.split('_', 1)
+        rng = np.random.default_rng([self.seed, zlib.crc32(market_id.encode())])
+        price = self.price_book.get(market_id) if self.price_book is not None else None
+        if not price:
+            price = float(10 ** rng.uniform(-3, 4))
+        contract_size = self.contract_index.contract_size(market_id, None, fetch_missing=False) if self.contract_index is not None else None
+        if not contract_size:
+            # Контракт порядка 1-10 USDT, как у большинства пар Gate.io
+            contract_size = float(10 ** np.floor(np.log10(5 / price)))
+        self._simulators[market_id] = MarketSimulator(
+            initial_price=price, volatility=self.volatility, seed=int(rng.integers(2 ** 31)),
+            speed=self.speed, history_minutes=self.history_minutes, start=self.milliseconds())
+        symbol = f"{base}/{quote}:{quote}"
+        self.markets[symbol] = {
+            'id': market_id, 'symbol': symbol, 'base': base, 'quote': quote, 'settle': quote,
+            'type': 'swap', 'spot': False, 'swap': True, 'future': False, 'contract': True,
+            'linear': True, 'inverse': False, 'active': True, 'contractSize': contract_size,
+            'taker': self.fee_rate, 'maker': self.fee_rate,
+            'precision': {'amount': 1.0, 'price': None},
+            'limits': {'amount': {'min': 1.0, 'max': None}, 'leverage': {'min': 1, 'max': 100}},
+            'info': {'name': market_id, 'quanto_multiplier': str(contract_size)},
+        }
+        logging.info(f"🧪 Simulated market {market_id}: price {price:.8g}, contract size {contract_size:g}")
+
+    def load_markets(self, reload=False, params={}):
+        return self.markets
+
+    def simulator(self, symbol):
+        """MarketSimulator пары (свечи и цена без задержки - это локальные данные, а не запрос)"""
+        return self._simulators[self.market(symbol)['id']]
+
+    def price(self, symbol):
+        return self.simulator(symbol).get_current_price()
+
+    # ----- Публичные данные -----
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params={}):
+        self._sleep()
+        candles = self.simulator(symbol).fetch_ohlcv(timeframe, limit=limit or 100)
+        if since is not None:
+            candles = [c for c in candles if c[0] >= since]
+        return candles
+
+    def fetch_ticker(self, symbol, params={}):
+        self._sleep()
+        market = self.market(symbol)
+        last = self.price(symbol)
+        now = self.milliseconds()
+        return {'symbol': market['symbol'], 'timestamp': now, 'datetime': _iso(now), 'last': last,
+                'close': last, 'bid': last, 'ask': last, 'mark': last, 'info': {}}
+
+    # ----- Настройки -----
+
+    def set_leverage(self, leverage, symbol=None, params={}):
+        self._sleep()
+        self._leverage[self.market(symbol)['id']] = float(leverage)
+        return {'leverage': leverage}
+
+    def set_margin_mode(self, margin_mode, symbol=None, params={}):
+        self._sleep()
+        self._margin_mode[self.market(symbol)['id']] = margin_mode
+        return {'marginMode': margin_mode}
+
+    # ----- Позиции и баланс -----
+
+    def _unrealized(self, market_id, pos, mark):
+        return pos['contracts'] * self._market_by_id(market_id)['contractSize'] * (mark - pos['entry_price'])
+
+    def _market_by_id(self, market_id):
+        base, quote = market_id.split('_', 1)
+        return self.markets[f"{base}/{quote}:{quote}"]
+
+    def _liquidate(self):
+        """Изолированная маржа: убыток больше маржи - позиция закрывается, маржа теряется"""
+        for market_id, pos in list(self._positions.items()):
+            mark = self._simulators[market_id].get_current_price()
+            if self._unrealized(market_id, pos, mark) <= -pos['margin']:
+                self._cash -= pos['margin']  # Маржа сгорает вместе с позицией
+                del self._positions[market_id]
+                self.stats["liquidations"] += 1
+                logging.warning(f"🧪 Simulated liquidation {market_id}: {pos['contracts']} contracts @ {mark:.8g}, "
+                                f"margin {pos['margin']:.4f} lost, cash {self._cash:.4f}")
+
+    def _position(self, market_id, pos):
+        market = self._market_by_id(market_id)
+        mark = self._simulators[market_id].get_current_price()
+        contracts = abs(pos['contracts'])
+        leverage = self._leverage.get(market_id, 10.0)
+        unrealized = self._unrealized(market_id, pos, mark)
+        side = 'long' if pos['contracts'] > 0 else 'short'
+        # Цена, при которой убыток равен марже
+        move = pos['margin'] / (contracts * market['contractSize'])
+        liquidation = pos['entry_price'] - move if side == 'long' else pos['entry_price'] + move
+        return {
+            'symbol': market['symbol'], 'id': None, 'timestamp': pos['timestamp'], 'datetime': _iso(pos['timestamp']),
+            'side': side, 'contracts': contracts, 'contractSize': market['contractSize'],
+            'entryPrice': pos['entry_price'], 'markPrice': mark,
+            'notional': contracts * market['contractSize'] * mark, 'leverage': leverage,
+            'collateral': pos['margin'] + unrealized, 'initialMargin': pos['margin'],
+            'unrealizedPnl': unrealized, 'percentage': unrealized / pos['margin'] * 100 if pos['margin'] else 0.0,
+            'liquidationPrice': max(liquidation, 0.0), 'marginMode': self._margin_mode.get(market_id, 'isolated'),
+            'hedged': False, 'info': {'contract': market_id, 'size': pos['contracts']},
+        }
+
+    def fetch_positions(self, symbols=None, params={}):
+        self._sleep()
+        wanted = {self.market(s)['id'] for s in symbols} if symbols else None
+        with self._lock:
+            self._liquidate()
+            return [self._position(market_id, pos) for market_id, pos in self._positions.items()
+                    if wanted is None or market_id in wanted]
+
+    def fetch_balance(self, params={}):
+        self._sleep()
+        with self._lock:
+            self._liquidate()
+            used = sum(pos['margin'] for pos in self._positions.values())
+            unrealized = sum(self._unrealized(market_id, pos, self._simulators[market_id].get_current_price())
+                             for market_id, pos in self._positions.items())
+            total = self._cash + unrealized
+            free = self._cash - used
+        usdt = {'free': free, 'used': used, 'total': total}
+        return {'USDT': usdt, 'free': {'USDT': free}, 'used': {'USDT': used}, 'total': {'USDT': total},
+                'info': [{'currency': 'USDT', 'available': str(free), 'total': str(total)}]}
+
+    # ----- Заявки -----
+
+    def create_order(self, symbol, type, side, amount, price=None, params={}):
+        """Рыночная заявка (amount - контракты); лимитная исполняется сразу, если цена не хуже лимита"""
+        if side not in ('buy', 'sell'):
+            raise InvalidOrder(f"{self.id} invalid order side {side}")
+        contracts = int(float(amount))
+        if contracts <= 0:
+            raise InvalidOrder(f"{self.id} order amount must be at least 1 contract, got {amount}")
+        market = self.market(symbol)
+        market_id = market['id']
+        self._sleep()
+        with self._lock:
+            self._liquidate()
+            mark = self._simulators[market_id].get_current_price()
+            slip = self.slippage_bps / 10000
+            fill = mark * (1 + slip) if side == 'buy' else mark * (1 - slip)
+            if type == 'limit' and price is not None and (fill > price if side == 'buy' else fill < price):
+                raise InvalidOrder(f"{self.id} limit orders are filled only when marketable")
+
+            pos = self._positions.get(market_id)
+            current = pos['contracts'] if pos else 0
+            signed = contracts if side == 'buy' else -contracts
+            if params.get('reduceOnly'):
+                if current == 0 or (current > 0) == (signed > 0):
+                    raise InvalidOrder(f"{self.id} reduceOnly order would increase position on {market_id}")
+                signed = max(signed, -current) if current > 0 else min(signed, -current)
+            leverage = self._leverage.get(market_id, 10.0)
+            size = market['contractSize']
+
+            closing = 0
+            if current and (current > 0) != (signed > 0):
+                closing = min(abs(signed), abs(current)) * (1 if signed > 0 else -1)
+            opening = signed - closing
+            fee = abs(signed) * size * fill * self.fee_rate
+            new_margin = abs(opening) * size * fill / leverage
+            used = sum(p['margin'] for p in self._positions.values())
+            if new_margin + fee > self._cash - used + (pos['margin'] * abs(closing) / abs(current) if closing else 0):
+                raise InsufficientFunds(f"{self.id} insufficient margin: need {new_margin + fee:.4f} USDT")
+
+            now = self.milliseconds()
+            if closing:
+                realized = -closing * size * (fill - pos['entry_price'])
+                self._cash += realized
+                pos['margin'] *= 1 - abs(closing) / abs(current)
+                pos['contracts'] += closing
+                if pos['contracts'] == 0:
+                    del self._positions[market_id]
+                    pos = None
+            if opening:
+                if pos is None:
+                    pos = self._positions[market_id] = {'contracts': 0, 'entry_price': fill, 'margin': 0.0, 'timestamp': now}
+                total = pos['contracts'] + opening
+                pos['entry_price'] = (pos['entry_price'] * abs(pos['contracts']) + fill * abs(opening)) / abs(total)
+                pos['contracts'] = total
+                pos['margin'] += new_margin
+            self._cash -= fee
+            self.stats["orders"] += 1
+            self.stats["fees"] += fee
+
+        filled = abs(signed)
+        return {
+            'id': uuid.uuid4().hex[:16], 'clientOrderId': None, 'timestamp': now, 'datetime': _iso(now),
+            'symbol': market['symbol'], 'type': 'market', 'side': side, 'price': fill, 'average': fill,
+            'amount': contracts, 'filled': filled, 'remaining': 0, 'cost': filled * size * fill,
+            'status': 'closed', 'reduceOnly': bool(params.get('reduceOnly')), 'timeInForce': 'IOC',
+            'fee': {'cost': fee, 'currency': market['settle']}, 'trades': [], 'info': {'contract': market_id},
+        }
+
+    def create_market_buy_order(self, symbol, amount, params={}):
+        return self.create_order(symbol, 'market', 'buy', amount, params=params)
+
+    def create_market_sell_order(self, symbol, amount, params={}):
+        return self.create_order(symbol, 'market', 'sell', amount, params=params)
+
+
+_exchange = None
+_exchange_lock = threading.Lock()
+
+
+def get_simulated_exchange(**kwargs):
+    """Одна биржа-симулятор на процесс: все экземпляры TradingBot видят одни позиции и баланс"""
+    global _exchange
+    with _exchange_lock:
+        if _exchange is None:
+            _exchange = SimulatedExchange(**kwargs)
+        return _exchange
@@ -0,0 +1,106 @@
+import time
+import random
+import logging
+import threading
+
+
+class SingleFlightRefresher:
+    """
+    Одно обновление за раз для дорогой фоновой загрузки (топ-гейнеры).
+
+    refresh() запускает fn(), только если ни одна загрузка сейчас не идет;
+    остальные вызывающие ждут ее завершения и получают тот же результат.
+    trigger() - неблокирующий вариант: максимум один поток на процесс,
+    сколько бы клиентов ни опрашивало. start() - плановое обновление раз в
+    interval секунд со случайным сдвигом (jitter), после ошибок пауза
+    растет экспоненциально до max_backoff. fn() возвращает False или
+    бросает исключение при неудаче.
+    """
+
+    def __init__(self, fn, interval, jitter=0.2, max_backoff=300, name="refresher"):
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.name = name
+        self.updated_at = 0
+        self.failures = 0
+        self.retry_at = 0
+        self.result = None
+        self._lock = threading.Lock()
+        self._done = None       # threading.Event текущей загрузки (None - загрузки нет)
+        self._thread = None
+        self.stats = {"runs": 0, "joined": 0, "errors": 0}
+
+    def _delay(self):
+        # Обычный интервал, при ошибках - interval * 2^failures, с jitter против синхронных залпов
+        base = self.interval if not self.failures else min(self.max_backoff, self.interval * 2 ** self.failures)
+        return base * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def is_stale(self, max_age=None):
+        return time.time() - self.updated_at > (self.interval if max_age is None else max_age)
+
+    def refresh(self, max_age=None, timeout=60):
+        """Обновить и дождаться результата; идущая загрузка переиспользуется, свежий результат отдается сразу"""
+        with self._lock:
+            if max_age is not None and not self.is_stale(max_age):
+                return self.result
+            done = self._done
+            joined = done is not None
+            if joined:
+                self.stats["joined"] += 1
+            else:
+                done = self._done = threading.Event()
+        if joined:
+            done.wait(timeout)
+            return self.result
+        return self._flight(done)
+
+    def _flight(self, done):
+        try:
+            return self._run()
+        finally:
+            with self._lock:
+                self._done = None
+            done.set()
+
+    def _run(self):
+        self.stats["runs"] += 1
+        try:
+            result = self.fn()
+        except Exception as e:
+            logging.error(f"{self.name} refresh error: {e}")
+            result = False
+        if result is False:
+            self.failures += 1
+            self.stats["errors"] += 1
+            self.retry_at = time.time() + self._delay()
+            logging.warning(f"⏳ {self.name}: refresh failed {self.failures}x, next try in {self.retry_at - time.time():.0f}s")
+        else:
+            self.failures = 0
+            self.retry_at = 0
+            self.result = result
+            self.updated_at = time.time()
+        return self.result
+
+    def trigger(self, max_age=None):
+        """Неблокирующее обновление, если данные устарели, загрузка не идет и нет паузы после ошибки"""
+        with self._lock:
+            if self._done is not None or time.time() < self.retry_at or not self.is_stale(max_age):
+                return False
+            done = self._done = threading.Event()
+        threading.Thread(target=self._flight, args=(done,), name=self.name, daemon=True).start()
+        return True
+
+    def _loop(self):
+        while True:
+            self.refresh(max_age=self.interval * (1 - self.jitter))
+            time.sleep(self._delay())
+
+    def start(self):
+        """Плановое обновление в фоне (один поток на процесс)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name=f"{self.name}-loop", daemon=True)
+            self._thread.start()
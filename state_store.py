@@ -0,0 +1,446 @@
+import os
+import copy
+import json
+import time
+import sqlite3
+import logging
+import atexit
+import threading
+
+STATE_DB_FILE = os.getenv('STATE_DB_FILE', 'goldantelopegate_v1.0_state.db')
+LEGACY_STATE_FILE = 'goldantelopegate_v1.0_state.json'
+DEFAULT_STRATEGY_CONFIG = {'open_levels': ['5m', '30m'], 'close_levels': ['5m']}
+TRADES_LIMIT = 20         # Сколько последних сделок отдает load_state (как DASHBOARD_MAX)
+CLOSE_LEASE_SECONDS = 60  # Через сколько секунд зависшее закрытие может перехватить другой воркер
+STATE_SAVE_COALESCE = float(os.getenv('STATE_SAVE_COALESCE', '0.25'))  # Окно склейки save_state_to_file
+
+# Ключи состояния, которые живут в отдельных таблицах, а не в flags
+POSITION_KEYS = ('in_position', 'position')
+SPECIAL_KEYS = POSITION_KEYS + ('trades', 'strategy_config')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS flags (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS position (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    in_position INTEGER NOT NULL DEFAULT 0,
+    position_id TEXT,
+    data TEXT,
+    closing_at REAL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS trades (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trade_key TEXT UNIQUE NOT NULL,
+    position_id TEXT,
+    symbol TEXT,
+    side TEXT,
+    pnl REAL,
+    closed_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS strategy_config (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    open_levels TEXT NOT NULL,
+    close_levels TEXT NOT NULL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def _dumps(value):
+    return json.dumps(value, default=str, separators=(',', ':'))
+
+
+def _trade_key(trade):
+    """Уникальный ключ сделки: position_id, для старых записей - время + пара"""
+    return trade.get('position_id') or f"{trade.get('time')}|{trade.get('symbol')}|{trade.get('side')}"
+
+
+class StateStore:
+    """
+    Хранилище состояния бота в SQLite (WAL) вместо goldantelopegate_v1.0_state.json.
+
+    Типизированные таблицы: position (одна строка), trades, strategy_config,
+    flags (остальные ключи state как JSON). Каждая запись - одна транзакция,
+    поэтому воркеры gunicorn никогда не читают наполовину записанное
+    состояние. Открытие и закрытие позиции - compare-and-set по position_id,
+    второй воркер получает False вместо дубля сделки. Счетчик version в meta
+    растет при каждой записи: load_state() при неизменной версии отдает
+    копию из памяти без чтения таблиц.
+
+    При первом запуске состояние импортируется из старого JSON-файла.
+    """
+
+    def __init__(self, path=STATE_DB_FILE, legacy_path=LEGACY_STATE_FILE):
+        self.path = path
+        self.legacy_path = legacy_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._cache = None
+        self._cache_version = None
+        self._seen_position_id = None
+        self._strategy_config = None  # Последний прочитанный/записанный этим процессом strategy_config
+        self._initialized = False
+        self.local_writes = 0  # Записей из этого процесса (для StateWatcher)
+
+    # ----- Соединение -----
+
+    def _connect(self):
+        # sqlite3-соединение нельзя делить между потоками и переносить через fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'pid', None) == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=10000')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        if not self._initialized or self._pid != os.getpid():
+            self._init_schema(conn)
+        return conn
+
+    def _init_schema(self, conn):
+        with self._lock:
+            conn.executescript(SCHEMA)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                fresh = conn.execute('SELECT COUNT(*) FROM position').fetchone()[0] == 0
+                if fresh:
+                    conn.execute('INSERT INTO position (id, in_position, updated_at) VALUES (1, 0, ?)', (time.time(),))
+                    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+                    self._import_legacy(conn)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self._seen_position_id = conn.execute('SELECT position_id FROM position WHERE id = 1').fetchone()[0]
+            self._pid = os.getpid()
+            self._initialized = True
+
+    def _import_legacy(self, conn):
+        """Одноразовый перенос goldantelopegate_v1.0_state.json в таблицы"""
+        try:
+            with open(self.legacy_path, 'r') as f:
+                legacy = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.warning(f"Could not import legacy state file: {e}")
+            return
+        self._write_state(conn, legacy, position_guard=False)
+        if legacy.get('strategy_config'):
+            self._write_strategy_config(conn, legacy['strategy_config'])
+        logging.info(f"📦 Imported legacy state file into {self.path} ({len(legacy.get('trades', []))} trades)")
+
+    def _transaction(self, fn):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            conn.execute('COMMIT')
+            self.local_writes += 1
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def version(self):
+        """Счетчик записей (растет при каждом изменении из любого процесса)"""
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    # ----- Чтение -----
+
+    def load_state(self):
+        """Полное состояние в формате старого JSON-файла (копия, менять можно)"""
+        version = self.version()
+        with self._lock:
+            if self._cache is not None and self._cache_version == version:
+                return self.copy_state(self._cache)
+        conn = self._connect()
+        state = {}
+        for key, value in conn.execute('SELECT key, value FROM flags'):
+            state[key] = json.loads(value)
+        in_position, position_id, data = conn.execute(
+            'SELECT in_position, position_id, data FROM position WHERE id = 1').fetchone()
+        state['in_position'] = bool(in_position)
+        state['position'] = json.loads(data) if data else None
+        state['trades'] = self._read_trades(conn)
+        state['strategy_config'] = self._read_strategy_config(conn)
+        with self._lock:
+            self._seen_position_id = position_id
+            self._cache = state
+            self._cache_version = version
+            self._strategy_config = state['strategy_config']
+        return self.copy_state(state)
+
+    @staticmethod
+    def copy_state(state):
+        result = dict(state)
+        result['trades'] = list(state['trades'])
+        result['strategy_config'] = dict(state['strategy_config'])
+        # position вложенный (stop, levels, ...) - правка копии не должна менять кэш
+        result['position'] = copy.deepcopy(state.get('position'))
+        return result
+
+    def get(self, key, default=None):
+        """Точечное чтение одного флага"""
+        row = self._connect().execute('SELECT value FROM flags WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def get_position(self):
+        """(in_position, position)"""
+        in_position, position_id, data = self._connect().execute(
+            'SELECT in_position, position_id, data FROM position WHERE id = 1').fetchone()
+        with self._lock:
+            self._seen_position_id = position_id
+        return bool(in_position), (json.loads(data) if data else None)
+
+    def _read_trades(self, conn, limit=TRADES_LIMIT):
+        rows = conn.execute('SELECT data FROM trades ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def get_trades(self, limit=TRADES_LIMIT):
+        return self._read_trades(self._connect(), limit)
+
+    def has_trade(self, position_id):
+        row = self._connect().execute('SELECT 1 FROM trades WHERE position_id = ?', (position_id,)).fetchone()
+        return row is not None
+
+    def _read_strategy_config(self, conn):
+        row = conn.execute('SELECT open_levels, close_levels FROM strategy_config WHERE id = 1').fetchone()
+        if row is None:
+            return dict(DEFAULT_STRATEGY_CONFIG)
+        return {'open_levels': json.loads(row[0]), 'close_levels': json.loads(row[1])}
+
+    def get_strategy_config(self):
+        return self._read_strategy_config(self._connect())
+
+    def cached_strategy_config(self):
+        """strategy_config из памяти (load_state, в том числе из StateWatcher, или set_strategy_config) - без чтения базы"""
+        with self._lock:
+            config = self._strategy_config
+        if config is None:
+            config = self.get_strategy_config()
+            with self._lock:
+                self._strategy_config = config
+        return dict(config)
+
+    # ----- Запись -----
+
+    def _write_trades(self, conn, trades):
+        """
+        Дописать новые сделки списка (INSERT OR IGNORE по ключу). Ничего не удаляет:
+        сделки, которых нет в списке, могли быть только что вставлены другим воркером.
+        Удаление - только явное, через delete_trades/clear_trades. Старые сделки за
+        пределами окна сохраняются.
+        """
+        for trade in trades:
+            conn.execute(
+                'INSERT OR IGNORE INTO trades (trade_key, position_id, symbol, side, pnl, closed_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (_trade_key(trade), trade.get('position_id'), trade.get('symbol'), trade.get('side'),
+                 trade.get('pnl'), trade.get('time'), _dumps(trade)))
+
+    def _write_flags(self, conn, values):
+        conn.executemany('INSERT OR REPLACE INTO flags (key, value) VALUES (?, ?)',
+                         [(key, _dumps(value)) for key, value in values.items()])
+
+    def _write_strategy_config(self, conn, config):
+        conn.execute('INSERT OR REPLACE INTO strategy_config (id, open_levels, close_levels, updated_at) '
+                     'VALUES (1, ?, ?, ?)',
+                     (_dumps(config.get('open_levels', [])), _dumps(config.get('close_levels', [])), time.time()))
+
+    def _write_state(self, conn, state, position_guard=True):
+        self._write_flags(conn, {k: v for k, v in state.items() if k not in SPECIAL_KEYS})
+        if 'trades' in state:
+            self._write_trades(conn, state['trades'] or [])
+        if 'in_position' in state or 'position' in state:
+            position = state.get('position')
+            in_position = bool(state.get('in_position')) and position is not None
+            position_id = position.get('position_id') if position else None
+            sql = ('UPDATE position SET in_position = ?, position_id = ?, data = ?, closing_at = NULL, updated_at = ? '
+                   'WHERE id = 1')
+            params = [int(in_position), position_id, _dumps(position) if position else None, time.time()]
+            if position_guard:
+                # Оптимистичная блокировка: не затирать позицию, которую этот процесс еще не видел
+                sql += ' AND (position_id IS ? OR position_id IS ?)'
+                params += [self._seen_position_id, position_id]
+            if conn.execute(sql, params).rowcount:
+                self._seen_position_id = position_id
+            else:
+                logging.warning("State save skipped position: it was changed by another worker")
+
+    def save_state(self, state):
+        """Записать состояние (flags, trades, position) одной транзакцией"""
+        self._transaction(lambda conn: self._write_state(conn, state))
+
+    def set_flags(self, **values):
+        """Точечная запись нескольких флагов"""
+        self._transaction(lambda conn: self._write_flags(conn, values))
+
+    def set_strategy_config(self, config):
+        self._transaction(lambda conn: self._write_strategy_config(conn, config))
+        with self._lock:
+            self._strategy_config = {'open_levels': list(config.get('open_levels', [])),
+                                     'close_levels': list(config.get('close_levels', []))}
+
+    def delete_trades(self, trades):
+        """Удалить перечисленные сделки по ключу (delete_last_trade). Возвращает число удаленных"""
+        keys = [(_trade_key(trade),) for trade in trades]
+        return self._transaction(lambda conn: conn.executemany('DELETE FROM trades WHERE trade_key = ?', keys).rowcount)
+
+    def clear_trades(self):
+        """Очистить историю сделок (reset_balance)"""
+        self._transaction(lambda conn: conn.execute('DELETE FROM trades'))
+
+    # ----- Compare-and-set для позиции -----
+
+    def open_position(self, position, **flags):
+        """Открыть позицию, только если сейчас позиции нет. True - позиция записана"""
+        def op(conn):
+            updated = conn.execute(
+                'UPDATE position SET in_position = 1, position_id = ?, data = ?, closing_at = NULL, updated_at = ? '
+                'WHERE id = 1 AND in_position = 0',
+                (position.get('position_id'), _dumps(position), time.time())).rowcount
+            if updated:
+                self._write_flags(conn, flags)
+                self._seen_position_id = position.get('position_id')
+            return bool(updated)
+        return self._transaction(op)
+
+    def begin_close(self, position_id):
+        """Захватить закрытие позиции (аренда на CLOSE_LEASE_SECONDS). False - уже закрыта или закрывается"""
+        now = time.time()
+        return bool(self._transaction(lambda conn: conn.execute(
+            'UPDATE position SET closing_at = ? WHERE id = 1 AND in_position = 1 AND position_id = ? '
+            'AND (closing_at IS NULL OR closing_at < ?)',
+            (now, position_id, now - CLOSE_LEASE_SECONDS)).rowcount))
+
+    def finish_close(self, position_id, trade=None, **flags):
+        """Закрыть позицию position_id, записать сделку и флаги (balance, ...) одной транзакцией"""
+        def op(conn):
+            updated = conn.execute(
+                'UPDATE position SET in_position = 0, position_id = NULL, data = NULL, closing_at = NULL, '
+                'updated_at = ? WHERE id = 1 AND in_position = 1 AND position_id = ?',
+                (time.time(), position_id)).rowcount
+            if not updated:
+                return False
+            if trade is not None:
+                conn.execute(
+                    'INSERT OR IGNORE INTO trades (trade_key, position_id, symbol, side, pnl, closed_at, data) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (_trade_key(trade), trade.get('position_id'), trade.get('symbol'), trade.get('side'),
+                     trade.get('pnl'), trade.get('time'), _dumps(trade)))
+            self._write_flags(conn, flags)
+            self._seen_position_id = None
+            return True
+        return self._transaction(op)
+
+    def clear_position(self, position_id=None):
+        """Снять позицию без сделки (ghost-позиция, сброс). position_id - только если это она"""
+        def op(conn):
+            sql = ('UPDATE position SET in_position = 0, position_id = NULL, data = NULL, closing_at = NULL, '
+                   'updated_at = ? WHERE id = 1')
+            params = [time.time()]
+            if position_id is not None:
+                sql += ' AND position_id = ?'
+                params.append(position_id)
+            self._seen_position_id = None
+            return bool(conn.execute(sql, params).rowcount)
+        return self._transaction(op)
+
+
+class StateWriter:
+    """
+    Склейка и дедупликация записей состояния для TradingBot.save_state_to_file.
+
+    save() только запоминает ссылку на state и взводит таймер: все вызовы в
+    пределах окна (close_position делает до четырех подряд) превращаются в
+    одну запись. При записи сравниваются сериализованные значения ключей с
+    последними записанными - в store уходят только изменившиеся ключи.
+    После записи обновляется компактный JSON-снимок (временный файл +
+    os.replace), читатели никогда не видят наполовину записанный файл.
+    """
+
+    def __init__(self, store, window=STATE_SAVE_COALESCE, snapshot_path=LEGACY_STATE_FILE):
+        self.store = store
+        self.window = window
+        self.snapshot_path = snapshot_path
+        self._saved = {}      # key -> JSON последнего записанного значения
+        self._pending = None  # state, ожидающий записи
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.stats = {"requested": 0, "flushed": 0}
+
+    def save(self, state, immediate=False):
+        """Запросить запись state (immediate=True - записать сразу)"""
+        with self._lock:
+            self._pending = state
+            self.stats["requested"] += 1
+            if not immediate and self.window > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def mark_clean(self, state):
+        """state только что прочитан из store - его значения уже записаны"""
+        with self._lock:
+            self._saved = {key: _dumps(value) for key, value in state.items()}
+
+    def flush(self):
+        """Записать изменившиеся ключи отложенного state одной транзакцией"""
+        with self._flush_lock:
+            with self._lock:
+                state, self._pending = self._pending, None
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if state is None:
+                return False
+            snapshot = dict(state)
+            serialized = {key: _dumps(value) for key, value in snapshot.items()}
+            dirty = [key for key, value in serialized.items() if value != self._saved.get(key)]
+            if not dirty:
+                return False
+            if any(key in POSITION_KEYS for key in dirty):
+                dirty = list(set(dirty) | {key for key in POSITION_KEYS if key in snapshot})
+            self.store.save_state({key: snapshot[key] for key in dirty})
+            with self._lock:
+                self._saved.update((key, serialized[key]) for key in dirty)
+                self.stats["flushed"] += 1
+            self._write_snapshot(snapshot)
+            return True
+
+    def _write_snapshot(self, state):
+        """Компактный JSON-снимок состояния для внешних читателей и бэкапов"""
+        if not self.snapshot_path:
+            return
+        try:
+            payload = dict(state)
+            payload['strategy_config'] = self.store.cached_strategy_config()
+            tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(payload, f, default=str, separators=(',', ':'))
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            logging.debug(f"Could not write state snapshot: {e}")
+
+
+state_store = StateStore()
+state_writer = StateWriter(state_store)
+atexit.register(state_writer.flush)
@@ -0,0 +1,171 @@
+import os
+import time
+import select
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+from state_store import state_store
+
+STATE_WATCH_POLL = float(os.getenv('STATE_WATCH_POLL', '0.5'))  # Секунд между проверками mtime без inotify
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def _inotify_libc():
+    """libc с inotify или None (не Linux)"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class StateWatcher:
+    """
+    Версионированный снимок состояния из state_store в памяти процесса.
+
+    Фоновый поток ждет изменений файлов базы (inotify на Linux, иначе
+    os.stat mtime/size раз в STATE_WATCH_POLL секунд) и только тогда
+    сверяет счетчик version и перечитывает состояние. state() и
+    strategy_config() ничего не читают с диска, пока база не менялась;
+    после записи из этого же процесса снимок обновляется сразу.
+    """
+
+    def __init__(self, store, poll=STATE_WATCH_POLL):
+        self.store = store
+        self.poll = poll
+        self.version = None
+        self._state = None
+        self._local_writes = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self.mode = None
+        self.stats = {"reloads": 0, "events": 0}
+
+    def _paths(self):
+        return [self.store.path, f"{self.store.path}-wal"]
+
+    def refresh(self, force=False):
+        """Перечитать состояние, если version изменился"""
+        local_writes = self.store.local_writes
+        version = self.store.version()
+        with self._lock:
+            if not force and self._state is not None and version == self.version:
+                self._local_writes = local_writes
+                return False
+        state = self.store.load_state()
+        with self._lock:
+            self._state = state
+            self.version = version
+            self._local_writes = local_writes
+            self.stats["reloads"] += 1
+        return True
+
+    def _stale(self):
+        # Без живого потока наблюдения (не запущен, после fork) - сверка version на каждом чтении
+        return (self._state is None or self._local_writes != self.store.local_writes
+                or self._thread is None or not self._thread.is_alive())
+
+    def state(self):
+        """Копия последнего снимка состояния (без чтения базы, если она не менялась)"""
+        if self._stale():
+            self.refresh()
+        with self._lock:
+            return self.store.copy_state(self._state)
+
+    def strategy_config(self):
+        if self._stale():
+            self.refresh()
+        with self._lock:
+            return dict(self._state['strategy_config'])
+
+    # ----- Фоновое наблюдение -----
+
+    def _watch_inotify(self, libc):
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        directory = os.path.dirname(os.path.abspath(self.store.path))
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+        prefix = os.path.basename(self.store.path).encode()
+        self.mode = "inotify"
+        try:
+            while True:
+                readable, _, _ = select.select([fd], [], [], 30)
+                if not readable:
+                    self.refresh()  # Страховка от потерянных событий
+                    continue
+                data = os.read(fd, 65536)
+                # struct inotify_event { int wd; uint32 mask, cookie, len; char name[]; }
+                offset, changed = 0, False
+                while offset + 16 <= len(data):
+                    name_len = int.from_bytes(data[offset + 12:offset + 16], 'little')
+                    name = data[offset + 16:offset + 16 + name_len].rstrip(b'\0')
+                    if name.startswith(prefix):
+                        changed = True
+                    offset += 16 + name_len
+                if changed:
+                    self.stats["events"] += 1
+                    self.refresh()
+        finally:
+            os.close(fd)
+
+    def _signature(self):
+        signature = []
+        for path in self._paths():
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _watch_stat(self):
+        self.mode = "stat"
+        last = self._signature()
+        while True:
+            time.sleep(self.poll)
+            current = self._signature()
+            if current != last:
+                last = current
+                self.stats["events"] += 1
+                self.refresh()
+
+    def _run(self):
+        libc = _inotify_libc()
+        if libc is not None:
+            try:
+                self._watch_inotify(libc)
+            except Exception as e:
+                logging.warning(f"inotify unavailable ({e}) - falling back to mtime polling")
+        while True:
+            try:
+                self._watch_stat()
+            except Exception as e:
+                logging.error(f"State watcher error: {e}")
+                time.sleep(self.poll)
+
+    def start(self):
+        """Запустить наблюдение (один поток на процесс)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="state-watcher", daemon=True)
+            self._thread.start()
+        self.refresh()
+
+
+state_watcher = StateWatcher(state_store)
@@ -18,6 +18,11 @@ class TradingDashboard {
         this.apiConnected = false;
         this.lastPosition = null;
         this.rebalanceActive = false;
+        this.stream = null;
+        this.streamConnected = false;
+        this.pollIntervals = [];
+        this.gainers = [];
+        this.gainersVersion = null;
         
         this.initChart();
         this.loadStrategyConfig();
@@ -189,6 +194,7 @@ class TradingDashboard {
                 this.chartManuallyAdjusted = false;
                 this.savedTimeRange = null;
                 this.updateChart();
+                if (this.stream) this.connectStream();  // Stream chart follows the selected timeframe
             });
         });
     }
@@ -266,8 +272,14 @@ class TradingDashboard {
             const response = await fetch(`/api/chart_data?timeframe=${this.currentTimeframe}`);
             if (!response.ok) return;
             
-            const data = await response.json();
-            
+            this.renderChart(await response.json());
+        } catch (error) {
+            console.error('Chart update error:', error);
+        }
+    }
+
+    renderChart(data) {
+        try {
             if (!this.candlestickSeries || !data.candles || data.candles.length === 0) return;
             
             // Convert time strings to timestamps
@@ -309,7 +321,7 @@ class TradingDashboard {
                 this.chart.timeScale().fitContent();
             }
         } catch (error) {
-            console.error('Chart update error:', error);
+            console.error('Chart render error:', error);
         }
     }
 
@@ -473,6 +485,28 @@ class TradingDashboard {
         }
     }
 
+    renderTopPair(gainers) {
+        if (!gainers || gainers.length === 0) return;
+        const topPair = gainers[0];
+        this.topPairPrice = parseFloat(topPair.price || 0);  // Store top 1 price
+        this.topPairSymbol = (topPair.symbol) ? topPair.symbol.split('_')[0] : 'TOP1';  // Store top 1 symbol
+        const priceElement = document.getElementById('current-price');
+        const symbolDisplay = document.getElementById('symbol-display');
+        if (priceElement) {
+            const decimals = this.topPairPrice < 0.01 ? 6 : (this.topPairPrice < 1 ? 4 : 2);
+            priceElement.textContent = `$${this.topPairPrice.toFixed(decimals)}`;
+        }
+        // Only update symbol if NOT locked by position
+        if (symbolDisplay && !this.positionSymbolLocked) {
+            symbolDisplay.textContent = this.topPairSymbol;
+        }
+        // Also update chart symbol
+        const chartSymbol = document.getElementById('chart-symbol');
+        if (chartSymbol && !this.positionSymbolLocked) {
+            chartSymbol.textContent = this.topPairSymbol;
+        }
+    }
+
     async updateDashboard() {
         if (this.isUpdating) return;
         this.isUpdating = true;
@@ -483,26 +517,7 @@ class TradingDashboard {
                 const gainersRes = await fetch('/api/top_gainers');
                 if (gainersRes.ok) {
                     const gainersData = await gainersRes.json();
-                    if (gainersData.gainers && gainersData.gainers.length > 0) {
-                        const topPair = gainersData.gainers[0];
-                        this.topPairPrice = parseFloat(topPair.price || 0);  // Store top 1 price
-                        this.topPairSymbol = (topPair.symbol) ? topPair.symbol.split('_')[0] : 'TOP1';  // Store top 1 symbol
-                        const priceElement = document.getElementById('current-price');
-                        const symbolDisplay = document.getElementById('symbol-display');
-                        if (priceElement) {
-                            const decimals = this.topPairPrice < 0.01 ? 6 : (this.topPairPrice < 1 ? 4 : 2);
-                            priceElement.textContent = `$${this.topPairPrice.toFixed(decimals)}`;
-                        }
-                        // Only update symbol if NOT locked by position
-                        if (symbolDisplay && !this.positionSymbolLocked) {
-                            symbolDisplay.textContent = this.topPairSymbol;
-                        }
-                        // Also update chart symbol
-                        const chartSymbol = document.getElementById('chart-symbol');
-                        if (chartSymbol && !this.positionSymbolLocked) {
-                            chartSymbol.textContent = this.topPairSymbol;
-                        }
-                    }
+                    this.renderTopPair(gainersData.gainers);
                 }
             } catch (err) {
                 console.log('Top pair price error:', err);
@@ -514,8 +529,16 @@ class TradingDashboard {
                 return;
             }
 
-            const data = await response.json();
+            this.renderStatus(await response.json());
+        } catch (error) {
+            console.error('Dashboard update error:', error);
+        } finally {
+            this.isUpdating = false;
+        }
+    }
 
+    renderStatus(data) {
+        try {
             // SYNC API connection status from backend
             if (data.api_connected !== undefined) {
                 this.apiConnected = data.api_connected;
@@ -591,9 +614,7 @@ class TradingDashboard {
 
             this.lastUpdateTime = new Date();
         } catch (error) {
-            console.error('Dashboard update error:', error);
-        } finally {
-            this.isUpdating = false;
+            console.error('Status render error:', error);
         }
     }
 
@@ -899,58 +920,14 @@ class TradingDashboard {
 
     updateTopGainers() {
         const container = document.getElementById('top-gainers-list');
-        const header = document.querySelector('[data-gainers-header]');
         
-        fetch('/api/top_gainers')
+        // Only changes since the last ranking version we have; the server falls back to the full list
+        const url = this.gainersVersion ? `/api/top_gainers?since=${this.gainersVersion}` : '/api/top_gainers';
+        fetch(url)
             .then(res => res.json())
             .then(data => {
-                // Обновляем заголовок
-                if (header) {
-                    const total = data.total_pairs || 0;
-                    const status = data.cached ? '✅' : '⏳';
-                    header.textContent = `${status} GATE - ${total} futures pairs`;
-                }
-                
-                if (!data.gainers || data.gainers.length === 0) {
-                    container.innerHTML = '<div class="text-center text-muted p-3">⏳ Loading futures data...</div>';
-                    return;
-                }
-                
-                // Get locked symbol from position if exists
-                let lockedSymbol = null;
-                if (this.lastPosition && this.lastPosition.symbol) {
-                    lockedSymbol = this.lastPosition.symbol;
-                }
-                
-                const html = data.gainers.map((coin, idx) => {
-                    const changeClass = coin.change >= 0 ? 'text-success' : 'text-danger';
-                    const changeSign = coin.change >= 0 ? '+' : '';
-                    const geckoRank = coin.gecko_rank !== 'N/A' ? `#${coin.gecko_rank}` : 'N/A';
-                    const geckoDisplay = coin.gecko_rank !== 'N/A' ? `<span class="badge bg-warning text-dark ms-2" style="font-size: 0.7rem;">CG: ${geckoRank}</span>` : '';
-                    
-                    // Check if this pair is locked
-                    const isLocked = lockedSymbol && coin.symbol === lockedSymbol;
-                    const lockedClass = isLocked ? 'pair-locked' : '';
-                    const lockIcon = isLocked ? '<i class="fas fa-lock lock-icon me-2"></i>' : '';
-                    const lockedText = isLocked ? '<small class="text-muted d-block">locked during trade</small>' : '';
-                    
-                    return `
-                        <div class="d-flex justify-content-between align-items-center p-2 border-bottom ${lockedClass}" style="font-size: 0.9rem;">
-                            <div>
-                                <span class="badge bg-primary me-2" style="font-size: 0.75rem;">${idx + 1}</span>
-                                ${lockIcon}
-                                <strong class="${changeClass}">${coin.symbol}</strong>
-                                ${geckoDisplay}
-                                ${lockedText}
-                            </div>
-                            <div class="text-end">
-                                <div class="${changeClass}" style="font-size: 0.85rem;">$${coin.price ? coin.price.toFixed(6) : 'N/A'}</div>
-                                <div class="${changeClass}"><strong style="font-size: 0.85rem;">${changeSign}${coin.change.toFixed(2)}%</strong></div>
-                            </div>
-                        </div>
-                    `;
-                }).join('');
-                container.innerHTML = html;
+                if (data.full === undefined) data.full = true;
+                if (!data.unchanged) this.applyGainers(data);
             })
             .catch(err => {
                 console.log('Top gainers error:', err);
@@ -958,6 +935,84 @@ class TradingDashboard {
             });
     }
 
+    applyGainers(data) {
+        // Stream: first frame is the full list, next ones carry only changed pairs and moved pairs
+        if (data.version !== undefined) this.gainersVersion = data.version;
+        if (data.full) {
+            this.gainers = data.gainers || [];
+        } else {
+            const bySymbol = new Map(this.gainers.map(coin => [coin.symbol, coin]));
+            (data.removed || []).forEach(symbol => bySymbol.delete(symbol));
+            (data.changed || []).forEach(coin => bySymbol.set(coin.symbol, coin));
+            // Pairs that did not move keep their relative order; moved ones are inserted at their new index
+            const moves = data.moves || [];
+            const moved = new Set(moves.map(([symbol]) => symbol));
+            const order = this.gainers.map(coin => coin.symbol).filter(symbol => bySymbol.has(symbol) && !moved.has(symbol));
+            moves.forEach(([symbol, index]) => order.splice(index, 0, symbol));
+            this.gainers = order.filter(symbol => bySymbol.has(symbol)).map(symbol => bySymbol.get(symbol));
+        }
+        this.renderTopPair(this.gainers);
+        this.renderTopGainers({
+            gainers: this.gainers,
+            total_pairs: data.total_pairs !== undefined ? data.total_pairs : this.gainers.length,
+            cached: data.cached
+        });
+    }
+
+    renderTopGainers(data) {
+        const container = document.getElementById('top-gainers-list');
+        const header = document.querySelector('[data-gainers-header]');
+        if (!container) return;
+        
+        // Обновляем заголовок
+        if (header) {
+            const total = data.total_pairs || 0;
+            const status = data.cached ? '✅' : '⏳';
+            header.textContent = `${status} GATE - ${total} futures pairs`;
+        }
+        
+        if (!data.gainers || data.gainers.length === 0) {
+            container.innerHTML = '<div class="text-center text-muted p-3">⏳ Loading futures data...</div>';
+            return;
+        }
+        
+        // Get locked symbol from position if exists
+        let lockedSymbol = null;
+        if (this.lastPosition && this.lastPosition.symbol) {
+            lockedSymbol = this.lastPosition.symbol;
+        }
+        
+        const html = data.gainers.map((coin, idx) => {
+            const changeClass = coin.change >= 0 ? 'text-success' : 'text-danger';
+            const changeSign = coin.change >= 0 ? '+' : '';
+            const geckoRank = coin.gecko_rank !== 'N/A' ? `#${coin.gecko_rank}` : 'N/A';
+            const geckoDisplay = coin.gecko_rank !== 'N/A' ? `<span class="badge bg-warning text-dark ms-2" style="font-size: 0.7rem;">CG: ${geckoRank}</span>` : '';
+            
+            // Check if this pair is locked
+            const isLocked = lockedSymbol && coin.symbol === lockedSymbol;
+            const lockedClass = isLocked ? 'pair-locked' : '';
+            const lockIcon = isLocked ? '<i class="fas fa-lock lock-icon me-2"></i>' : '';
+            const lockedText = isLocked ? '<small class="text-muted d-block">locked during trade</small>' : '';
+            
+            return `
+                <div class="d-flex justify-content-between align-items-center p-2 border-bottom ${lockedClass}" style="font-size: 0.9rem;">
+                    <div>
+                        <span class="badge bg-primary me-2" style="font-size: 0.75rem;">${idx + 1}</span>
+                        ${lockIcon}
+                        <strong class="${changeClass}">${coin.symbol}</strong>
+                        ${geckoDisplay}
+                        ${lockedText}
+                    </div>
+                    <div class="text-end">
+                        <div class="${changeClass}" style="font-size: 0.85rem;">$${coin.price ? coin.price.toFixed(6) : 'N/A'}</div>
+                        <div class="${changeClass}"><strong style="font-size: 0.85rem;">${changeSign}${coin.change.toFixed(2)}%</strong></div>
+                    </div>
+                </div>
+            `;
+        }).join('');
+        container.innerHTML = html;
+    }
+
     async loadLeverage() {
         try {
             const response = await fetch('/api/get_leverage');
@@ -1156,8 +1211,8 @@ class TradingDashboard {
     }
     
     startAutoUpdate() {
-        // ✅ Start auto-update with 2s interval
-        if (!this.dataUpdateInterval) {
+        // ✅ Start auto-update with 2s interval (not needed while the push stream is live)
+        if (!this.dataUpdateInterval && !this.streamConnected) {
             this.dataUpdateInterval = setInterval(() => {
                 this.updateDashboard();
             }, 2000);
@@ -1404,17 +1459,61 @@ class TradingDashboard {
     }
 
     startDataUpdates() {
-        setInterval(() => this.updateDashboard(), 5000);
-        setInterval(() => this.updateChart(), 5000);
-        setInterval(() => this.updateTopGainers(), 15000);
         setInterval(() => this.updateOnlineUsers(), 5000);
         setInterval(() => this.sendHeartbeat(), 30000);  // Keep session alive
         this.updateTopGainers();
+        if (window.EventSource) {
+            this.connectStream();
+        } else {
+            this.startPolling();
+        }
+    }
+
+    // Fallback when /api/stream is unavailable: the old polling loops
+    startPolling() {
+        if (this.pollIntervals.length > 0) return;
+        this.pollIntervals = [
+            setInterval(() => this.updateDashboard(), 5000),
+            setInterval(() => this.updateChart(), 5000),
+            setInterval(() => this.updateTopGainers(), 15000)
+        ];
+    }
+
+    stopPolling() {
+        this.pollIntervals.forEach(id => clearInterval(id));
+        this.pollIntervals = [];
+    }
+
+    // ✅ One push connection: status, position P&L, SAR, candles and top gainers arrive as they change
+    connectStream() {
+        if (this.stream) this.stream.close();
+        const stream = new EventSource(`/api/stream?timeframe=${this.currentTimeframe}`);
+        this.stream = stream;
+        const parse = (handler) => (event) => {
+            try {
+                handler(JSON.parse(event.data));
+            } catch (error) {
+                console.error('Stream event error:', error);
+            }
+        };
+        stream.addEventListener('open', () => {
+            this.streamConnected = true;
+            this.stopPolling();
+        });
+        stream.addEventListener('status', parse(data => this.renderStatus(data)));
+        stream.addEventListener('gainers', parse(data => this.applyGainers(data)));
+        stream.addEventListener('chart', parse(data => this.renderChart(data)));
+        stream.addEventListener('symbol', parse(data => renderCurrentSymbol(data.symbol)));
+        stream.addEventListener('error', () => {
+            // EventSource reconnects by itself (server closes the stream periodically); poll meanwhile
+            this.streamConnected = false;
+            this.startPolling();
+        });
     }
 }
 
 document.addEventListener('DOMContentLoaded', () => {
-    new TradingDashboard();
+    window.tradingDashboard = new TradingDashboard();
 });
 
 // Update current trading symbol display
@@ -1423,18 +1522,23 @@ async function updateCurrentSymbol() {
         const res = await fetch('/api/current_trading_symbol');
         if (!res.ok) return;
         const data = await res.json();
-        const symbol = data.symbol || 'TOP1/USDT';
-        
-        // Update all symbol displays (check if element exists first)
-        const headerSymbol = document.getElementById('header-symbol');
-        const chartSymbol = document.getElementById('chart-symbol');
-        if (headerSymbol) headerSymbol.textContent = symbol;
-        if (chartSymbol) chartSymbol.textContent = symbol;
+        renderCurrentSymbol(data.symbol);
     } catch (err) {
         console.log('Symbol update error:', err);
     }
 }
 
-// Call on init and every 15 seconds
+function renderCurrentSymbol(symbol) {
+    symbol = symbol || 'TOP1/USDT';
+    // Update all symbol displays (check if element exists first)
+    const headerSymbol = document.getElementById('header-symbol');
+    const chartSymbol = document.getElementById('chart-symbol');
+    if (headerSymbol) headerSymbol.textContent = symbol;
+    if (chartSymbol) chartSymbol.textContent = symbol;
+}
+
+// Call on init and every 15 seconds (the push stream delivers symbol changes while it is connected)
 document.addEventListener('DOMContentLoaded', updateCurrentSymbol);
-setInterval(updateCurrentSymbol, 15000);
+setInterval(() => {
+    if (!(window.tradingDashboard && window.tradingDashboard.streamConnected)) updateCurrentSymbol();
+}, 15000);
@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+STATUS_SNAPSHOT_FILE = os.getenv('STATUS_SNAPSHOT_FILE', 'goldantelopegate_status.json')
+STATUS_TICK = float(os.getenv('STATUS_TICK', '1'))  # Секунд между пересборками /api/status
+
+
+class StatusSnapshot:
+    """
+    Готовый ответ /api/status: payload собирается один раз за тик
+    (воркер движка), сериализуется один раз и хранится как bytes + ETag.
+    Остальные воркеры читают тот же файл только при смене mtime, так что
+    запрос обслуживается без сборки и сериализации, а неизмененный
+    ответ - через 304 Not Modified.
+    """
+
+    def __init__(self, path=STATUS_SNAPSHOT_FILE):
+        self.path = path
+        self.body = None
+        self.etag = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _etag(body):
+        return hashlib.sha1(body).hexdigest()[:20]
+
+    def publish(self, payload):
+        """Сериализовать payload; файл и ETag меняются, только если изменилось содержимое"""
+        body = json.dumps(payload, default=str, separators=(',', ':')).encode()
+        with self._lock:
+            if body == self.body:
+                return False
+            self.body = body
+            self.etag = self._etag(body)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, self.path)
+            with self._lock:
+                self._mtime = os.stat(self.path).st_mtime_ns
+        except Exception as e:
+            logging.debug(f"Could not write status snapshot: {e}")
+        return True
+
+    def current(self):
+        """(body, etag) последнего снимка, (None, None) - снимка еще нет"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime is not None and mtime != self._mtime:
+                try:
+                    with open(self.path, 'rb') as f:
+                        body = f.read()
+                    self._mtime = mtime
+                    if body != self.body:
+                        self.body = body
+                        self.etag = self._etag(body)
+                except Exception as e:
+                    logging.debug(f"Could not read status snapshot: {e}")
+            return self.body, self.etag
+
+
+status_snapshot = StatusSnapshot()
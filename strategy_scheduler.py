@@ -0,0 +1,130 @@
+import time
+import threading
+
+from candle_cache import timeframe_seconds, next_candle_boundary
+
+
+class LevelScheduler:
+    """
+    Планировщик проверок SAR по уровням стратегии.
+
+    Уровень проверяется сразу после закрытия своей свечи (граница + close_grace)
+    и, пока свеча не закрыта, не чаще одного раза в live_interval(tf) секунд.
+    trigger() будит цикл немедленно (ценовой тик, смена стратегии, force_close).
+    """
+
+    def __init__(self, levels=None, close_grace=1.0, min_live_interval=5.0, max_live_interval=60.0):
+        self.close_grace = close_grace
+        self.min_live_interval = min_live_interval
+        self.max_live_interval = max_live_interval
+        self._next_due = {}
+        self._last_check = {}
+        self._wake = threading.Event()
+        self._triggered = False
+        self._triggers = 0          # Счетчик trigger()
+        self._consumed = 0          # Значение счетчика, которое забрал текущий цикл (due_levels)
+        self._lock = threading.Lock()
+        self.last_cycle = None
+        self.set_levels(levels or [])
+
+    def live_interval(self, tf):
+        """Интервал проверки незакрытой свечи: ~1/12 свечи, в пределах [min, max]"""
+        return max(self.min_live_interval, min(self.max_live_interval, timeframe_seconds(tf) / 12))
+
+    def set_levels(self, levels):
+        """Обновить набор уровней (open_levels + close_levels); новые уровни проверяются сразу"""
+        with self._lock:
+            levels = set(levels)
+            for tf in list(self._next_due):
+                if tf not in levels:
+                    del self._next_due[tf]
+                    self._last_check.pop(tf, None)
+            for tf in levels:
+                self._next_due.setdefault(tf, 0.0)
+
+    @property
+    def levels(self):
+        with self._lock:
+            return list(self._next_due)
+
+    def trigger(self):
+        """Запросить немедленную проверку всех уровней"""
+        with self._lock:
+            self._triggered = True
+            self._triggers += 1
+        self._wake.set()
+
+    def due_levels(self, now=None):
+        """Уровни, которые пора проверить"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._consumed = self._triggers
+            if self._triggered:
+                return list(self._next_due)
+            return [tf for tf, due in self._next_due.items() if due <= now]
+
+    def mark_checked(self, levels, now=None):
+        """
+        Запланировать следующую проверку для проверенных уровней. trigger(), пришедший
+        во время цикла (после due_levels), не сбрасывается - следующий цикл начнется сразу.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._triggers == self._consumed:
+                self._triggered = False
+                self._wake.clear()
+            for tf in levels:
+                if tf not in self._next_due:
+                    continue
+                boundary = next_candle_boundary(tf, now) + self.close_grace
+                self._last_check[tf] = now
+                self._next_due[tf] = min(boundary, now + self.live_interval(tf))
+
+    def defer(self, levels, now=None):
+        """Повторить проверку уровней, не получивших данных, через min_live_interval"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for tf in levels:
+                if tf in self._next_due:
+                    self._next_due[tf] = now + self.min_live_interval
+
+    def record_cycle(self, duration, checked, missing):
+        """Запомнить длительность последней проверки (время самого медленного запроса)"""
+        with self._lock:
+            self.last_cycle = {
+                "duration_ms": round(duration * 1000, 1),
+                "checked": sorted(checked),
+                "missing": sorted(missing),
+            }
+
+    def delay(self, now=None):
+        """Сколько секунд до следующей проверки (0 - проверка уже нужна)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._triggered or not self._next_due:
+                return 0.0
+            return max(0.0, min(self._next_due.values()) - now)
+
+    def wait(self, should_continue=None, poll=1.0):
+        """
+        Спать до следующей проверки или trigger(). Каждые poll секунд
+        проверяется should_continue, чтобы остановка бота не ждала свечу.
+        Возвращает False, если цикл нужно остановить.
+        """
+        while True:
+            if should_continue and not should_continue():
+                return False
+            remaining = self.delay()
+            if remaining <= 0:
+                return True
+            self._wake.wait(timeout=min(remaining, poll))
+
+    def status(self):
+        """Расписание для /api/status: unix-время следующих проверок (не меняется между тиками снимка)"""
+        with self._lock:
+            return {
+                "next_evaluation_at": None if not self._next_due else round(min(self._next_due.values()), 1),
+                "triggered": self._triggered,
+                "levels": {tf: round(due, 1) for tf, due in self._next_due.items()},
+                "last_cycle": self.last_cycle,
+            }
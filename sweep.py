@@ -0,0 +1,135 @@
+import time
+import logging
+import argparse
+from itertools import combinations, product
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import backtest as engine
+
+SWEEP_LEVERAGES = (3, 5, 10)             # Допустимые значения /api/set_leverage
+SWEEP_STEPS = (0.02, 0.05, 0.1)
+SWEEP_MAX_STEPS = (0.2, 0.5)
+SWEEP_CHUNK = 8                          # Наборов open_levels в одной задаче воркера
+
+# Состояние воркера: свечи из общей памяти и кэш сигналов по (step, max_step)
+_candles = None
+_shm = None
+_directions = {}
+
+
+def level_sets(levels=engine.LEVELS):
+    """Все непустые подмножества уровней (как в меню открытия/закрытия)"""
+    return [list(combo) for size in range(1, len(levels) + 1) for combo in combinations(levels, size)]
+
+
+def _attach(name, shape):
+    """Инициализатор воркера: свечи читаются из общей памяти без копии"""
+    global _candles, _shm
+    _shm = shared_memory.SharedMemory(name=name)
+    _candles = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf)
+
+
+def _signals(step, max_step):
+    key = (step, max_step)
+    if key not in _directions:
+        directions = {tf: engine.level_directions(_candles, tf, step, max_step) for tf in engine.LEVELS}
+        _directions[key] = directions, engine.change_points(directions)
+    return _directions[key]
+
+
+def run_chunk(step, max_step, open_sets, close_sets, leverages, fee_rate=0.0):
+    """Одна задача: все close_levels и плечи для части наборов open_levels при одном (step, max_step)"""
+    directions, changes = _signals(step, max_step)
+    ts, price = _candles[:, 0], _candles[:, 4]
+    rows = []
+    for open_levels, close_levels in product(open_sets, close_sets):
+        trades = engine.find_trades(ts, directions, open_levels, close_levels, changes=changes)
+        for leverage in leverages:
+            # Сделки от плеча не зависят - пересчитывается только P&L
+            result = engine.score(ts, price, trades, leverage, fee_rate=fee_rate)
+            result.pop("pnl_list")
+            rows.append(dict(result, open_levels=",".join(open_levels), close_levels=",".join(close_levels),
+                             step=step, max_step=max_step, leverage=leverage))
+    return rows
+
+
+def sweep(candles, steps=SWEEP_STEPS, max_steps=SWEEP_MAX_STEPS, leverages=SWEEP_LEVERAGES,
+          open_sets=None, close_sets=None, workers=None, fee_rate=0.0, chunk=SWEEP_CHUNK):
+    """
+    Перебор open_levels x close_levels x (step, max_step) x leverage по одному набору свечей.
+
+    Свечи кладутся в общую память один раз, воркеры ProcessPoolExecutor
+    подключаются к ней без копирования. Сигналы уровней считаются в воркере
+    один раз на (step, max_step), дальше каждая комбинация - find_trades +
+    score. Возвращает DataFrame, отсортированный по доходности.
+    """
+    candles = np.ascontiguousarray(candles, dtype=np.float64)
+    open_sets = open_sets or level_sets()
+    close_sets = close_sets or level_sets()
+    tasks = [(step, max_step, open_sets[i:i + chunk])
+             for step, max_step in product(steps, max_steps) for i in range(0, len(open_sets), chunk)]
+    shm = shared_memory.SharedMemory(create=True, size=candles.nbytes)
+    try:
+        np.ndarray(candles.shape, dtype=np.float64, buffer=shm.buf)[:] = candles
+        rows = []
+        started = time.time()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(shm.name, candles.shape)) as pool:
+            futures = [pool.submit(run_chunk, step, max_step, part, close_sets, list(leverages), fee_rate)
+                       for step, max_step, part in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                rows.extend(future.result())
+                if done % max(1, len(futures) // 10) == 0:
+                    logging.info(f"Sweep: {done}/{len(futures)} tasks, {len(rows)} results, {time.time() - started:.1f}s")
+    finally:
+        shm.close()
+        shm.unlink()
+    table = pd.DataFrame(rows)
+    if table.empty:
+        return table
+    params = ["open_levels", "close_levels", "step", "max_step", "leverage"]
+    table = table[params + [column for column in table.columns if column not in params]]
+    return table.sort_values(["return_pct", "max_drawdown_pct"], ascending=[False, True]).reset_index(drop=True)
+
+
+def _floats(text):
+    return [float(v) for v in text.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep strategy levels, PSAR step/max_step and leverage over 1m candles")
+    parser.add_argument("symbol", help="Gate.io pair, e.g. XNY_USDT")
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--steps", default=",".join(map(str, SWEEP_STEPS)))
+    parser.add_argument("--max-steps", default=",".join(map(str, SWEEP_MAX_STEPS)))
+    parser.add_argument("--leverages", default=",".join(map(str, SWEEP_LEVERAGES)))
+    parser.add_argument("--fee", type=float, default=0.0, help="Taker fee rate per side, e.g. 0.0005")
+    parser.add_argument("--workers", type=int, default=None, help="Processes (default: CPU count)")
+    parser.add_argument("--out", default="sweep_results.csv")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    from exchange_gateway import get_exchange
+    from contract_index import normalize_symbol
+
+    base, quote = normalize_symbol(args.symbol).split("_")
+    since = int((time.time() - args.days * 86400) * 1000)
+    candles = engine.fetch_history(get_exchange(), f"{base}/{quote}:{quote}", since)
+    logging.info(f"Loaded {len(candles)} 1m candles for {args.symbol}")
+
+    started = time.time()
+    table = sweep(candles, _floats(args.steps), _floats(args.max_steps),
+                  [int(v) for v in _floats(args.leverages)], workers=args.workers, fee_rate=args.fee)
+    logging.info(f"Sweep finished: {len(table)} combinations in {time.time() - started:.1f}s -> {args.out}")
+    table.to_csv(args.out, index=False)
+    columns = ["open_levels", "close_levels", "step", "max_step", "leverage",
+               "trades", "return_pct", "max_drawdown_pct", "hit_rate"]
+    print(table[columns].head(args.top).to_string(index=False) if not table.empty else "No results")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    main()
@@ -1,17 +1,27 @@
 import os
 import time
-import json
 import threading
 import random
 import uuid
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
-import ccxt
 import pandas as pd
 from ta.trend import PSARIndicator
 import logging
-from market_simulator import MarketSimulator
+from simulated_exchange import get_simulated_exchange
 from signal_sender import SignalSender
+from psar_engine import PSARBook, PSAR_STEP, PSAR_MAX_STEP
+from candle_cache import CandleCache
+from candle_store import candle_store
+from candle_resampler import CandleResampler
+from psar_scanner import PSARScanner
+from strategy_scheduler import LevelScheduler
+from exchange_gateway import get_exchange
+from contract_index import contract_index, normalize_symbol
+from price_book import price_book
+from state_store import state_store, state_writer
+from state_watcher import state_watcher
 
 # ✅ IMPORTANT: Will import state from app.py after app is initialized
 # For now, use local state as fallback
@@ -43,6 +53,22 @@ MAX_RANDOM_TRADE_SECONDS = 780
 PAUSE_BETWEEN_TRADES = 0
 START_BANK = 100.0
 DASHBOARD_MAX = 20
+RECONCILE_INTERVAL = 30  # Секунд между сверками позиции с биржей в strategy_loop
+FETCH_TIMEOUT = 10  # Секунд на один запрос свечей / на весь цикл проверки уровней
+
+# ✅ Streaming PSAR per (symbol, timeframe) - shared by all TradingBot instances in the process
+psar_book = PSARBook(step=PSAR_STEP, max_step=PSAR_MAX_STEP)
+# ✅ Separate engines for the chart: its longer window must not reseed the strategy's engines
+chart_psar_book = PSARBook(step=PSAR_STEP, max_step=PSAR_MAX_STEP)
+# ✅ Shared OHLCV cache per (symbol, timeframe) - incremental since= fetches only,
+# closed candles persisted to the local candle store (warm restarts, backtests)
+candle_cache = CandleCache(maxlen=500, live_ttl=5.0, store=candle_store)
+# ✅ One 1m stream per symbol, 5m/15m/30m/1h bars are built locally from it
+candle_resampler = CandleResampler(candle_cache, base_tf="1m", base_limit=180)
+# ✅ Bounded pool for fetching strategy levels concurrently (one worker per timeframe)
+fetch_pool = ThreadPoolExecutor(max_workers=len(TIMEFRAMES), thread_name_prefix="ohlcv")
+# ✅ SAR directions for the whole top-gainers list, batched NumPy PSAR per timeframe
+psar_scanner = PSARScanner(TIMEFRAMES.keys())
 
 # ✅ Local fallback state (will be overridden by app.py state)
 state = {
@@ -62,15 +88,12 @@ state = {
     "api_connected": False
 }
 
-# ✅ Load trades from file immediately on module import
+# ✅ Load trades from the state store immediately on module import
 try:
-    with open("goldantelopegate_v1.0_state.json", "r") as f:
-        _saved_state = json.load(f)
-        if "trades" in _saved_state:
-            state["trades"] = _saved_state["trades"]
-            logging.info(f"✅ Loaded {len(state['trades'])} trades from state file")
-except:
-    pass
+    state["trades"] = state_store.get_trades()
+    logging.info(f"✅ Loaded {len(state['trades'])} trades from state store")
+except Exception as e:
+    logging.warning(f"Could not load trades from state store: {e}")
 
 class TradingBot:
     def __init__(self, telegram_notifier=None, trading_symbol=None, app_context=None):
@@ -78,6 +101,7 @@ class TradingBot:
         self.notifier = telegram_notifier
         self.signal_sender = SignalSender()
         self.app_context = app_context
+        self.scheduler = LevelScheduler()
         
         # Устанавливаем символ для торговли
         if trading_symbol:
@@ -87,21 +111,15 @@ class TradingBot:
             trading_symbol = SYMBOL
         
         if USE_SIMULATOR:
-            logging.info("Initializing market simulator")
-            self.simulator = MarketSimulator(initial_price=3000, volatility=0.02)
-            self.exchange = None
+            # ✅ Simulated exchange: positions, orders, balance and candles for any pair, no network
+            logging.info("Initializing simulated exchange")
+            self.exchange = get_simulated_exchange(price_book=price_book, contract_index=contract_index)
+            self.exchange.set_margin_mode('isolated', SYMBOL)
+            self.exchange.set_leverage(LEVERAGE, SYMBOL)
         else:
             logging.info("Initializing GATE.IO exchange connection")
-            self.simulator = None
-            self.exchange = ccxt.gateio({
-                "apiKey": API_KEY,
-                "secret": API_SECRET,
-                "sandbox": False,
-                "enableRateLimit": True,
-                "options": {
-                    "defaultType": "swap",
-                }
-            })
+            # ✅ Shared pooled async client (one per process and API key pair)
+            self.exchange = get_exchange(API_KEY, API_SECRET)
             logging.info("GATE.IO configured for futures trading with leverage support")
             
             if API_KEY and API_SECRET:
@@ -123,33 +141,33 @@ class TradingBot:
         state["pending_signal_direction"] = None
         state["pending_signal_levels"] = None
         
-    def save_state_to_file(self):
+    def save_state_to_file(self, immediate=False):
+        """
+        Queue a state save: calls within STATE_SAVE_COALESCE seconds are merged into one
+        store transaction with only the changed keys (strategy_config lives in its own table)
+        """
         try:
-            # Load existing file to preserve strategy_config
-            try:
-                with open("goldantelopegate_v1.0_state.json", "r") as f:
-                    existing = json.load(f)
-                    strategy_cfg = existing.get('strategy_config', None)
-            except:
-                strategy_cfg = None
-            
-            # Merge state with strategy_config
-            save_data = dict(state)
-            if strategy_cfg:
-                save_data['strategy_config'] = strategy_cfg
-            
-            with open("goldantelopegate_v1.0_state.json", "w") as f:
-                json.dump(save_data, f, default=str, indent=2)
+            state_writer.save(state, immediate=immediate)
         except Exception as e:
             logging.error(f"Save error: {e}")
 
+    def sync_state(self):
+        """Sync state across Gunicorn workers (in-memory snapshot, reloaded only on change)"""
+        global state
+        try:
+            # A save still inside the coalesce window must land first, or the reload brings back pre-trade values
+            state_writer.flush()
+            state = state_watcher.state()
+            state_writer.mark_clean(state)
+        except Exception as e:
+            logging.debug(f"Could not reload state from store: {e}")  # Keep in-memory state
+
     def load_state_from_file(self):
         try:
-            with open("goldantelopegate_v1.0_state.json", "r") as f:
-                data = json.load(f)
-                state.update(data)
-        except:
-            pass
+            state.update(state_store.load_state())
+            state_writer.mark_clean(state)
+        except Exception as e:
+            logging.error(f"Load state error: {e}")
 
     def now(self):
         return datetime.utcnow()
@@ -165,50 +183,114 @@ class TradingBot:
             return f"{base}/USDT:USDT"
         return symbol
 
-    def fetch_ohlcv_tf(self, tf: str, limit=200):
+    def _exchange_fetch(self, ccxt_symbol):
+        """fetch(tf, since, limit) для candle_resampler"""
+        def fetch(tf, since, limit):
+            return self.exchange.fetch_ohlcv(ccxt_symbol, timeframe=tf, since=since, limit=limit)
+        return fetch
+
+    def _ohlcv_df(self, ohlcv):
+        if not ohlcv:
+            return None
+        df = pd.DataFrame(ohlcv)
+        df.columns = ["timestamp", "open", "high", "low", "close", "volume"]
+        df["datetime"] = pd.to_datetime(df["timestamp"], unit="ms")
+        return df
+
+    def fetch_ohlcv_tf(self, tf: str, limit=200, symbol=None):
         """
         Возвращает pd.DataFrame с колонками: timestamp, open, high, low, close, volume
+        Старшие таймфреймы собираются локально из общего 1m потока (candle_resampler)
+        symbol - пара (по умолчанию текущая SYMBOL)
         """
+        symbol = symbol or SYMBOL
         try:
-            if USE_SIMULATOR and self.simulator:
-                ohlcv = self.simulator.fetch_ohlcv(tf, limit=limit)
+            if USE_SIMULATOR:
+                ohlcv = self.exchange.simulator(symbol).fetch_ohlcv(tf, limit=limit)
             else:
-                ccxt_symbol = self.convert_symbol_for_ccxt(SYMBOL)
-                ohlcv = self.exchange.fetch_ohlcv(ccxt_symbol, timeframe=tf, limit=limit)
-            
-            if not ohlcv:
-                return None
-                
-            df = pd.DataFrame(ohlcv)
-            df.columns = ["timestamp", "open", "high", "low", "close", "volume"]
-            df["datetime"] = pd.to_datetime(df["timestamp"], unit="ms")
-            return df
+                ccxt_symbol = self.convert_symbol_for_ccxt(symbol)
+                ohlcv = candle_resampler.get(ccxt_symbol, tf, limit, self._exchange_fetch(ccxt_symbol))
+            return self._ohlcv_df(ohlcv)
         except Exception as e:
             logging.error(f"Error fetching {tf} ohlcv: {e}")
             return None
 
-    def compute_psar(self, df: pd.DataFrame):
+    def fetch_ohlcv_many(self, timeframes, limit=50, symbol=None):
+        """
+        {tf: DataFrame} для нескольких таймфреймов из одного снимка 1m свечей.
+        Таймфреймы загружаются параллельно в fetch_pool; не успевшие за FETCH_TIMEOUT -> None
+        """
+        symbol = symbol or SYMBOL
+        if USE_SIMULATOR:
+            return {tf: self.fetch_ohlcv_tf(tf, limit=limit, symbol=symbol) for tf in timeframes}
+        try:
+            ccxt_symbol = self.convert_symbol_for_ccxt(symbol)
+            snapshot = candle_resampler.get_many(ccxt_symbol, list(timeframes), limit, self._exchange_fetch(ccxt_symbol),
+                                                 executor=fetch_pool, timeout=FETCH_TIMEOUT)
+            return {tf: self._ohlcv_df(snapshot.get(tf)) for tf in timeframes}
+        except Exception as e:
+            logging.error(f"Error fetching ohlcv for {list(timeframes)}: {e}")
+            return {tf: None for tf in timeframes}
+
+    def fetch_candles_for(self, symbol, timeframes, limit=50):
+        """{tf: свечи} любой пары из общего кэша (загрузчик для psar_scanner)"""
+        ccxt_symbol = self.convert_symbol_for_ccxt(symbol)
+        return candle_resampler.get_many(ccxt_symbol, list(timeframes), limit, self._exchange_fetch(ccxt_symbol))
+
+    def start_scanner(self):
+        """Фоновый сканер топ-гейнеров (в симуляторе не нужен: его свечи не должны попасть в общий кэш)"""
+        if not USE_SIMULATOR and self.exchange is not None:
+            psar_scanner.start(self.fetch_candles_for)
+
+    def switch_symbol(self, symbol):
+        """Сменить торгуемую пару: SAR-уровни strategy_loop дальше считаются по ней"""
+        global SYMBOL
+        if symbol == SYMBOL:
+            return
+        logging.info(f"🔄 Switching trading symbol {SYMBOL} -> {symbol}")
+        SYMBOL = symbol
+        if self.app_context is not None:
+            self.app_context['current_trading_symbol'] = symbol
+
+    def compute_psar(self, df: pd.DataFrame, tf: str = None, book: PSARBook = None):
         """
         Возвращает Series с PSAR (последняя точка).
+        Если передан tf - значения берутся из потокового движка (symbol, tf) без пересчета ta.
+        book - набор движков (по умолчанию psar_book стратегии, для графика - chart_psar_book)
         """
         if df is None or len(df) < 5:
             return None
         try:
+            if tf:
+                engine = (book or psar_book).sync(SYMBOL, tf, self._df_candles(df))
+                points = engine.sar_by_timestamp()
+                return pd.Series([points.get(ts, float("nan")) for ts in df["timestamp"].tolist()])
             high_series = pd.Series(df["high"].values)
             low_series = pd.Series(df["low"].values)
             close_series = pd.Series(df["close"].values)
-            psar_ind = PSARIndicator(high=high_series, low=low_series, close=close_series, step=0.05, max_step=0.5)
+            psar_ind = PSARIndicator(high=high_series, low=low_series, close=close_series, step=PSAR_STEP, max_step=PSAR_MAX_STEP)
             psar = psar_ind.psar()
             return psar
         except Exception as e:
             logging.error(f"PSAR compute error: {e}")
             return None
 
-    def get_direction_from_psar(self, df: pd.DataFrame):
+    def _df_candles(self, df: pd.DataFrame):
+        """DataFrame из fetch_ohlcv_tf -> список [timestamp, open, high, low, close]"""
+        return df[["timestamp", "open", "high", "low", "close"]].values.tolist()
+
+    def get_direction_from_psar(self, df: pd.DataFrame, tf: str = None, symbol: str = None):
         """
         Возвращает направление 'long' или 'short' на основе сравнения последней close и psar
+        Если передан tf - O(1) обновление потокового PSAR (symbol или SYMBOL, tf) вместо полного пересчета окна
         """
         try:
+            if tf:
+                if df is None or len(df) < 5:
+                    return None
+                engine = psar_book.sync(symbol or SYMBOL, tf, self._df_candles(df))
+                return engine.direction()
+
             psar = self.compute_psar(df)
             if psar is None or len(psar) == 0:
                 return None
@@ -227,11 +309,12 @@ class TradingBot:
     def get_current_directions(self):
         """Get current PSAR directions for all timeframes"""
         directions = {}
+        frames = self.fetch_ohlcv_many(TIMEFRAMES.keys(), limit=50)
         for tf in TIMEFRAMES.keys():
             try:
-                df = self.fetch_ohlcv_tf(tf, limit=50)
+                df = frames.get(tf)
                 if df is not None and len(df) >= 5:
-                    direction = self.get_direction_from_psar(df)
+                    direction = self.get_direction_from_psar(df, tf)
                     directions[tf] = direction if direction else None
                 else:
                     directions[tf] = None
@@ -253,20 +336,11 @@ class TradingBot:
             logging.warning(f"❌ Invalid price: {price}")
             return 0.0, 0.0
         
-        # Get contract size from exchange
+        # Get contract size from the contract index (O(1), no load_markets)
         contract_size = 10000.0  # ✅ Gate.io standard contract size
-        try:
-            if self.exchange and symbol:
-                ccxt_symbol = self.convert_symbol_for_ccxt(symbol)
-                if ccxt_symbol not in self.exchange.markets:
-                    self.exchange.load_markets()
-                if ccxt_symbol in self.exchange.markets:
-                    market = self.exchange.markets[ccxt_symbol]
-                    contract_size = float(market.get('contractSize', 10000.0))
-                    logging.info(f"📊 Contract size for {symbol}: {contract_size}")
-        except Exception as e:
-            logging.warning(f"Could not get contract size: {e}")
-            contract_size = 10000.0
+        if symbol:
+            contract_size = self.get_contract_size(symbol)
+            logging.info(f"📊 Contract size for {symbol}: {contract_size}")
         
         # Notional = balance × leverage (total position value in USDT)
         notional = balance * POSITION_PERCENT * LEVERAGE
@@ -290,63 +364,39 @@ class TradingBot:
         return contracts, actual_notional
 
     def get_current_price(self):
-        """Get current price from exchange or simulator"""
-        if USE_SIMULATOR and self.simulator:
-            return self.simulator.get_current_price()
+        """Get current price from the shared price book (no network) or simulator"""
+        if USE_SIMULATOR:
+            return self.exchange.price(SYMBOL)
         else:
-            try:
-                ticker = self.exchange.fetch_ticker(SYMBOL)
-                price = ticker['last']
-                return price if price and price > 0 else 3000.0
-            except Exception as e:
-                logging.error(f"Error fetching price: {e}")
+            price = price_book.get(SYMBOL)
+            if price is None:
+                logging.debug(f"No fresh price for {SYMBOL} in price book (age={price_book.age(SYMBOL)})")
                 return 3000.0
+            return price
 
     def get_price_for_symbol(self, symbol):
-        """Get current price for ANY symbol (not just SYMBOL)"""
+        """Get current price for ANY symbol (not just SYMBOL) - O(1) price book lookup"""
         if not symbol:
             return self.get_current_price()
-        if USE_SIMULATOR and self.simulator:
-            return self.simulator.get_current_price()
+        if USE_SIMULATOR:
+            return self.exchange.price(symbol)
         else:
-            try:
-                # Convert FHE_USDT to FHE/USDT:USDT format for ccxt
-                if '_' in symbol and ':' not in symbol:
-                    parts = symbol.split('_')
-                    ccxt_symbol = f"{parts[0]}/{parts[1]}:{parts[1]}"
-                else:
-                    ccxt_symbol = symbol
-                
-                ticker = self.exchange.fetch_ticker(ccxt_symbol)
-                price = ticker['last']
-                if price and price > 0:
-                    return price
-                else:
-                    # Fallback: return entry_price from position if available
-                    pos = state.get("position", {})
-                    return pos.get("entry_price", 0.01)
-            except Exception as e:
-                logging.error(f"Error fetching price for {symbol}: {e}")
-                # Fallback: return entry_price from position (NOT 3000!)
-                pos = state.get("position", {})
-                return pos.get("entry_price", 0.01)
+            price = price_book.get(symbol)
+            if price is not None:
+                return price
+            logging.warning(f"No fresh price for {symbol} in price book (age={price_book.age(symbol)})")
+            # Fallback: return entry_price from position (NOT 3000!)
+            pos = state.get("position") or {}
+            return pos.get("entry_price", 0.01)
 
     def get_contract_size(self, symbol=None):
-        """Get contract size for a symbol from exchange or use default"""
+        """Get contract size for a symbol from the contract index or use default"""
         default_size = 10000.0  # Gate.io standard for most contracts
         if not symbol:
             return default_size
-        try:
-            if self.exchange:
-                ccxt_symbol = self.convert_symbol_for_ccxt(symbol)
-                if ccxt_symbol not in self.exchange.markets:
-                    self.exchange.load_markets()
-                if ccxt_symbol in self.exchange.markets:
-                    market = self.exchange.markets[ccxt_symbol]
-                    return float(market.get('contractSize', default_size))
-        except Exception as e:
-            logging.debug(f"Could not get contract size for {symbol}: {e}")
-        return default_size
+        if USE_SIMULATOR:
+            return self.exchange.market(symbol)['contractSize']
+        return contract_index.contract_size(symbol, default_size)
 
     def calculate_unrealized_pnl(self):
         """Рассчитать нереализованный P&L для открытой позиции
@@ -408,12 +458,14 @@ class TradingBot:
         
         return round(unrealized_pnl, 4)
 
-    def place_market_order(self, side: str, amount_base: float, price_override: float = None, notional_amount: float = None):
+    def place_market_order(self, side: str, amount_base: float, price_override: float = None, notional_amount: float = None,
+                           symbol: str = None):
         """
         side: 'buy' или 'sell' (для открытия позиции)
         amount_base: количество в базовой валюте (ETH)
         price_override: опциональная цена для установки (используется для TOP 1 гейнера)
         notional_amount: маржин-требование (если не передано, вычисляется как amount_base * price)
+        symbol: пара реальной заявки (по умолчанию текущая SYMBOL)
         """
         logging.info(f"[{self.now()}] PLACE MARKET ORDER -> side={side}, amount={amount_base:.6f}")
         
@@ -425,7 +477,7 @@ class TradingBot:
         # ✅ USE STATE DICT (shared across all Gunicorn workers!)
         shared_state = get_state()
         api_connected = shared_state.get('api_connected', False)
-        use_paper = not api_connected  # Paper mode when state['api_connected']=FALSE
+        use_paper = not api_connected and not USE_SIMULATOR  # Paper mode when state['api_connected']=FALSE (simulator trades on its exchange)
         
         # ✅ CRITICAL: Block if available balance is invalid
         available = shared_state.get('available', 0)
@@ -451,20 +503,12 @@ class TradingBot:
             notional = notional_amount if notional_amount is not None else (amount_base * entry_price)
             margin = notional / LEVERAGE
             
-            state["available"] -= margin  # Deduct margin from available
-            
             close_time_seconds = random.randint(MIN_RANDOM_TRADE_SECONDS, MAX_RANDOM_TRADE_SECONDS)
+            trade_number = state.get("telegram_trade_counter", 0) + 1
             
-            if "telegram_trade_counter" not in state:
-                state["telegram_trade_counter"] = 1
-            else:
-                state["telegram_trade_counter"] += 1
-            trade_number = state["telegram_trade_counter"]
-            
-            state["in_position"] = True
             # Get TOP1 pair from top1_entry, fall back to SYMBOL if not available
             position_symbol = state.get("top1_entry", {}).get("pair", SYMBOL)
-            state["position"] = {
+            position = {
                 "position_id": str(uuid.uuid4()),  # Unique position ID for timer tracking
                 "symbol": position_symbol,  # Position MUST be in TOP1 pair that was current at entry
                 "side": "long" if side == "buy" else "short",
@@ -477,22 +521,27 @@ class TradingBot:
                 "trade_number": trade_number,
                 "top1_entry": state.get("top1_entry", {})
             }
+            
+            # ✅ COMPARE-AND-SET: only one worker can open a position
+            if not state_store.open_position(position):
+                logging.warning("❌ BLOCKED: Position already opened by another worker")
+                state["in_position"], state["position"] = state_store.get_position()
+                return None
+            
+            state["available"] -= margin  # Deduct margin from available
+            state["telegram_trade_counter"] = trade_number
+            state["in_position"] = True
+            state["position"] = position
             state["last_trade_time"] = entry_time.isoformat()
             
-            # ✅ SAVE STATE TO FILE - ensure all workers see the update
+            # ✅ SAVE STATE - ensure all workers see the update
             self.save_state_to_file()
             
             logging.info(f"Position opened with random close time: {close_time_seconds}s ({close_time_seconds/60:.1f} minutes)")
             
-            # ✅ ANTI-DUPLICATE: Only send TG if this trade wasn't already opened by another worker
-            position_id = state["position"]["position_id"]
-            last_opened_id = state.get("last_tg_open_position_id", "")
-            if self.notifier and position_id != last_opened_id:
-                state["last_tg_open_position_id"] = position_id
-                self.save_state_to_file()  # Save BEFORE sending to prevent race condition
+            # ✅ Only the worker that won open_position() gets here - no duplicate TG
+            if self.notifier:
                 self.notifier.send_position_opened(state["position"], price, trade_number, state["balance"], position_symbol)
-            elif position_id == last_opened_id:
-                logging.info(f"⚠️ TG notification already sent for open position {position_id[:8]} - skipping duplicate")
             
             if state["position"]["side"] == "long":
                 self.signal_sender.send_open_long()
@@ -501,13 +550,17 @@ class TradingBot:
             
             return state["position"]
         else:
+            if state_store.get_position()[0]:
+                logging.warning("❌ BLOCKED: State store already holds an open position")
+                return None
+            order_symbol = symbol or SYMBOL
             try:
                 try:
-                    self.exchange.set_leverage(LEVERAGE, SYMBOL)
+                    self.exchange.set_leverage(LEVERAGE, order_symbol)
                 except Exception as e:
                     logging.error(f"set_leverage failed: {e}")
 
-                order = self.exchange.create_market_buy_order(SYMBOL, amount_base) if side == "buy" else self.exchange.create_market_sell_order(SYMBOL, amount_base)
+                order = self.exchange.create_market_buy_order(order_symbol, amount_base) if side == "buy" else self.exchange.create_market_sell_order(order_symbol, amount_base)
                 logging.info(f"Order response: {order}")
                 
                 entry_price = float(order.get("average", order.get("price", self.get_current_price())))
@@ -515,14 +568,17 @@ class TradingBot:
                 notional = amount_base * entry_price
                 margin = notional / LEVERAGE
                 
-                state["available"] -= margin
+                if USE_SIMULATOR:
+                    state["available"] = float(self.exchange.fetch_balance()['USDT']['free'])  # Маржа и комиссия уже списаны
+                else:
+                    state["available"] -= margin
                 
                 close_time_seconds = random.randint(MIN_RANDOM_TRADE_SECONDS, MAX_RANDOM_TRADE_SECONDS)
                 
                 state["in_position"] = True
                 state["position"] = {
                     "position_id": str(uuid.uuid4()),  # Unique position ID for timer tracking
-                    "symbol": SYMBOL,  # ✅ FIX: Always save trading symbol
+                    "symbol": order_symbol,  # ✅ FIX: Always save trading symbol
                     "side": "long" if side == "buy" else "short",
                     "entry_price": entry_price,
                     "size_base": amount_base,
@@ -534,7 +590,9 @@ class TradingBot:
                 }
                 state["last_trade_time"] = entry_time.isoformat()
                 
-                # CRITICAL: Save state immediately to sync all workers
+                # CRITICAL: Record the position atomically, then save state to sync all workers
+                if not state_store.open_position(state["position"]):
+                    logging.error("⚠️ Real order filled but another worker recorded a position first")
                 self.save_state_to_file()
                 
                 logging.info(f"Position opened with random close time: {close_time_seconds}s ({close_time_seconds/60:.1f} minutes)")
@@ -553,28 +611,19 @@ class TradingBot:
         # ✅ CRITICAL: Immediately mark position as closed to prevent race conditions
         position_id = state["position"].get("position_id", "")
         
-        # Check if already being closed or was closed
-        if state.get("closing_position_id") == position_id:
-            logging.warning(f"⚠️ Position {position_id[:8]} already being closed - skipping duplicate")
+        # ✅ LOCK: Claim the close in the state store BEFORE any work (fails if another worker
+        # is closing it or it is already closed)
+        if not state_store.begin_close(position_id):
+            logging.warning(f"⚠️ Position {position_id[:8]} already closed or being closed - skipping duplicate")
+            state["in_position"], state["position"] = state_store.get_position()
             return None
         
-        # Check if this position was already closed (in trades history)
-        for trade in state.get("trades", []):
-            if trade.get("position_id") == position_id:
-                logging.warning(f"⚠️ Position {position_id[:8]} already in trades history - skipping duplicate close")
-                state["in_position"] = False
-                state["position"] = None
-                self.save_state_to_file()
-                return None
-        
-        # ✅ LOCK: Mark this position as being closed BEFORE any work
-        state["closing_position_id"] = position_id
-        self.save_state_to_file()  # Save lock state immediately
-        
         pos = state["position"]
         position_symbol = pos.get("symbol", SYMBOL)
         size = float(pos["size_base"])
         
+        exchange_balance = None
+        
         # ✅ REAL TRADING: Close position on Gate.io exchange
         try:
             # Get real position from exchange
@@ -608,11 +657,16 @@ class TradingBot:
                 # Get actual PnL from the closed position
                 exit_price = float(order.get('average', real_pos.get('markPrice', 0)))
                 pnl = float(real_pos.get('unrealizedPnl', 0))
+                if USE_SIMULATOR:
+                    # Симулятор списывает комиссии и проскальзывание: баланс - из его кассы, а не state + PnL
+                    pnl -= float((order.get('fee') or {}).get('cost') or 0)
+                    exchange_balance = float(self.exchange.fetch_balance()['USDT']['total'])
             else:
                 logging.warning(f"⚠️ No real position found on exchange for {position_symbol}")
                 # Ghost position - clear state and return early
                 if not pos.get("entry_price"):
                     logging.info("🔄 Clearing ghost position (no entry_price)")
+                    state_store.clear_position(position_id)
                     state["in_position"] = False
                     state["position"] = None
                     self.save_state_to_file()
@@ -630,6 +684,7 @@ class TradingBot:
             # Fallback to virtual close - check for ghost position
             if not pos.get("entry_price"):
                 logging.info("🔄 Clearing ghost position in fallback (no entry_price)")
+                state_store.clear_position(position_id)
                 state["in_position"] = False
                 state["position"] = None
                 self.save_state_to_file()
@@ -675,11 +730,19 @@ class TradingBot:
             "close_reason": close_reason
         }
         
-        state["balance"] += pnl
+        balance = exchange_balance if exchange_balance is not None else state["balance"] + pnl
         # ✅ SAFETY: Prevent negative balance
-        if state["balance"] < 0:
-            logging.warning(f"⚠️ Negative balance detected: ${state['balance']:.2f}, resetting to $0")
-            state["balance"] = 0
+        if balance < 0:
+            logging.warning(f"⚠️ Negative balance detected: ${balance:.2f}, resetting to $0")
+            balance = 0
+        
+        # ✅ COMPARE-AND-SET: close the position, record the trade and balance in one transaction
+        if not state_store.finish_close(position_id, trade_record, balance=balance, available=balance):
+            logging.warning(f"⚠️ Position {position_id[:8]} was closed by another worker - skipping duplicate")
+            state["in_position"], state["position"] = state_store.get_position()
+            return None
+        
+        state["balance"] = balance
         margin_released = pos.get("margin", pos["notional"] / LEVERAGE)
         state["available"] = state["balance"]  # When no position: available = balance
         logging.info(f"✅ Position closed - balance=${state['balance']:.2f}, available=${state['available']:.2f}")
@@ -692,14 +755,9 @@ class TradingBot:
         trade_number = pos.get("trade_number", state.get("telegram_trade_counter", 1))
         position_id = pos.get("position_id", "")
         
-        # ✅ ANTI-DUPLICATE: Only send TG if this position wasn't already closed by another worker
-        last_closed_id = state.get("last_tg_close_position_id", "")
-        if self.notifier and position_id and position_id != last_closed_id:
-            state["last_tg_close_position_id"] = position_id
-            self.save_state_to_file()  # Save BEFORE sending to prevent race condition
+        # ✅ Only the worker that won finish_close() gets here - no duplicate TG
+        if self.notifier and position_id:
             self.notifier.send_position_closed(trade_record, trade_number, state["balance"], trade_record.get("symbol", SYMBOL))
-        elif position_id == last_closed_id:
-            logging.info(f"⚠️ TG notification already sent for position {position_id[:8]} - skipping duplicate")
         
         if pos["side"] == "long":
             self.signal_sender.send_close_long()
@@ -708,7 +766,6 @@ class TradingBot:
         
         state["in_position"] = False
         state["position"] = None
-        state["closing_position_id"] = None  # ✅ Clear the lock after successful close
         state["last_position_close_time"] = time.time()
         logging.info(f"⏳ 20-second cooldown started before next trade")
         
@@ -736,7 +793,7 @@ class TradingBot:
             if df is None or len(df) < 5:
                 logging.warning("Could not fetch 1m OHLCV data - using default LONG")
                 return "long"
-            direction = self.get_direction_from_psar(df)
+            direction = self.get_direction_from_psar(df, "1m")
             logging.debug(f"1m direction determined: {direction}")
             return direction
         except Exception as e:
@@ -750,7 +807,7 @@ class TradingBot:
             if df is None or len(df) < 5:
                 logging.warning("Could not fetch 5m OHLCV data - using default LONG")
                 return "long"
-            direction = self.get_direction_from_psar(df)
+            direction = self.get_direction_from_psar(df, "5m")
             logging.debug(f"5m direction determined: {direction}")
             return direction
         except Exception as e:
@@ -764,7 +821,7 @@ class TradingBot:
             if df is None or len(df) < 5:
                 logging.warning("Could not fetch 15m OHLCV data - using default LONG")
                 return "long"
-            direction = self.get_direction_from_psar(df)
+            direction = self.get_direction_from_psar(df, "15m")
             logging.debug(f"15m direction determined: {direction}")
             return direction
         except Exception as e:
@@ -778,7 +835,7 @@ class TradingBot:
             if df is None or len(df) < 5:
                 logging.warning("Could not fetch 30m OHLCV data - using default LONG")
                 return "long"
-            direction = self.get_direction_from_psar(df)
+            direction = self.get_direction_from_psar(df, "30m")
             logging.debug(f"30m direction determined: {direction}")
             return direction
         except Exception as e:
@@ -792,7 +849,7 @@ class TradingBot:
             if df is None or len(df) < 5:
                 logging.warning("Could not fetch 1h OHLCV data - using default LONG")
                 return "long"
-            direction = self.get_direction_from_psar(df)
+            direction = self.get_direction_from_psar(df, "1h")
             logging.debug(f"1h direction determined: {direction}")
             return direction
         except Exception as e:
@@ -816,15 +873,54 @@ class TradingBot:
             logging.warning(f"Unknown timeframe: {timeframe}")
             return "long"
     
+    def get_directions(self, levels, symbol=None):
+        """
+        Directions for several levels fetched concurrently from one candle snapshot.
+        Levels whose data did not arrive in time are left out (partial result) -
+        the caller keeps their last known direction and retries them next cycle.
+        symbol defaults to the traded SYMBOL.
+        """
+        started = time.time()
+        levels = [level.lower() for level in levels]
+        frames = self.fetch_ohlcv_many(levels, limit=50, symbol=symbol)
+        directions = {}
+        for level in levels:
+            df = frames.get(level)
+            if df is None or len(df) < 5:
+                logging.warning(f"Could not fetch {level} OHLCV data - keeping last known direction")
+                continue
+            directions[level] = self.get_direction_from_psar(df, level, symbol)
+        duration = time.time() - started
+        missing = [level for level in levels if level not in directions]
+        self.scheduler.record_cycle(duration, directions.keys(), missing)
+        logging.info(f"⏱️ Levels {levels} evaluated in {duration * 1000:.0f}ms" + (f", missing: {missing}" if missing else ""))
+        return directions
+
+    def on_stream_tick(self, kind, symbol, data):
+        """
+        Listener for market_stream: a live price that crosses the in-progress SAR
+        of any strategy level wakes strategy_loop immediately instead of waiting
+        for the level's next scheduled check.
+        """
+        if USE_SIMULATOR or normalize_symbol(symbol) != normalize_symbol(SYMBOL):
+            return
+        price = data if kind == "ticker" else data[4]
+        for level in self.scheduler.levels:
+            engine = psar_book.engine(SYMBOL, level)
+            if engine.last_sar is None:
+                continue
+            direction = engine.direction()
+            if (direction == "long" and price < engine.last_sar) or (direction == "short" and price > engine.last_sar):
+                logging.info(f"⚡ {SYMBOL} {price} crossed {level} SAR {engine.last_sar:.6f} - re-checking levels")
+                self.scheduler.trigger()
+                return
+
     def get_strategy_config(self):
-        """Get strategy config from FILE (not app_context) to sync across workers"""
+        """Get strategy config from the state store (not app_context) to sync across workers"""
         try:
-            with open("goldantelopegate_v1.0_state.json", "r") as f:
-                saved_state = json.load(f)
-                if "strategy_config" in saved_state:
-                    return saved_state["strategy_config"]
+            return state_watcher.strategy_config()
         except Exception as e:
-            logging.debug(f"Could not load strategy from file: {e}")
+            logging.debug(f"Could not load strategy from state store: {e}")
         return {'open_levels': ['5m', '30m'], 'close_levels': ['5m']}
 
     def strategy_loop(self, should_continue=None):
@@ -837,75 +933,82 @@ class TradingBot:
         logging.info(f"🎯 Strategy CLOSE on levels: {close_levels}")
         
         last_level_directions = {}
-        direction_check_interval = 5
-        last_direction_check = 0
+        known_directions = {}
+        last_reconcile = 0
+        self.scheduler.set_levels(open_levels + close_levels)
         
         while True:
-            if should_continue and not should_continue():
+            # ✅ Sleep until a level's candle closes, its live re-check is due or scheduler.trigger()
+            if not self.scheduler.wait(should_continue):
                 logging.info("Strategy loop stopped by external signal")
                 break
             
+            current_time = time.time()
+            due_levels = self.scheduler.due_levels(current_time)
+            checked_levels = due_levels
             try:
-                current_time = time.time()
                 
-                # ✅ CRITICAL FIX: Always re-read state from FILE to sync across Gunicorn workers
-                global state
-                try:
-                    with open("goldantelopegate_v1.0_state.json", "r") as f:
-                        state = json.load(f)
-                except:
-                    pass  # Keep in-memory state if file read fails
+                # ✅ CRITICAL FIX: Sync state across Gunicorn workers
+                self.sync_state()
                 
                 # ✅ RECONCILIATION: Sync state with real exchange positions
                 # CRITICAL: Only reconcile in REAL mode (api_connected=True)
                 # In DEMO mode, positions are virtual and should NOT be cleared
+                # In simulator mode every worker has its own SimulatedExchange - nothing to reconcile against
                 api_connected = state.get('api_connected', False)
                 
-                try:
-                    real_positions = self.exchange.fetch_positions()
-                    has_real_position = any(float(p.get('contracts', 0)) != 0 for p in real_positions)
+                if not USE_SIMULATOR and current_time - last_reconcile >= RECONCILE_INTERVAL:
+                    try:
+                        last_reconcile = current_time
+                        real_positions = self.exchange.fetch_positions()
+                        has_real_position = any(float(p.get('contracts', 0)) != 0 for p in real_positions)
                     
-                    if state.get('in_position') and not has_real_position and api_connected:
-                        # State says in position but no real position - clear ghost (ONLY IN REAL MODE)
-                        logging.info("🔄 RECONCILE: Clearing ghost position (state=True, exchange=None) [REAL MODE]")
-                        state['in_position'] = False
-                        state['position'] = None
-                        state['position_open_levels_directions'] = {}
-                        self.save_state_to_file()
-                    elif has_real_position and (not state.get('in_position') or state.get('position') is None):
-                        # Real position exists but state says not in position OR position data is None - sync
-                        logging.info("🔄 RECONCILE: Syncing real position to state (in_position or position missing)")
-                        for p in real_positions:
-                            if float(p.get('contracts', 0)) != 0:
-                                state['in_position'] = True
-                                state['position'] = {
-                                    'position_id': str(uuid.uuid4()),
-                                    'symbol': p['symbol'].split(':')[0].replace('/', '_'),
-                                    'side': p.get('side', 'long'),
-                                    'size_base': float(p.get('contracts', 0)),
-                                    'entry_price': float(p.get('entryPrice', 0)),
-                                    'entry_time': datetime.utcnow().isoformat(),
-                                    'notional': float(p.get('notional', 0)),
-                                    'margin': float(p.get('collateral', 0))
-                                }
-                                logging.info(f"🔄 RECONCILE: Position synced - {state['position']['symbol']} {state['position']['side']} {state['position']['size_base']} contracts")
-                                self.save_state_to_file()
-                                break
-                except Exception as e:
-                    logging.debug(f"Reconciliation check failed: {e}")
+                        if state.get('in_position') and not has_real_position and api_connected:
+                            # State says in position but no real position - clear ghost (ONLY IN REAL MODE)
+                            logging.info("🔄 RECONCILE: Clearing ghost position (state=True, exchange=None) [REAL MODE]")
+                            state['in_position'] = False
+                            state['position'] = None
+                            state['position_open_levels_directions'] = {}
+                            self.save_state_to_file()
+                        elif has_real_position and (not state.get('in_position') or state.get('position') is None):
+                            # Real position exists but state says not in position OR position data is None - sync
+                            logging.info("🔄 RECONCILE: Syncing real position to state (in_position or position missing)")
+                            for p in real_positions:
+                                if float(p.get('contracts', 0)) != 0:
+                                    state['in_position'] = True
+                                    state['position'] = {
+                                        'position_id': str(uuid.uuid4()),
+                                        'symbol': p['symbol'].split(':')[0].replace('/', '_'),
+                                        'side': p.get('side', 'long'),
+                                        'size_base': float(p.get('contracts', 0)),
+                                        'entry_price': float(p.get('entryPrice', 0)),
+                                        'entry_time': datetime.utcnow().isoformat(),
+                                        'notional': float(p.get('notional', 0)),
+                                        'margin': float(p.get('collateral', 0))
+                                    }
+                                    logging.info(f"🔄 RECONCILE: Position synced - {state['position']['symbol']} {state['position']['side']} {state['position']['size_base']} contracts")
+                                    self.save_state_to_file()
+                                    break
+                    except Exception as e:
+                        logging.debug(f"Reconciliation check failed: {e}")
                 
-                if current_time - last_direction_check >= direction_check_interval:
-                    config = self.get_strategy_config()
-                    open_levels = config.get('open_levels', ['5m', '30m'])
-                    close_levels = config.get('close_levels', ['5m'])
-                    
-                    # Get current directions for all levels
-                    current_directions = {}
-                    for level in set(open_levels + close_levels):
-                        current_directions[level] = self.get_direction(level)
+                config = self.get_strategy_config()
+                open_levels = config.get('open_levels', ['5m', '30m'])
+                close_levels = config.get('close_levels', ['5m'])
+                if set(open_levels + close_levels) != set(self.scheduler.levels):
+                    self.scheduler.set_levels(open_levels + close_levels)
+                    due_levels = self.scheduler.due_levels(current_time)
+                    checked_levels = due_levels
+                
+                if due_levels:
+                    # ✅ Recompute only levels whose data can have changed, reuse the rest
+                    fresh_directions = self.get_directions(due_levels)
+                    known_directions.update(fresh_directions)
+                    checked_levels = list(fresh_directions)
+                    current_directions = {level: known_directions.get(level) for level in set(open_levels + close_levels)}
                     
-                    level_str = ", ".join([f"{k}:{v.upper()}" for k, v in current_directions.items()])
-                    logging.info(f"SAR Levels: {level_str}")
+                    level_str = ", ".join([f"{k}:{str(v).upper()}" for k, v in current_directions.items()])
+                    logging.info(f"SAR Levels: {level_str} (checked: {sorted(due_levels)})")
                     logging.info(f"🔍 in_position={state.get('in_position')}, last_close={state.get('last_position_close_time')}")
                     
                     # Initialize last_level_directions on first run
@@ -971,6 +1074,19 @@ class TradingBot:
                     # Check if ALL open_levels aligned -> OPEN position
                     # Auto strategy works both in virtual and LIVE mode when API connected
                     logging.info(f"🔍 ENTERING OPEN CHECK: in_position={state.get('in_position')}")
+                    scanned = None
+                    traded_directions = current_directions
+                    if not state["in_position"] and psar_scanner.is_fresh():
+                        # ✅ Symbol selection + SAR check in one lookup: first top gainer with all open_levels aligned
+                        scanned = psar_scanner.pick(open_levels)
+                        if scanned:
+                            # Scanner directions can be a full scan old: re-check the picked pair before deciding
+                            picked_directions = self.get_directions(set(open_levels + close_levels), symbol=scanned[0])
+                            current_directions = {level: picked_directions.get(level) for level in set(open_levels + close_levels)}
+                            logging.info(f"🛰️ SCAN PICK: {scanned[0]} {scanned[1].upper()} on {open_levels}, re-checked: {current_directions}")
+                        else:
+                            current_directions = {level: None for level in open_levels}
+                            logging.info(f"🛰️ SCAN: no top gainer has {open_levels} aligned")
                     if not state["in_position"]:
                         # CRITICAL: Validate all levels exist and have valid direction (not None)
                         valid_levels = all(level in current_directions and current_directions[level] in ['long', 'short'] for level in open_levels)
@@ -1027,8 +1143,13 @@ class TradingBot:
                                         
                                         # ✅ CRITICAL FIX: Get price from TOP1 gainer, not self.SYMBOL
                                         from app import top_gainers_cache
-                                        top1_symbol = SYMBOL  # Default to current symbol
-                                        if top_gainers_cache['data'] and len(top_gainers_cache['data']) > 0:
+                                        top1_symbol = scanned[0] if scanned else SYMBOL  # Default to current symbol
+                                        if scanned:
+                                            # Scanner picked SYMBOL - trade the pair whose SAR levels were checked
+                                            price = self.get_price_for_symbol(top1_symbol)
+                                            state["current_top1"] = {"pair": top1_symbol, "price": price}
+                                            logging.info(f"📊 Using scanned pair price: {top1_symbol} @ ${price}")
+                                        elif top_gainers_cache['data'] and len(top_gainers_cache['data']) > 0:
                                             top1_fresh = top_gainers_cache['data'][0]
                                             top1_symbol = top1_fresh.get('symbol', SYMBOL)
                                             price = float(top1_fresh.get('price', 0))
@@ -1044,9 +1165,15 @@ class TradingBot:
                                         shared_state = get_state()
                                         balance_for_order = shared_state["available"]
                                         amount, notional = self.compute_order_size_usdt(balance_for_order, price, top1_symbol)
-                                        order_result = self.place_market_order(trade_side, amount, price_override=price, notional_amount=notional)
+                                        order_result = self.place_market_order(trade_side, amount, price_override=price, notional_amount=notional,
+                                                                               symbol=top1_symbol if scanned else None)
                                         # ✅ CRITICAL: Only set in_position=True if order succeeded (not None)
                                         if order_result is not None:
+                                            if scanned:
+                                                # Position is on the picked pair: its levels are tracked from now on
+                                                self.switch_symbol(scanned[0])
+                                                known_directions = dict(current_directions)
+                                                traded_directions = current_directions
                                             state["in_position"] = True
                                             state["position_open_price"] = price
                                             state["position_open_time"] = current_time
@@ -1055,10 +1182,13 @@ class TradingBot:
                                         else:
                                             logging.warning(f"❌ ORDER FAILED: Position NOT opened (order returned None)")
                     
-                    last_level_directions = current_directions.copy()
-                    last_direction_check = current_time
+                    last_level_directions = traded_directions.copy()
+                elif not self.scheduler.levels:
+                    time.sleep(self.scheduler.min_live_interval)  # Нет уровней в конфиге
                 
             except Exception as e:
                 logging.error(f"Strategy loop error: {e}", exc_info=True)
-            
-            time.sleep(5)
+            finally:
+                # Levels that timed out are retried after a short delay, not on the next candle
+                self.scheduler.mark_checked(checked_levels, current_time)
+                self.scheduler.defer([level for level in due_levels if level not in checked_levels], current_time)
@@ -0,0 +1,73 @@
+"""
+Локальная подмена Gate.io futures WebSocket для проверки market_stream.
+
+Проигрывает кадры, записанные MarketStream(record_path=...) (JSONL, один
+кадр на строку), каждому подключившемуся клиенту после его первой подписки.
+Паузы между кадрами берутся из поля time (сек) и делятся на --speed.
+
+    python ws_replay.py frames.jsonl --port 8765 --speed 10
+    GATE_WS_URL=ws://127.0.0.1:8765/v4/ws/usdt python app.py
+"""
+import json
+import asyncio
+import argparse
+import logging
+
+from aiohttp import web, WSMsgType
+
+
+def load_frames(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def replay(ws, frames, speed, drop_after=None):
+    """Отправить кадры с исходными паузами; drop_after - оборвать соединение после N кадров"""
+    prev_time = None
+    for i, frame in enumerate(frames):
+        if drop_after is not None and i >= drop_after:
+            await ws.close()
+            return
+        frame_time = frame.get("time")
+        if prev_time is not None and frame_time and speed > 0:
+            await asyncio.sleep(max(0, frame_time - prev_time) / speed)
+        prev_time = frame_time or prev_time
+        await ws.send_str(json.dumps(frame))
+
+
+def make_app(frames, speed=1.0, drop_after=None, path="/v4/ws/usdt"):
+    async def handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        task = None
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            request_frame = json.loads(msg.data)
+            channel = request_frame.get("channel")
+            event = request_frame.get("event")
+            if channel == "futures.ping":
+                await ws.send_json({"channel": "futures.pong", "result": None})
+            elif event in ("subscribe", "unsubscribe"):
+                await ws.send_json({"channel": channel, "event": event, "error": None,
+                                    "result": {"status": "success"}})
+                if task is None and event == "subscribe":
+                    task = asyncio.ensure_future(replay(ws, frames, speed, drop_after))
+        if task is not None:
+            task.cancel()
+        return ws
+
+    app = web.Application()
+    app.router.add_get(path, handler)
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Replay recorded Gate.io WS frames")
+    parser.add_argument("frames", help="JSONL file recorded via GATE_WS_RECORD")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier (0 - no pauses)")
+    parser.add_argument("--drop-after", type=int, default=None, help="Close connection after N frames")
+    args = parser.parse_args()
+    web.run_app(make_app(load_frames(args.frames), args.speed, args.drop_after), port=args.port)